@@ -33,7 +33,7 @@
 # ### 2. Ants moving via probability
 # Then for each of the ants we complete a closed path i.e. from start, covering all the nodes and without repeating any of the nodes. To move an ant from one node to the next we use the following formula.
 # 
-# $$P_{ij}(t)=\frac{\tau_{ij}^\alpha + \eta_{ij}^\beta}{\sum (\tau^\alpha + \eta^\beta)} $$
+# $$P_{ij}(t)=\frac{\tau_{ij}^\alpha \eta_{ij}^\beta}{\sum \tau^\alpha \eta^\beta} $$
 # 
 # Where $\tau$ (*tau*) is the amount of pheromones and $\eta$ (*eta*) is the inverse of the distance ($1/d$).
 # 
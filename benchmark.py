@@ -0,0 +1,371 @@
+# Import
+from library import *
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import platform
+import re
+import time
+
+# Unix only, peak memory of the worker process
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Known optimum distances of the bundled TSPLIB instances
+OPTIMA = {'berlin52': 7542, 'kroA100': 21282}
+
+# Instances of the default sweep, bundled ones first then synthetic ones ('rand' and the number of nodes)
+INSTANCES = ('berlin52', 'kroA100', 'rand500', 'rand1000', 'rand2000')
+
+# Named solver configurations, runAcoTsp keyword arguments
+CONFIGS = {
+    'as': {'variant': 'as'},
+    'acs-candidates': {'variant': 'acs', 'candidates': 20},
+    'mmas-2opt': {'variant': 'mmas', 'candidates': 20, 'local_search': '2-opt'}
+}
+
+# Result columns, in the order of the CSV file
+COLUMNS = (
+    'instance', 'nodes', 'config', 'repeat', 'seed', 'iterations', 'colony', 'wall_time', 'first_iteration_time',
+    'iterations_per_second', 'tours_per_second', 'peak_memory_mb', 'distance', 'optimum', 'gap'
+)
+
+# Node ranges of the batch benchmark, random sizes within each, the last one mixed
+BATCH_RANGES = ((20, 50), (50, 100), (100, 200), (20, 200))
+
+# Compared metrics and whether higher is better
+METRICS = {'wall_time': False, 'iterations_per_second': True, 'tours_per_second': True, 'peak_memory_mb': False,
+           'distance': False}
+
+"""
+    Run benchmark - Run every configuration on every instance, each run in a fresh process so timings and peak memory
+    do not depend on the previous runs, warmed up first so they do not include loading the compiled kernels either
+    @arg
+        {list} instances {INSTANCES}    -- Instance names, bundled in /data or synthetic ('rand' and the nodes)
+        {list} configs {None}           -- Names of CONFIGS, all if None
+        {int} iterations {20}           -- Iterations per run
+        {int} colony {20}               -- Number of ants in the colony
+        {int} repeats {1}               -- Runs per instance and configuration
+        {int} seed {0}                  -- Seed of the whole benchmark, every run gets its own stream
+
+    @return
+        {dict}                          -- 'meta' data of the machine and 'results', one row per run
+"""
+def runBenchmark(instances = INSTANCES, configs = None, iterations = 20, colony = 20, repeats = 1, seed = 0):
+    configs = configs or list(CONFIGS)
+
+    # Every run, with independent random numbers
+    runs = [(tsp, config, repeat) for tsp in instances for config in configs for repeat in range(repeats)]
+    seeds = spawnSeeds(seed, len(runs))
+
+    # One run at a time, a new worker process for each
+    results = []
+    for (tsp, config, repeat), child in zip(runs, seeds):
+        with ProcessPoolExecutor(1) as pool:
+            row = pool.submit(runCase, tsp, config, iterations, colony, child).result()
+
+        row.update(repeat = repeat, seed = seed)
+        results.append(row)
+        msg('{instance} {config} #{repeat}: {wall_time:.2f}s, {iterations_per_second:.2f} it/s, '
+            '{peak_memory_mb} MB, distance {distance}, gap {gap}'.format(**row))
+
+    return {'meta': machineInfo(), 'results': results}
+
+"""
+    Run case - Run a configuration on an instance in a worker process
+    @arg
+        {string} tsp                        -- The instance name
+        {string} config                     -- Name of CONFIGS
+        {int} iterations                    -- Iterations of the run
+        {int} colony                        -- Number of ants in the colony
+        {numpy.random.SeedSequence} seed    -- Seed of the run
+
+    @return
+        {dict}                              -- Result row, but repeat and seed
+"""
+def runCase(tsp, config, iterations, colony, seed):
+    # Compiled kernels loaded and instance read before the clock starts and the memory baseline
+    warmUp()
+    data = getTspData(instanceFile(tsp))
+    space = np.asarray(data['node_coord_section'])
+    metric = data['edge_weight_type'] if data['edge_weight_type'] in ('EUC_2D', 'CEIL_2D') else None
+    before = peakMemory()
+
+    # Elapsed seconds after the first iteration, the rest is the steady rate
+    first = None
+    for event in iterateAcoTsp(space, iterations, colony, metric = metric, seed = seed, **CONFIGS[config]):
+        if event['event'] == 'iteration' and first is None:
+            first = event['elapsed']
+    elapsed = event['elapsed']
+    steady = (event['iteration'] - 1) / (elapsed - first) if event['iteration'] > 1 else event['iteration'] / elapsed
+
+    optimum = OPTIMA.get(tsp)
+    return {
+        'instance': tsp,
+        'nodes': space.shape[0],
+        'config': config,
+        'iterations': event['iteration'],
+        'colony': colony,
+        'wall_time': elapsed,
+        'first_iteration_time': first,
+        'iterations_per_second': steady,
+        'tours_per_second': steady * colony,
+        'peak_memory_mb': None if before is None else round((peakMemory() - before) / (1 << 20), 1),
+        'distance': float(event['distance']),
+        'optimum': optimum,
+        'gap': None if optimum is None else float(event['distance']) / optimum - 1
+    }
+
+"""
+    Run batch benchmark - Solve many small random instances with runAcoTspBatch and with a loop of runAcoTsp, same
+    iterations and colony, and compare their throughput and distances
+    @arg
+        {tuple} ranges {BATCH_RANGES}   -- (fewest, most) nodes of the instances of every case
+        {int} count {100}               -- Instances per case
+        {int} iterations {20}           -- Iterations per instance
+        {int} colony {20}               -- Number of ants in the colony of every instance
+        {int} seed {0}                  -- Seed of the instances and runs
+
+    @return
+        {dict}                          -- 'meta' data of the machine and 'results', one row per case
+"""
+def runBatchBenchmark(ranges = BATCH_RANGES, count = 100, iterations = 20, colony = 20, seed = 0):
+    results = []
+    for low, high in ranges:
+        rng = np.random.default_rng(seed)
+        spaces = [rng.random((nodes, 2)) * 1000 for nodes in rng.integers(low, high + 1, count)]
+
+        # Compiled kernels and caches warmed up before the clock starts
+        runAcoTspBatch(spaces[:2], 2, colony)
+        runAcoTsp(spaces[0], 2, colony)
+
+        started = time.perf_counter()
+        batch = runAcoTspBatch(spaces, iterations, colony, seed = seed)
+        batch_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        loop = [runAcoTsp(space, iterations, colony, seed = seed) for space in spaces]
+        loop_time = time.perf_counter() - started
+
+        row = {
+            'nodes': '{}-{}'.format(low, high),
+            'instances': count,
+            'batch_time': batch_time,
+            'loop_time': loop_time,
+            'batch_routes_per_second': count / batch_time,
+            'loop_routes_per_second': count / loop_time,
+            'speedup': loop_time / batch_time,
+            'distance_ratio': float(np.mean([b[1] / l[1] for b, l in zip(batch, loop)]))
+        }
+        results.append(row)
+        msg('Batch {nodes} nodes: {batch_routes_per_second:.1f} routes/s (batch), {loop_routes_per_second:.1f} '
+            'routes/s (loop), {speedup:.2f}x, distance ratio {distance_ratio:.4f}'.format(**row))
+
+    return {'meta': machineInfo(), 'results': results}
+
+"""
+    Instance file - Get the .tsp file of an instance, synthetic ones are generated once in /data
+    @arg
+        {string} tsp            -- The instance name, bundled or 'rand' and the number of nodes
+
+    @return
+        {string}                -- The .tsp file src
+"""
+def instanceFile(tsp):
+    file = 'data/{}.tsp'.format(tsp)
+    if not os.path.exists(file) and re.fullmatch(r'rand\d+', tsp):
+        saveRandomTsp(file, int(tsp[4:]))
+
+    return file
+
+"""
+    Save random TSP - Write a synthetic instance with nodes uniformly spread over a square, the same for a given
+    number of nodes
+    @arg
+        {string} file           -- The .tsp file src
+        {int} nodes             -- Number of nodes
+
+    @export
+        {tsp}                   -- Generated TSPLIB .tsp file
+"""
+def saveRandomTsp(file, nodes):
+    # Integer coordinates in a 1000000 side square, seeded by the number of nodes
+    space = np.random.default_rng(nodes).integers(1000000, size = (nodes, 2))
+
+    # Written to a temporary file first, parallel runs may generate it at once
+    partial = '{}.{}.partial'.format(file, os.getpid())
+    with open(partial, 'w') as tsp:
+        tsp.write('NAME: rand{}\n'.format(nodes))
+        tsp.write('TYPE: TSP\n')
+        tsp.write('COMMENT: {} nodes uniformly random in a square (synthetic)\n'.format(nodes))
+        tsp.write('DIMENSION: {}\n'.format(nodes))
+        tsp.write('EDGE_WEIGHT_TYPE: EUC_2D\n')
+        tsp.write('NODE_COORD_SECTION\n')
+        for node, (x, y) in enumerate(space):
+            tsp.write('{} {} {}\n'.format(node + 1, x, y))
+        tsp.write('EOF\n')
+    os.replace(partial, file)
+
+"""
+    Peak memory - Get the maximum resident memory of the process so far
+    @return
+        {int}                   -- Bytes, None if unknown
+"""
+def peakMemory():
+    if resource is None:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+"""
+    Machine info - Get what the timings depend on
+    @return
+        {dict}                  -- Python, NumPy, platform and processor data
+"""
+def machineInfo():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count()
+    }
+
+"""
+    Save benchmark - Write the results as JSON (with the machine data) and CSV
+    @arg
+        {dict} benchmark        -- The runBenchmark result
+        {string} file           -- Path without extension, .json and .csv are added
+
+    @export
+        {json, csv}             -- Generated files for the benchmark
+"""
+def saveBenchmark(benchmark, file):
+    with open('{}.json'.format(file), 'w') as out:
+        json.dump(benchmark, out, indent = 2)
+
+    with open('{}.csv'.format(file), 'w', newline = '') as out:
+        writer = csv.DictWriter(out, COLUMNS)
+        writer.writeheader()
+        writer.writerows(benchmark['results'])
+
+    msg('{0}.json and {0}.csv generated'.format(file))
+
+"""
+    Compare benchmarks - Find the metrics that got worse than a baseline by more than a tolerance, averaging the
+    repeats of every instance and configuration
+    @arg
+        {dict} benchmark            -- The runBenchmark result
+        {dict} baseline             -- A previous runBenchmark result
+        {float} tolerance {0.1}     -- Relative change allowed
+
+    @return
+        {list}                      -- (instance, config, metric, baseline, current, relative change) of every
+                                       regression
+"""
+def compareBenchmarks(benchmark, baseline, tolerance = 0.1):
+    current = averageRuns(benchmark['results'])
+    previous = averageRuns(baseline['results'])
+
+    regressions = []
+    for key in sorted(set(current) & set(previous)):
+        for metric, higher in METRICS.items():
+            now, before = current[key].get(metric), previous[key].get(metric)
+            if now is None or before is None or not before:
+                continue
+
+            # Relative change, positive when worse
+            change = (now - before) / before
+            if higher:
+                change = -change
+            if change > tolerance:
+                regressions.append(key + (metric, before, now, change))
+
+    return regressions
+
+"""
+    Average runs - Get the mean of every metric over the repeats of an instance and configuration
+    @arg
+        {list} results          -- Result rows
+
+    @return
+        {dict}                  -- Mean metrics by (instance, config)
+"""
+def averageRuns(results):
+    groups = {}
+    for row in results:
+        groups.setdefault((row['instance'], row['config']), []).append(row)
+
+    return {
+        key: {
+            metric: None if None in [row.get(metric) for row in rows] else float(np.mean([row[metric] for row in rows]))
+            for metric in METRICS
+        }
+        for key, rows in groups.items()
+    }
+
+"""
+    Show a console message
+    @arg
+        {string} str
+"""
+def msg(str):
+    print('[Benchmark ACO_TSP] {}'.format(str))
+
+"""
+    Command line entry point, 'run' the benchmark (and compare it with a baseline), 'compare' two saved ones or
+    'batch' to compare runAcoTspBatch with a loop. Exits with 1 on regressions
+"""
+def main():
+    parser = argparse.ArgumentParser(description = 'ACO-TSP benchmark suite')
+    parser.add_argument('command', choices = ('run', 'compare', 'batch'))
+    parser.add_argument('--instances', nargs = '+', default = list(INSTANCES))
+    parser.add_argument('--configs', nargs = '+', choices = list(CONFIGS), default = list(CONFIGS))
+    parser.add_argument('--iterations', type = int, default = 20)
+    parser.add_argument('--colony', type = int, default = 20)
+    parser.add_argument('--repeats', type = int, default = 1)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--out', default = 'results/benchmark')
+    parser.add_argument('--current', help = 'Saved benchmark JSON to compare, instead of running one')
+    parser.add_argument('--baseline', help = 'Saved benchmark JSON to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.1)
+    parser.add_argument('--count', type = int, default = 100, help = 'Instances per case of the batch benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'batch':
+        benchmark = runBatchBenchmark(count = args.count, iterations = args.iterations, colony = args.colony,
+                                      seed = args.seed)
+        with open('{}-batch.json'.format(args.out), 'w') as out:
+            json.dump(benchmark, out, indent = 2)
+        msg('{}-batch.json generated'.format(args.out))
+        return
+
+    if args.command == 'run':
+        benchmark = runBenchmark(args.instances, args.configs, args.iterations, args.colony, args.repeats, args.seed)
+        saveBenchmark(benchmark, args.out)
+    else:
+        if not args.current or not args.baseline:
+            parser.error('compare needs --current and --baseline')
+        with open(args.current) as file:
+            benchmark = json.load(file)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        regressions = compareBenchmarks(benchmark, baseline, args.tolerance)
+        for instance, config, metric, before, now, change in regressions:
+            msg('REGRESSION {} {} {}: {:.4g} -> {:.4g} ({:+.1%})'.format(instance, config, metric, before, now, change))
+        msg('{} regressions over a {:.0%} tolerance'.format(len(regressions), args.tolerance))
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# Import
+import numba
+import numpy as np
+import os
+
+# Fork safe threading layer unless chosen otherwise, the islands and process pools may fork after kernels ran (TBB can
+# hang at exit and GNU OpenMP aborts in that case)
+if 'NUMBA_THREADING_LAYER' not in os.environ:
+    numba.config.THREADING_LAYER = 'workqueue'
+
+# Compiled kernels of library.py, used when Numba is importable. Every kernel does the same floating point operations
+# in the same order as its NumPy counterpart, so a seed gives the same run with or without them
+
+"""
+    Choose - Pick the next node among weights as selectNext and rouletteSelect do, for a single ant
+    @arg
+        {numpy.ndarray} weights     -- Probability weights, visited nodes already zero (overwritten)
+        {numpy.ndarray} free        -- Whether each node is not visited yet
+        {numpy.ndarray} draws       -- Uniform random numbers of the ant, the roulette and (if q0) the
+                                       pseudo-random-proportional rule
+        {float} q0                  -- Probability of taking the most probable node instead of a random one
+
+    @return
+        {int}                       -- Index of the selected weight
+"""
+@numba.njit(cache = True)
+def choose(weights, free, draws, q0):
+    count = weights.shape[0]
+
+    # Nodes left without weight are chosen uniformly
+    total = 0.0
+    for j in range(count):
+        total += weights[j]
+    if total <= 0:
+        for j in range(count):
+            weights[j] = 1.0 if free[j] else 0.0
+
+    # Pseudo-random-proportional rule, the first most probable node
+    if q0 > 0 and draws[1] < q0:
+        best = 0
+        for j in range(count):
+            if weights[j] > weights[best]:
+                best = j
+        return best
+
+    # Roulette over the cumulative weights, threshold kept strictly below the total
+    for j in range(1, count):
+        weights[j] += weights[j - 1]
+    total = weights[count - 1]
+    threshold = min(draws[0] * total, np.nextafter(total, 0.0))
+    for j in range(count):
+        if weights[j] > threshold:
+            return j
+
+    return count - 1
+
+"""
+    Next node - Pick the next node of an ant, among its unvisited candidates first then the full row, as moveAnts
+    @arg
+        {int} ant                   -- The ant
+        {int} current               -- Its current node
+        {numpy.ndarray} choice      -- Choice info, pheromones ^ alpha * inverted distances ^ beta
+        {numpy.ndarray} candidates  -- Candidate lists, empty for full rows
+        {numpy.ndarray} visited     -- Visited nodes mask, one row per ant
+        {numpy.ndarray} draws       -- Uniform random numbers of the ant for this step
+        {float} q0                  -- Probability of taking the most probable node instead of a random one
+        {numpy.ndarray} weights     -- Scratch row of the ant, at least as long as a full row
+        {numpy.ndarray} free        -- Scratch row of the ant, same length
+
+    @return
+        {int}                       -- The next node
+"""
+@numba.njit(cache = True)
+def nextNode(ant, current, choice, candidates, visited, draws, q0, weights, free):
+    # Unvisited candidates first
+    if candidates.shape[0] > 0:
+        k = candidates.shape[1]
+        available = False
+        for c in range(k):
+            node = candidates[current, c]
+            free[c] = not visited[ant, node]
+            available = available or free[c]
+            weights[c] = choice[current, node] if free[c] else 0.0
+
+        if available:
+            return candidates[current, choose(weights[:k], free[:k], draws, q0)]
+
+    # Full row
+    nodes = visited.shape[1]
+    for node in range(nodes):
+        free[node] = not visited[ant, node]
+        weights[node] = choice[current, node] if free[node] else 0.0
+
+    return choose(weights[:nodes], free[:nodes], draws, q0)
+
+"""
+    Move colony - Build the paths of every ant, each ant in parallel (prange) as they do not depend on each other
+    without local updates. Every buffer is given, so nothing is allocated
+    @arg
+        {numpy.ndarray} positions   -- Initial positions of the ants
+        {numpy.ndarray} choice      -- Choice info, pheromones ^ alpha * inverted distances ^ beta
+        {numpy.ndarray} candidates  -- Candidate lists, empty for full rows
+        {numpy.ndarray} draws       -- Uniform random numbers, one (colony, 1 or 2) block per step
+        {float} q0                  -- Probability of taking the most probable node instead of a random one
+        {numpy.ndarray} paths       -- Indexes of the paths, one row per ant, written
+        {numpy.ndarray} visited     -- Visited nodes masks, one row per ant, overwritten
+        {numpy.ndarray} weights     -- Scratch rows, one per ant
+        {numpy.ndarray} free        -- Scratch rows, one per ant
+"""
+@numba.njit(parallel = True, cache = True)
+def moveColony(positions, choice, candidates, draws, q0, paths, visited, weights, free):
+    nodes = choice.shape[0]
+
+    for ant in numba.prange(positions.shape[0]):
+        visited[ant, :] = False
+        paths[ant, 0] = positions[ant]
+        visited[ant, positions[ant]] = True
+        for step in range(1, nodes):
+            node = nextNode(ant, paths[ant, step - 1], choice, candidates, visited, draws[step - 1, ant], q0,
+                            weights[ant], free[ant])
+            paths[ant, step] = node
+            visited[ant, node] = True
+
+"""
+    Move step - Move every ant one step, in parallel (prange), for variants with local updates between steps
+    @arg
+        {numpy.ndarray} paths       -- Paths so far, one row per ant, the step column is written
+        {int} step                  -- The step
+        {numpy.ndarray} visited     -- Visited nodes mask, one row per ant, updated
+        {numpy.ndarray} choice      -- Choice info, pheromones ^ alpha * inverted distances ^ beta
+        {numpy.ndarray} candidates  -- Candidate lists, empty for full rows
+        {numpy.ndarray} draws       -- Uniform random numbers of the step, one row per ant
+        {float} q0                  -- Probability of taking the most probable node instead of a random one
+        {numpy.ndarray} weights     -- Scratch rows, one per ant
+        {numpy.ndarray} free        -- Scratch rows, one per ant
+"""
+@numba.njit(parallel = True, cache = True)
+def moveStep(paths, step, visited, choice, candidates, draws, q0, weights, free):
+    for ant in numba.prange(paths.shape[0]):
+        node = nextNode(ant, paths[ant, step - 1], choice, candidates, visited, draws[ant], q0, weights[ant], free[ant])
+        paths[ant, step] = node
+        visited[ant, node] = True
+
+"""
+    Tour lengths - Distances of closed paths, edge after edge as the cumulative sum of library.tourLengths, in float64
+    @arg
+        {numpy.ndarray} paths       -- Indexes of the paths, one row per path
+        {numpy.ndarray} distances   -- Distances between all nodes
+
+    @return
+        {numpy.ndarray}             -- Distance of every path
+"""
+@numba.njit(parallel = True, cache = True)
+def tourLengths(paths, distances):
+    count, nodes = paths.shape
+    lengths = np.zeros(count, dtype = np.float64)
+    for path in numba.prange(count):
+        for i in range(nodes):
+            lengths[path] += distances[paths[path, i], paths[path, (i + 1) % nodes]]
+
+    return lengths
+
+"""
+    Deposit - Add amounts to edges one after another, as numpy.add.at
+    @arg
+        {numpy.ndarray} pheromones  -- Pheromones trail, updated
+        {numpy.ndarray} rows        -- Rows of the edges
+        {numpy.ndarray} columns     -- Columns of the edges
+        {numpy.ndarray} amounts     -- Amount per edge
+"""
+@numba.njit(cache = True)
+def deposit(pheromones, rows, columns, amounts):
+    for i in range(rows.shape[0]):
+        pheromones[rows[i], columns[i]] += amounts[i]
+
+"""
+    Move batch - Build the paths of every ant of a padded stack of instances, the instances in parallel (prange). The
+    choice info of an instance is first copied to a contiguous block of its own size, so its ants go through rows
+    without padding, and padding nodes follow in order, as library.moveAntsBatch
+    @arg
+        {numpy.ndarray} positions   -- Initial positions, one row of ants per instance
+        {numpy.ndarray} choice      -- Choice info of every instance
+        {numpy.ndarray} sizes       -- Number of nodes of every instance
+        {numpy.ndarray} draws       -- Uniform random numbers, one (instances x colony, 1 or 2) block per step
+        {float} q0                  -- Probability of taking the most probable node instead of a random one
+
+    @return
+        {numpy.ndarray}             -- Indexes of the paths, (instances, ants, nodes)
+"""
+@numba.njit(parallel = True, cache = True)
+def moveBatch(positions, choice, sizes, draws, q0):
+    instances, colony = positions.shape
+    nodes = choice.shape[1]
+    paths = np.empty((instances, colony, nodes), dtype = np.int64)
+    candidates = np.empty((0, 0), dtype = np.int64)
+
+    for instance in numba.prange(instances):
+        size = sizes[instance]
+        info = np.ascontiguousarray(choice[instance, :size, :size])
+        visited = np.zeros((colony, size), dtype = np.bool_)
+        weights = np.empty(size)
+        free = np.empty(size, dtype = np.bool_)
+
+        for ant in range(colony):
+            row = instance * colony + ant
+            paths[instance, ant, 0] = positions[instance, ant]
+            visited[ant, positions[instance, ant]] = True
+            for step in range(1, size):
+                node = nextNode(ant, paths[instance, ant, step - 1], info, candidates, visited, draws[step - 1, row],
+                                q0, weights, free)
+                paths[instance, ant, step] = node
+                visited[ant, node] = True
+            for step in range(size, nodes):
+                paths[instance, ant, step] = step
+
+    return paths
+
+"""
+    Batch lengths - Distances of the closed paths of a padded stack, edge after edge as the cumulative sum of
+    library.batchLengths, padding left out
+    @arg
+        {numpy.ndarray} paths       -- Indexes of the paths, (instances, ants, nodes)
+        {numpy.ndarray} distances   -- Distances of every instance
+        {numpy.ndarray} sizes       -- Number of nodes of every instance
+
+    @return
+        {numpy.ndarray}             -- Distance of every path, (instances, ants)
+"""
+@numba.njit(parallel = True, cache = True)
+def batchLengths(paths, distances, sizes):
+    instances, colony = paths.shape[:2]
+    lengths = np.zeros((instances, colony))
+    for row in numba.prange(instances * colony):
+        instance, ant = row // colony, row % colony
+        size = sizes[instance]
+        for i in range(size):
+            lengths[instance, ant] += distances[instance, paths[instance, ant, i], paths[instance, ant, (i + 1) % size]]
+
+    return lengths
+
+"""
+    Deposit batch - Add an amount per path to the edges it takes in both directions, every instance in parallel
+    (prange) as they do not share edges, in the order of library.depositBatch within an instance
+    @arg
+        {numpy.ndarray} pheromones  -- Pheromones trail of every instance, updated
+        {numpy.ndarray} paths       -- Indexes of the paths, (instances, ants, nodes)
+        {numpy.ndarray} sizes       -- Number of nodes of every instance
+        {numpy.ndarray} amounts     -- Amount per path, (instances, ants)
+"""
+@numba.njit(parallel = True, cache = True)
+def depositBatch(pheromones, paths, sizes, amounts):
+    instances, colony = paths.shape[:2]
+    for instance in numba.prange(instances):
+        size = sizes[instance]
+        trail = pheromones[instance]
+        for ant in range(colony):
+            for i in range(size):
+                trail[paths[instance, ant, i], paths[instance, ant, (i + 1) % size]] += amounts[instance, ant]
+        for ant in range(colony):
+            for i in range(size):
+                trail[paths[instance, ant, (i + 1) % size], paths[instance, ant, i]] += amounts[instance, ant]
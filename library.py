@@ -1,48 +1,148 @@
 # [0] Libs
 
+import contextlib
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import time
+import traceback
 import numpy as np
+from collections import OrderedDict, deque
+
+# Optional spatial index, candidate lists fall back to blocked brute force without it
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Optional compiled kernels (Numba), construction, evaluation and deposit fall back to NumPy without them. Set KERNELS
+# to False to use NumPy anyway, a seed gives the same run either way
+try:
+    import kernels
+except ImportError:
+    kernels = None
+KERNELS = kernels is not None
 
 # [1] TSP
 
+# A line starting a TSPLIB keyword, which ends a section
+TSP_KEYWORD = re.compile(r'^[ \t]*[A-Za-z]', re.M)
+
 """
-    Get data from a given TSP file and convert it into a dictionary
+    Get data from a given TSP file and convert it into a dictionary. Headers are read in any order, every section is
+    parsed in bulk into NumPy arrays and .gz files are read compressed
     @arg
         {string} tsp    -- The TSP file src
 
     @return
-        {dictionary}    -- The TSP file as dictionary
+        {dictionary}    -- The TSP file as dictionary, headers and sections keyed by their lowercase TSPLIB keyword
 """
 def getTspData(tsp):
-    # Open input file
-    infile = open(tsp, 'r')
-
-    # Read instance
-    name = infile.readline().strip().split()[1]                     # NAME
-    type = infile.readline().strip().split()[1]                     # TYPE
-    comment = infile.readline().strip().split()[1]                  # COMMENT
-    dimension = infile.readline().strip().split()[1]                # DIMENSION
-    edge_weight_type = infile.readline().strip().split()[1]         # EDGE_WEIGHT_TYPE
-    node_coord_section = []                                         # NODE_COORD_SECTION
-    infile.readline()
-
-    # Read node coord section and store its x, y coordinates
-    for i in range(0, int(dimension)):
-        x, y = infile.readline().strip().split()[1:]
-        node_coord_section.append([float(x), float(y)])
-
-    # Close input file
-    infile.close()
+    # Read the whole input file, compressed or not
+    opener = gzip.open if tsp.endswith('.gz') else open
+    with opener(tsp, 'rt') as infile:
+        text = infile.read()
 
-    # File as dictionary
-    return {
-        'name': name,
-        'type': type,
-        'comment': comment,
-        'dimension': dimension,
-        'edge_weight_type': edge_weight_type,
-        'node_coord_section': node_coord_section
+    # Known headers, missing ones stay None
+    src = {
+        'name': None,
+        'type': None,
+        'comment': None,
+        'dimension': None,
+        'edge_weight_type': None,
+        'node_coord_section': None
     }
 
+    # Read instance, a line at a time for headers and in bulk for sections
+    position = 0
+    while position < len(text):
+        end = text.find('\n', position)
+        end = len(text) if end < 0 else end
+        keyword, _, value = text[position:end].partition(':')
+        keyword, value = keyword.strip().upper(), value.strip()
+        position = end + 1
+
+        if not keyword:
+            continue
+
+        if keyword == 'EOF':
+            break
+
+        # Headers, COMMENT may be repeated
+        if not keyword.endswith('_SECTION'):
+            if keyword == 'COMMENT' and src['comment']:
+                value = '{} {}'.format(src['comment'], value)
+            src[keyword.lower()] = int(value) if keyword in ('DIMENSION', 'CAPACITY') else value
+            continue
+
+        # Section data runs until the next keyword line
+        match = TSP_KEYWORD.search(text, position)
+        stop = match.start() if match else len(text)
+        values = np.fromstring(text[position:stop], sep = ' ')
+        position = stop
+
+        # Coordinates, sorted by node number
+        if keyword in ('NODE_COORD_SECTION', 'DISPLAY_DATA_SECTION'):
+            three = src.get('node_coord_type') == 'THREED_COORDS' or str(src['edge_weight_type']).endswith('_3D')
+            values = values.reshape(-1, 4 if three and keyword == 'NODE_COORD_SECTION' else 3)
+            values = values[np.argsort(values[:, 0], kind = 'stable'), 1:]
+
+        # Explicit distances as a full matrix
+        elif keyword == 'EDGE_WEIGHT_SECTION':
+            values = edgeWeightMatrix(values, src['dimension'], src.get('edge_weight_format', 'FULL_MATRIX'))
+
+        src[keyword.lower()] = values
+
+    # File as dictionary
+    return src
+
+"""
+    Edge weight matrix - Get the full matrix of an explicit TSPLIB EDGE_WEIGHT_SECTION
+    @arg
+        {numpy.ndarray} values      -- The section values, in file order
+        {int} dimension             -- Number of nodes
+        {string} format             -- The EDGE_WEIGHT_FORMAT
+
+    @return
+        {numpy.ndarray}             -- A dimension per dimension array of distances
+"""
+def edgeWeightMatrix(values, dimension, format):
+    if format == 'FULL_MATRIX':
+        return values[:dimension * dimension].reshape(dimension, dimension)
+
+    # Triangles walked by columns are the opposite triangle walked by rows, as the matrix is symmetric
+    format = {
+        'UPPER_COL': 'LOWER_ROW',
+        'LOWER_COL': 'UPPER_ROW',
+        'UPPER_DIAG_COL': 'LOWER_DIAG_ROW',
+        'LOWER_DIAG_COL': 'UPPER_DIAG_ROW'
+    }.get(format, format)
+
+    # Row-major indexes of the stored triangle
+    if format == 'UPPER_ROW':
+        rows, columns = np.triu_indices(dimension, 1)
+    elif format == 'LOWER_ROW':
+        rows, columns = np.tril_indices(dimension, -1)
+    elif format == 'UPPER_DIAG_ROW':
+        rows, columns = np.triu_indices(dimension)
+    elif format == 'LOWER_DIAG_ROW':
+        rows, columns = np.tril_indices(dimension)
+    else:
+        raise ValueError('Unknown edge weight format: {}'.format(format))
+
+    # Mirror the triangle
+    matrix = np.zeros((dimension, dimension))
+    matrix[rows, columns] = values[:rows.size]
+    matrix[columns, rows] = values[:rows.size]
+    return matrix
+
 """
     Display headers from a given dictionary gotten from a TSP file
     @arg
@@ -61,147 +161,2520 @@ def displayTspHeaders(dict):
     Run Ant Colony Optimization (ACO) algorithm for a given Symmetric traveling salesman problem (TSP) space and data
     @arg
         {numpy.ndarray} space           -- The space
-        {int} iterations {80}           -- Number of iterations (Ending condition)
+        {int} iterations {80}           -- Maximum number of iterations (Ending condition), unbounded if None
         {int} colony {50}               -- Number of ants in the colony
         {float} alpha {1.0}             -- Alpha algorithm parameter, more or less weight to a selected distance
         {float} beta {1.0}              -- Beta algorithm parameter, more or less weight to a selected distance
         {float} del_tau {1.0}           -- Delta Tau algorithm parameter, pheromones releasing rate
         {float} rho {0.5}               -- Rho algorithm parameter, pheromones evaporation rate
+        {int} candidates {None}         -- Size of the nearest neighbours candidate list per node, full rows if None
+        {string} storage {'dense'}      -- Distances and pheromones storage, 'dense' matrices or 'sparse' candidate edges
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype {float64}   -- Type of the distances, inverted distances and pheromones, float32 halves
+                                           memory and bandwidth
+        {InstanceCache} cache {None}    -- On-disk cache of preprocessed instances, preprocess every time if None
+        {string} local_search {None}    -- Local search applied to paths, '2-opt', 'or-opt' or '2-opt+or-opt', none if None
+        {string} search_scope {'best'}  -- Paths improved by the local search, 'best' of each iteration or 'all'
+        {string|AntSystem} variant {'as'}   -- Pheromones update rule, 'as' (Ant System), 'mmas' (MAX-MIN Ant System),
+                                               'acs' (Ant Colony System) or an AntSystem instance
+        {float} time_budget {None}      -- Seconds to return by (Ending condition), unbounded if None
+        {int} stagnation {None}         -- Iterations without improvement of the minimum distance (Ending condition)
+        {float} branching {None}        -- Lambda-branching factor of the pheromones trail (Ending condition), checked
+                                           from iteration BRANCHING_WARMUP on, not for 'acs' (ValueError)
+        {float} target {None}           -- Known minimum distance, e.g. the optimum (Ending condition)
+        {float} gap {0.0}               -- Relative tolerance over target
+        {numpy.ndarray|string} initial_path {None}  -- Warm start, indexes of a known path (open or closed) whose edges
+                                                       receive pheromones before the first iteration, or 'greedy' for
+                                                       the nearest neighbour path
+        {string} checkpoint {None}      -- File the state of the run is saved to (.npz), every checkpoint_every
+                                           iterations and at the end
+        {int} checkpoint_every {10}     -- Iterations between checkpoints
+        {string} resume {None}          -- Checkpoint file to resume a run from, same instance and parameters, the
+                                           iterations already run count towards the ending conditions
+        {int|numpy.random.Generator} seed {None}    -- Seed of the random numbers, or a generator to draw them from,
+                                                     unseeded if None. The same seed gives the same run
+        {Timings} timings {None}        -- Cumulative time and calls of every phase (preprocessing, construction,
+                                           evaluation, local search, pheromones update), not measured if None
+
+        {function} callback {None}      -- Called with every event of iterateAcoTsp, the run is cancelled if it returns
+                                           False
 
     @return
         {Tuple(numpy.ndarray, float)}   -- Indexes of the minimun distance path and the minimun distance
 """
-def runAcoTsp(space, iterations = 80, colony = 50, alpha = 1.0, beta = 1.0, del_tau = 1.0, rho = 0.5):
-    # [1] Find inverted distances for all nodes
-    inv_distances = inverseDistances(space)
-
-    # Add beta algorithm parameter to inverted distances
-    inv_distances = inv_distances ** beta
-
-    # Empty pheromones trail
-    pheromones = np.zeros((space.shape[0], space.shape[0]))
-
+def runAcoTsp(space, iterations = 80, colony = 50, alpha = 1.0, beta = 1.0, del_tau = 1.0, rho = 0.5, candidates = None,
+              storage = 'dense', metric = None, dtype = np.float64, cache = None, local_search = None,
+              search_scope = 'best', variant = 'as', time_budget = None, stagnation = None, branching = None,
+              target = None, gap = 0.0, initial_path = None, checkpoint = None, checkpoint_every = 10, resume = None,
+              seed = None, timings = None, callback = None):
     # Empty minimum distance and path
     min_distance = None
     min_path = None
 
-    # [2] For the number of iterations
-    for i in range(iterations):
-        # Initial random positions
-        positions = initializeAnts(space, colony)
+    # Follow the run until it ends or the callback cancels it
+    events = iterateAcoTsp(space, iterations, colony, alpha, beta, del_tau, rho, candidates, storage, metric, dtype,
+                           cache, local_search, search_scope, variant, time_budget, stagnation, branching, target,
+                           gap, initial_path, checkpoint, checkpoint_every, resume, seed, timings)
+    for event in events:
+        if event['event'] == 'improved':
+            min_distance = event['distance']
+            min_path = event['path']
+
+        if callback is not None and callback(event) is False:
+            events.close()
+
+    # Return tuple
+    return (min_path, min_distance)
+
+"""
+    Iterate ACO TSP - Run Ant Colony Optimization (ACO) as a generator of events, so the best path so far can be used
+    while the run goes on. Closing the generator cancels the run
+    @arg
+        {*} ...                         -- The runAcoTsp arguments, but callback
+        {int} report {1}                -- Iterations between 'iteration' events
+
+    @yield
+        {dict}                          -- An event, with its 'event' name, 'iteration' number and 'elapsed' seconds:
+                                           'improved' with the new minimum 'distance' and closed 'path' (at iteration 0
+                                           or the resumed one for a warm start),
+                                           'iteration' with the minimum 'distance' so far, and the 'iteration_best' and
+                                           'iteration_mean' distances of the colony,
+                                           'done' with the minimum 'distance', closed 'path', ending 'reason' and
+                                           the 'timings' summary if measured
+"""
+def iterateAcoTsp(space, iterations = 80, colony = 50, alpha = 1.0, beta = 1.0, del_tau = 1.0, rho = 0.5,
+                  candidates = None, storage = 'dense', metric = None, dtype = np.float64, cache = None,
+                  local_search = None, search_scope = 'best', variant = 'as', time_budget = None, stagnation = None,
+                  branching = None, target = None, gap = 0.0, initial_path = None, checkpoint = None,
+                  checkpoint_every = 10, resume = None, seed = None, timings = None, report = 1):
+    # Ending conditions, the time budget includes preprocessing
+    termination = Termination(iterations, time_budget, stagnation, branching, target, gap)
+
+    # Variant, checked against the ending conditions before any preprocessing
+    engine = makeEngine(variant)
+    termination.check(engine)
+
+    # Random numbers of the run
+    rng = np.random.default_rng(seed)
+
+    # [1] Inverted distances ^ beta and empty pheromones trail for all nodes
+    with phase(timings, 'preprocessing'):
+        storage = makeStorage(space, storage, beta, candidates, metric, dtype, cache)
+
+        # Neighbour lists for the local search, the candidate lists if any
+        search = makeSearch(space, storage, local_search, search_scope, metric)
+
+    # Initial pheromones trail of the variant
+    with phase(timings, 'initialization'):
+        engine.start(space, storage, colony, alpha, beta, del_tau, rho)
+
+        # Empty minimum distance and path, unless warm started from a checkpoint or a known path
+        min_distance = None
+        min_path = None
+        if resume is not None:
+            min_path, min_distance = loadCheckpoint(resume, storage, engine, termination, rng)
+        elif initial_path is not None:
+            min_path, min_distance = warmStart(space, storage, engine, initial_path)
+
+    # [2] Run the colony
+    yield from iterateEngine(space, storage, engine, search, termination, rng, min_path, min_distance, report,
+                             checkpoint, checkpoint_every, timings)
+
+"""
+    Iterate engine - Run a started variant until an ending condition is met, as a generator of iterateAcoTsp events
+    @arg
+        {numpy.ndarray} space           -- The space
+        {Storage} storage               -- Inverted distances ^ beta and pheromones trail
+        {AntSystem} engine              -- The started variant
+        {dict} search                   -- Local search settings of makeSearch, none if None
+        {Termination} termination       -- Ending conditions
+        {numpy.random.Generator} rng    -- Random numbers of the run
+        {numpy.ndarray} min_path {None} -- Indexes of a known path to start from, open, none if None
+        {float} min_distance {None}     -- Its distance
+        {int} report {1}                -- Iterations between 'iteration' events
+        {string} checkpoint {None}      -- File the state of the run is saved to, none if None
+        {int} checkpoint_every {10}     -- Iterations between checkpoints
+        {Timings} timings {None}        -- Time of every phase, not measured if None
+
+    @yield
+        {dict}                          -- The iterateAcoTsp events
+"""
+def iterateEngine(space, storage, engine, search, termination, rng, min_path = None, min_distance = None,
+                  report = 1, checkpoint = None, checkpoint_every = 10, timings = None):
+    # A known path is the first improvement
+    if min_path is not None:
+        min_path = closedPath(min_path)
+        yield {
+            'event': 'improved',
+            'iteration': termination.iteration,
+            'elapsed': termination.elapsed(),
+            'distance': min_distance,
+            'path': min_path
+        }
+
+    # Buffers of the colony, reused by every iteration
+    workspace = Workspace()
+
+    # Until an ending condition is met
+    while not termination.done(min_distance, storage, engine):
+        # Move the colony and measure its paths
+        paths, distances = runIteration(space, storage, engine, search, rng, timings, workspace)
+
+        # Update minimun distance and path if less nor non existent
+        best = np.argmin(distances)
+        improved = not min_distance or distances[best] < min_distance
+        termination.record(improved)
+        iteration = termination.iteration
+        if improved:
+            min_distance = distances[best]
+
+            # Copy and append first node to end of minimum path to form closed path
+            min_path = closedPath(paths[best])
+
+            yield {
+                'event': 'improved',
+                'iteration': iteration,
+                'elapsed': termination.elapsed(),
+                'distance': min_distance,
+                'path': min_path
+            }
+
+        if iteration % report == 0:
+            yield {
+                'event': 'iteration',
+                'iteration': iteration,
+                'elapsed': termination.elapsed(),
+                'distance': min_distance,
+                'iteration_best': distances[best],
+                'iteration_mean': distances.mean()
+            }
+
+        if checkpoint is not None and iteration % checkpoint_every == 0:
+            with phase(timings, 'checkpoint'):
+                saveCheckpoint(checkpoint, storage, engine, termination, rng)
+
+    if checkpoint is not None:
+        with phase(timings, 'checkpoint'):
+            saveCheckpoint(checkpoint, storage, engine, termination, rng)
+
+    done = {
+        'event': 'done',
+        'iteration': termination.iteration,
+        'elapsed': termination.elapsed(),
+        'distance': min_distance,
+        'path': min_path,
+        'reason': termination.reason
+    }
+    if timings is not None:
+        done['timings'] = timings.summary()
+
+    yield done
+
+# Iterations before the branching factor is checked, a young trail has few reinforced edges without having converged
+BRANCHING_WARMUP = 10
+
+"""
+    Termination - Ending conditions of a run, checked before every iteration. The first iteration always runs, and an
+    iteration is not started when it would likely end after the time budget
+    @arg
+        {int} iterations {80}           -- Maximum number of iterations, unbounded if None
+        {float} time_budget {None}      -- Seconds to return by, counted from the creation, unbounded if None
+        {int} stagnation {None}         -- Iterations without improvement of the minimum distance
+        {float} branching {None}        -- Lambda-branching factor of the pheromones trail under which it converged, only
+                                           checked after an iteration without improvement and from iteration
+                                           BRANCHING_WARMUP on, against the trail limits of the variant if it has any.
+                                           Rejected by check for a variant whose trail does not tell convergence (ACS)
+        {float} target {None}           -- Known minimum distance, e.g. the optimum
+        {float} gap {0.0}               -- Relative tolerance over target
+"""
+class Termination:
+    def __init__(self, iterations = 80, time_budget = None, stagnation = None, branching = None, target = None,
+                 gap = 0.0):
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.stagnation = stagnation
+        self.branching = branching
+        self.target = target
+        self.gap = gap
+
+        # Progress, iteration includes the ones of a resumed run and ran only the ones since the creation
+        self.started = time.perf_counter()
+        self.iteration = 0
+        self.ran = 0
+        self.stale = 0
+        self.reason = None
+
+    # Seconds since the creation
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # Reject the ending conditions a variant cannot meet, a ValueError
+    def check(self, engine):
+        if self.branching is not None and not engine.converges:
+            raise ValueError('The branching ending condition does not apply to {}, its trail does not converge to a '
+                             'single path'.format(type(engine).__name__))
+
+    # Count an iteration, given whether it improved the minimum distance
+    def record(self, improved):
+        self.stale = 0 if improved else self.stale + 1
+        self.iteration += 1
+        self.ran += 1
+
+    # Whether to stop, its reason is kept in reason, the engine gives the trail limits for the branching factor
+    def done(self, min_distance, storage, engine = None):
+        if min_distance is None:
+            return False
+
+        if self.iterations is not None and self.iteration >= self.iterations:
+            self.reason = 'iterations'
+        elif self.time_budget is not None and self.ran and self.elapsed() * (1 + 1 / self.ran) >= self.time_budget:
+            self.reason = 'time'
+        elif self.stagnation is not None and self.stale >= self.stagnation:
+            self.reason = 'stagnation'
+        elif self.branching is not None and self.stale and self.iteration >= BRANCHING_WARMUP and \
+                branchingFactor(storage.pheromones, limits = engine and engine.limits()) <= self.branching:
+            self.reason = 'branching'
+        elif self.target is not None and min_distance <= self.target * (1 + self.gap):
+            self.reason = 'target'
+
+        return self.reason is not None
+
+"""
+    Branching factor - Get the average number of edges per node whose pheromones are over the lambda-branching cut, it
+    tends to 2 as the trail converges to a single path
+    @arg
+        {numpy.ndarray} pheromones      -- Tau, pheromones trail, one row per node
+        {float} lam {0.05}              -- Lambda, position of the cut between the minimum and maximum of each row
+        {tuple} limits {None}           -- (tau_min, tau_max) bounds of the trail the cut is taken between instead,
+                                           e.g. MMAS whose fresh trail is uniform at tau_max
+
+    @return
+        {float}                         -- The lambda-branching factor
+"""
+def branchingFactor(pheromones, lam = 0.05, limits = None):
+    if limits is None:
+        low = pheromones.min(axis = 1, keepdims = True)
+        high = pheromones.max(axis = 1, keepdims = True)
+    else:
+        low, high = limits
+    return (pheromones >= low + lam * (high - low)).sum(axis = 1).mean()
+
+"""
+    Run iteration - Move the colony once over the space, measure the paths taken and update the pheromones trail
+    @arg
+        {numpy.ndarray} space           -- The space
+        {Storage} storage               -- Inverted distances ^ beta and Tau, pheromones trail
+        {AntSystem} engine              -- The started variant, with the algorithm parameters
+        {dict} search {None}            -- Local search settings from makeSearch, none if None
+        {numpy.random.Generator} rng {None}     -- Random numbers, unseeded if None
+        {Timings} timings {None}        -- Time of every phase, not measured if None
+        {Workspace} workspace {None}    -- Buffers reused from the previous iteration, allocated if None
+
+    @return
+        {Tuple(numpy.ndarray, numpy.ndarray)}   -- Indexes of the paths taken by the ants (overwritten by the next
+                                                   iteration on the same workspace) and their distances
+"""
+def runIteration(space, storage, engine, search = None, rng = None, timings = None, workspace = None):
+    rng = np.random.default_rng(rng)
+
+    # Complete a path from random initial positions
+    with phase(timings, 'construction'):
+        positions = initializeAnts(space, engine.colony, rng)
+        paths = moveAnts(space, positions, storage, engine.alpha, engine.beta, engine.q0, engine.local, rng,
+                         workspace)
+
+    # Improve every path
+    if search and search['scope'] == 'all':
+        with phase(timings, 'local_search'):
+            for ant in range(engine.colony):
+                paths[ant] = localSearch(paths[ant], space, search['neighbours'], search['method'], search['metric'],
+                                         search['distances'])
+
+    # Distances of the closed paths, all at once
+    with phase(timings, 'evaluation'):
+        distances = storage.pathDistances(paths)
+
+    # Improve the best path only
+    if search and search['scope'] == 'best':
+        with phase(timings, 'local_search'):
+            ant = np.argmin(distances)
+            paths[ant] = localSearch(paths[ant], space, search['neighbours'], search['method'], search['metric'],
+                                     search['distances'])
+            distances[ant] = storage.pathDistances(paths[ant])
+
+    # Evaporate and release pheromones
+    with phase(timings, 'pheromones'):
+        engine.update(storage, paths, distances)
+
+    return (paths, distances)
+
+"""
+    Tour lengths - Get the distances of closed paths, back to their first node included, in a single gather
+    @arg
+        {numpy.ndarray} paths           -- Indexes of a path, or of several paths one per row
+        {numpy.ndarray} distances       -- A space.dimension per space.dimension array of distances
+
+    @return
+        {numpy.ndarray|float}           -- Distance of every path
+"""
+def tourLengths(paths, distances):
+    # Edge after edge (cumulative sum) rather than pairwise, the same sums as the compiled kernel, in float64 whatever
+    # the type of the distances so lengths stay exact
+    edges = distances[paths, np.roll(paths, -1, axis = -1)]
+    return np.cumsum(edges, axis = -1, dtype = np.float64)[..., -1]
+
+"""
+    Workspace - Buffers of a run kept from one iteration to the next, so moving the colony allocates next to nothing.
+    A buffer only grows, smaller shapes are views of it
+"""
+class Workspace:
+    def __init__(self):
+        self.buffers = {}
+
+    # Buffer of a given name, shape and type, uninitialized
+    def get(self, name, shape, dtype = np.float64):
+        size = math.prod(shape)
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(size, dtype = dtype)
+
+        return buffer[:size].reshape(shape)
+
+"""
+    Path type - Get the smallest integer type holding the indexes of a given number of nodes
+    @arg
+        {int} nodes             -- Number of nodes
+
+    @return
+        {numpy.dtype}           -- uint16 or uint32
+"""
+def pathType(nodes):
+    return np.dtype(np.uint16 if nodes <= 1 << 16 else np.uint32)
+
+"""
+    Closed path - Get a path back to its first node, as plain integer indexes
+    @arg
+        {numpy.ndarray} path    -- Indexes of the path, open
+
+    @return
+        {numpy.ndarray}         -- Indexes of the closed path, a new array
+"""
+def closedPath(path):
+    closed = np.empty(path.shape[0] + 1, dtype = int)
+    closed[:-1] = path
+    closed[-1] = path[0]
+    return closed
+
+"""
+    Make search - Get the local search settings used by runIteration
+    @arg
+        {numpy.ndarray} space           -- The space
+        {Storage} storage               -- Storage whose candidate lists are reused as neighbour lists
+        {string} method                 -- '2-opt', 'or-opt' or '2-opt+or-opt', no local search if None
+        {string} scope                  -- Paths improved, 'best' of each iteration or 'all'
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {int} k {10}                    -- Size of the neighbour lists when the storage has no candidate lists
+
+    @return
+        {dict}                          -- Method, scope, metric, neighbour lists and distance matrix (dense storage
+                                           only), or None without local search
+"""
+def makeSearch(space, storage, method, scope, metric = None, k = 10):
+    if not method:
+        return None
 
-        # Complete a path
-        paths = moveAnts(space, positions, inv_distances, pheromones, alpha, beta, del_tau)
+    if scope not in ('best', 'all'):
+        raise ValueError('Unknown search scope: {}'.format(scope))
 
-        # Evaporate pheromones
-        pheromones *= (1 - rho)
+    neighbours = storage.candidates if storage.candidates is not None else nearestNeighbours(space, k)
+    distances = storage.distances if isinstance(storage, DenseStorage) else None
+    return {'method': method, 'scope': scope, 'metric': metric, 'neighbours': neighbours, 'distances': distances}
 
-        # [3] For each path
-        for path in paths:
-            # Empty distance
-            distance = 0
+"""
+    Distance matrix - Get an array of distances between all nodes, computed by blocks of rows
+    @arg
+        {numpy.ndarray} space           -- The space
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype {float64}   -- Type of the distances, float32 halves memory
+        {string} file {None}            -- A .npy file to write the distances into as a memory-mapped array
+        {int} block {1024}              -- Rows computed at a time
 
-            # For each node from second to last
-            for node in range(1, path.shape[0]):
-                # Calculate distance to the last node
-                distance += np.sqrt(((space[int(path[node])] - space[int(path[node - 1])]) ** 2).sum())
+    @return
+        {numpy.ndarray}                 -- A space.dimension per space.dimension array of distances
+"""
+def distanceMatrix(space, metric = None, dtype = np.float64, file = None, block = 1024):
+    # Empty multidimensional array (matriz) to distances, in memory or memory-mapped
+    nodes = space.shape[0]
+    if file is None:
+        distances = np.empty((nodes, nodes), dtype = dtype)
+    else:
+        distances = np.lib.format.open_memmap(file, mode = 'w+', dtype = dtype, shape = (nodes, nodes))
 
-            # Update minimun distance and path if less nor non existent
-            if not min_distance or distance < min_distance:
-                min_distance = distance
-                min_path = path
+    # Calculate distance to all nodes to all nodes, a block of nodes at a time
+    for start in range(0, nodes, block):
+        distances[start:start + block] = pairDistances(space[start:start + block, None, :], space[None, :, :], metric)
 
-        # Copy and append first node to end of minimum path to form closed path
-        min_path = np.append(min_path, min_path[0])
+    # Write memory-mapped distances to disk
+    if file is not None:
+        distances.flush()
 
-        # Return tuple
-        return (min_path, min_distance)
+    return distances
 
 """
     Inverse distance - Get an array of inverted distances
+    @arg
+        {numpy.ndarray} space           -- The space
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype {float64}   -- Type of the inverted distances, float32 halves memory
+        {string} file {None}            -- A .npy file to write the inverted distances into as a memory-mapped array
+        {int} block {1024}              -- Rows computed at a time
+
+    @return
+        {numpy.ndarray}                 -- A space.dimension per space.dimension array of inverse distances
+"""
+def inverseDistances(space, metric = None, dtype = np.float64, file = None, block = 1024):
+    # Distances to all nodes to all nodes
+    distances = distanceMatrix(space, metric, dtype, file, block)
+
+    # Invert the distances in place, a block of nodes at a time
+    for start in range(0, space.shape[0], block):
+        invert(distances[start:start + block], out = distances[start:start + block])
+
+    # Write memory-mapped inverted distances to disk
+    if file is not None:
+        distances.flush()
+
+    # Eta algorithm result, inverted distances
+    return distances
+
+"""
+    Pair distances - Get the distances between two broadcastable arrays of points
+    @arg
+        {numpy.ndarray} a           -- Points
+        {numpy.ndarray} b           -- Points
+        {string} metric {None}      -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+
+    @return
+        {numpy.ndarray}             -- Distances between the points
+"""
+def pairDistances(a, b, metric = None):
+    # Euclidean distances, squared differences in place (integer points as floats)
+    differences = np.subtract(a, b, dtype = np.result_type(a, b, np.float16))
+    differences *= differences
+    distances = differences.sum(axis = -1)
+    np.sqrt(distances, out = distances)
+
+    # TSPLIB nint, rounded to the nearest integer
+    if metric == 'EUC_2D':
+        distances += 0.5
+        return np.floor(distances, out = distances)
+
+    # TSPLIB rounded up to the next integer
+    if metric == 'CEIL_2D':
+        return np.ceil(distances, out = distances)
+
+    if metric is not None:
+        raise ValueError('Unknown metric: {}'.format(metric))
+
+    return distances
+
+"""
+    Nearest neighbours - Get the k nearest neighbours of every node, closest first
     @arg
         {numpy.ndarray} space   -- The space
+        {int} k                 -- Number of neighbours per node
+        {int} block {1024}      -- Rows computed at a time when no spatial index is available
 
     @return
-        {numpy.ndarray}         -- A space.dimension per space.dimension array of inverse distances
+        {numpy.ndarray}         -- A space.dimension per k array of indexes of the nearest nodes
 """
-def inverseDistances(space):
-    # Empty multidimensional array (matriz) to distances
-    distances = np.zeros((space.shape[0], space.shape[0]))
+def nearestNeighbours(space, k, block = 1024):
+    # Sizes, a node can not be its own neighbour
+    nodes = space.shape[0]
+    k = min(k, nodes - 1)
 
-    # Calculate distance to all nodes to all nodes
-    for index, point in enumerate(space):
-        distances[index] = np.sqrt(((space - point) ** 2).sum(axis = 1))
+    # Query a KD-tree when available, asking one extra neighbour for the node itself
+    if cKDTree is not None:
+        _, found = cKDTree(space).query(space, k + 1)
+        found = found.reshape(nodes, k + 1)
 
-    # Floating-point error handling - Setted to known state
-    with np.errstate(all = 'ignore'):
-        # Invert the distances
-        inv_distances = 1 / distances
+        # Drop the node itself, or the farthest neighbour when a duplicated point took its place
+        keep = found != np.arange(nodes)[:, None]
+        keep[keep.all(axis = 1), -1] = False
+        return found[keep].reshape(nodes, k)
 
-    # Replace infinity by zero to prevent zero division error
-    inv_distances[inv_distances == np.inf] = 0
+    # Empty multidimensional array (matriz) to neighbours
+    neighbours = np.empty((nodes, k), dtype = int)
 
-    # Eta algorithm result, inverted distances
-    return inv_distances
+    # Squared distances for a block of nodes at a time to bound memory
+    for start in range(0, nodes, block):
+        end = min(start + block, nodes)
+        rows = np.arange(end - start)
+        distances = ((space[start:end, None, :] - space[None, :, :]) ** 2).sum(axis = 2)
+        distances[rows, start + rows] = np.inf
+
+        # Unordered k nearest, then sorted closest first
+        nearest = np.argpartition(distances, k - 1, axis = 1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, nearest, axis = 1), axis = 1)
+        neighbours[start:end] = np.take_along_axis(nearest, order, axis = 1)
+
+    # Indexes of the nearest nodes
+    return neighbours
+
+"""
+    Spawn seeds - Get independent seeds for parallel runs, so they neither share random numbers nor depend on the
+    number of workers
+    @arg
+        {int|numpy.random.SeedSequence|numpy.random.Generator} seed     -- Parent seed, or a generator to draw it
+                                                                           from, unseeded if None
+        {int} count                                                     -- Number of seeds
+
+    @return
+        {list}                  -- numpy.random.SeedSequence children, one per run
+"""
+def spawnSeeds(seed, count):
+    if isinstance(seed, np.random.Generator):
+        seed = int(seed.integers(1 << 63))
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(count)
 
 """
     Initialize ants - Get an array of random initial positions of the ants in space
     @arg
         {numpy.ndarray} space   -- The space
         {int} colony            -- Number of ants in the colony
+        {numpy.random.Generator} rng {None}     -- Random numbers, unseeded if None
 
     @return
         {numpy.ndarry}          -- An array of indexes of initial positions of ants in the space
 """
-def initializeAnts(space, colony):
+def initializeAnts(space, colony, rng = None):
     # Indexes of initial positions of ants
-    return np.random.randint(space.shape[0], size = colony)
+    return np.random.default_rng(rng).integers(space.shape[0], size = colony)
 
 """
-    Move ants - Move ants from initial positions to cover all nodes
+    Move ants - Move the whole colony from initial positions to cover all nodes, one step for all ants at a time
     @arg
         {numpy.ndarray} space           -- The space
         {numpy.ndarray} positions       -- Indexes of initial positions of ants in the space
-        {numpy.ndarray} inv_distances   -- Inverted distances ^ beta
-        {numpy.ndarray} pheromones      -- Tau, pheromones trail
+        {Storage} storage               -- Inverted distances ^ beta and Tau, pheromones trail
         {float} alpha                   -- Alpha algorithm parameter, more or less weight to a selected distance
         {float} beta                    -- Beta algorithm parameter, more or less weight to a selected distance
-        {float} del_tau                 -- Delta Tau algorithm parameter, pheromones releasing rate
+        {float} q0 {0.0}                -- Probability of taking the most probable node instead of a random one
+        {function} local {None}         -- Called with the edges just taken by the ants (rows, columns) after each step
+        {numpy.random.Generator} rng {None}     -- Random numbers, unseeded if None
+        {Workspace} workspace {None}    -- Buffers of the paths, masks and probability weights, allocated if None
 
     @return
-        {numpy.ndarry}                  -- Indexes of the paths taken by the ants
+        {numpy.ndarry}                  -- Indexes of the paths taken by the ants, one row per ant, in the smallest
+                                           integer type of pathType (a workspace buffer)
 """
-def moveAnts(space, positions, inv_distances, pheromones, alpha, beta, del_tau):
-    # Empty multidimensional array (matriz) to paths
-    paths = np.zeros((space.shape[0], positions.shape[0]), dtype = int) - 1
+def moveAnts(space, positions, storage, alpha, beta, q0 = 0.0, local = None, rng = None, workspace = None):
+    rng = np.random.default_rng(rng)
+    if workspace is None:
+        workspace = Workspace()
+
+    # Compiled kernels on dense storage
+    if KERNELS and isinstance(storage, DenseStorage):
+        return moveAntsCompiled(positions, storage, alpha, q0, local, rng, workspace)
+
+    # Nearest neighbours candidate lists, full rows if None
+    candidates = storage.candidates
+
+    # Sizes
+    nodes = space.shape[0]
+    colony = positions.shape[0]
+    ants = np.arange(colony)
+
+    # Empty multidimensional array (matriz) to paths, one row per ant
+    paths = workspace.get('paths', (colony, nodes), pathType(nodes))
+
+    # Visited nodes mask, one row per ant
+    visited = workspace.get('visited', (colony, nodes), bool)
+    visited.fill(False)
+
+    # Random numbers of a step
+    draws = workspace.get('draws', (colony, 2 if q0 > 0 else 1))
+
+    # Next node of every ant, and the offset of its row in the flat visited masks
+    next_positions = workspace.get('next_positions', (colony,), int)
+    offsets = (ants * nodes)[:, None]
 
     # Initial position at node zero
-    paths[0] = positions
+    paths[:, 0] = positions
+    visited[ants, positions] = True
 
     # For nodes after start to end
-    for node in range(1, space.shape[0]):
-        # For each ant
-        for ant in range(positions.shape[0]):
-            # Probability to travel the nodes
-            next_location_probability = (inv_distances[positions[ant]] ** alpha + pheromones[positions[ant]] ** beta /
-                                            inv_distances[positions[ant]].sum() ** alpha + pheromones[positions[ant]].sum() ** beta)
+    for node in range(1, nodes):
+        # Current position of every ant
+        current = paths[:, node - 1]
+
+        # Random numbers of the step for every ant at once, the roulette and the pseudo-random-proportional rule
+        rng.random(out = draws)
 
-            # Index to maximum probability node
-            next_position = np.argwhere(next_location_probability == np.amax(next_location_probability))[0][0]
+        # Choose among full rows, or among candidate lists first
+        if candidates is None:
+            next_positions[:] = selectNext(storage.rowWeights(current, alpha, workspace), visited, q0, draws, workspace)
+        else:
+            # Candidates of every ant and whether they have been visited
+            shape = (colony, candidates.shape[1])
+            options = np.take(candidates, current, axis = 0, out = workspace.get('options', shape, candidates.dtype))
+            cells = np.add(offsets, options, out = workspace.get('cells', shape, int))
+            taken = np.take(visited, cells, out = workspace.get('taken', shape, bool))
+            available = ~taken.all(axis = 1)
 
-            # Check if node has already been visited
-            while next_position in paths[:, ant]:
-                # Replace the probability of visited to zero
-                next_location_probability[next_position] = 0.0
+            # Usually every ant has unvisited candidates and chooses among them only, without masked copies
+            if available.all():
+                weights = storage.candidateWeights(current, alpha, workspace)
+                next_positions[:] = options[ants, selectNext(weights, taken, q0, draws, workspace)]
+            elif available.any():
+                weights = storage.candidateWeights(current[available], alpha, workspace)
+                next_positions[available] = options[available, selectNext(weights, taken[available], q0,
+                                                                          draws[available], workspace)]
 
-                # Find the maximum probability node
-                next_position = np.argwhere(next_location_probability == np.amax(next_location_probability))[0][0]
+            # Ants with every candidate visited fall back to the full row
+            if not available.all():
+                weights = storage.rowWeights(current[~available], alpha, workspace)
+                next_positions[~available] = selectNext(weights, visited[~available], q0, draws[~available],
+                                                        workspace)
 
-            # Add node to path
-            paths[node, ant] = next_position
+        # Add nodes to paths
+        paths[:, node] = next_positions
+        visited[ants, next_positions] = True
 
-            # Update pheromones (releasing pheromones)
-            pheromones[node, next_position] = pheromones[node, next_position] + del_tau
+        # Update pheromones on the edges just taken
+        if local is not None:
+            local(storage, current, next_positions)
 
     # Paths taken by the ants
-    return np.swapaxes(paths, 0, 1)
+    return paths
+
+"""
+    Move ants compiled - moveAnts with the compiled kernels, every ant in parallel. Draws the same random numbers, all
+    at once, and picks the same nodes as moveAnts
+    @arg
+        {numpy.ndarray} positions           -- Indexes of initial positions of ants in the space
+        {DenseStorage} storage              -- Inverted distances ^ beta and Tau, pheromones trail
+        {float} alpha                       -- Alpha algorithm parameter, more or less weight to a selected distance
+        {float} q0                          -- Probability of taking the most probable node instead of a random one
+        {function} local                    -- Called with the edges just taken by the ants after each step, none if None
+        {numpy.random.Generator} rng        -- Random numbers
+        {Workspace} workspace               -- Buffers of the paths, masks and probability weights
+
+    @return
+        {numpy.ndarry}                      -- Indexes of the paths taken by the ants, one row per ant
+"""
+def moveAntsCompiled(positions, storage, alpha, q0, local, rng, workspace):
+    # Sizes, and candidate lists as an empty array for full rows
+    nodes = storage.heuristic.shape[0]
+    colony = positions.shape[0]
+    candidates = storage.candidates if storage.candidates is not None else np.empty((0, 0), dtype = int)
+
+    # Random numbers of every step, the same stream as drawing them step by step
+    draws = workspace.get('draws', (nodes - 1, colony, 2 if q0 > 0 else 1))
+    rng.random(out = draws)
+
+    # Paths, visited nodes masks and scratch rows of every ant
+    paths = workspace.get('paths', (colony, nodes), pathType(nodes))
+    visited = workspace.get('visited', (colony, nodes), bool)
+    weights = workspace.get('weights', (colony, nodes), weightType(storage))
+    free = workspace.get('free', (colony, nodes), bool)
+
+    # Without local updates every ant builds its whole path on its own
+    if local is None:
+        kernels.moveColony(positions, storage.choiceInfo(alpha), candidates, draws, float(q0), paths, visited, weights,
+                           free)
+        return paths
+
+    # Otherwise a step for all ants at a time, then the local update
+    visited.fill(False)
+    paths[:, 0] = positions
+    visited[np.arange(colony), positions] = True
+    for node in range(1, nodes):
+        kernels.moveStep(paths, node, visited, storage.choiceInfo(alpha), candidates, draws[node - 1], float(q0),
+                         weights, free)
+        local(storage, paths[:, node - 1], paths[:, node])
+
+    return paths
+
+"""
+    Warm up - Load the compiled kernels of the usual runs (construction, path distances and deposit of every variant,
+    float64 and float32) by solving a tiny instance, so the first run of a process does not pay it within its time
+    budget or measures, e.g. in a pool initializer. Nothing to load without kernels
+"""
+def warmUp():
+    if not KERNELS:
+        return
+
+    space = np.random.default_rng(0).random((16, 2))
+    for variant, dtype in itertools.product(('as', 'mmas', 'acs'), (np.float64, np.float32)):
+        runAcoTsp(space, iterations = 2, colony = 4, variant = variant, dtype = dtype, seed = 0)
+
+"""
+    Select next - Pick the next node of every ant among the ones not visited yet
+    @arg
+        {numpy.ndarray} weights     -- Probability weights to travel the nodes, one row per ant (overwritten)
+        {numpy.ndarray} visited     -- Visited nodes mask, same shape as weights
+        {float} q0 {0.0}            -- Probability of taking the most probable node instead of a random one
+        {numpy.ndarray} draws {None}    -- Uniform random numbers, one row per ant, for the roulette and (if q0) the
+                                           pseudo-random-proportional rule, drawn unseeded if None
+        {Workspace} workspace {None}    -- Buffers of the roulette, allocated if None
+
+    @return
+        {numpy.ndarray}             -- Index of the selected column for each row
+"""
+def selectNext(weights, visited, q0 = 0.0, draws = None, workspace = None):
+    if draws is None:
+        draws = np.random.default_rng().random((weights.shape[0], 2))
+
+    # Replace the probability of visited nodes to zero
+    np.putmask(weights, visited, 0.0)
+
+    # Nodes left without weight (e.g. duplicated points) are chosen uniformly
+    totals = weights.sum(axis = 1)
+    empty = totals <= 0
+    if empty.any():
+        weights[empty] = ~visited[empty]
+        totals[empty] = weights[empty].sum(axis = 1)
+
+    # Roulette selection, a single cumulative sum for the whole colony
+    selected = rouletteSelect(weights, draws[:, 0], workspace)
+
+    # Pseudo-random-proportional rule, some ants take the most probable node
+    if q0 > 0:
+        greedy = draws[:, 1] < q0
+        selected[greedy] = weights[greedy].argmax(axis = 1)
+
+    return selected
+
+"""
+    Roulette select - Pick one column per row with probability proportional to its weight
+    @arg
+        {numpy.ndarray} weights     -- Non negative weights, one row per ant
+        {numpy.ndarray} draws       -- Uniform random numbers in [0, 1), one per row
+        {Workspace} workspace {None}    -- Buffers of the cumulative weights and the comparison, allocated if None
+
+    @return
+        {numpy.ndarray}             -- Index of the selected column for each row
+"""
+def rouletteSelect(weights, draws, workspace = None):
+    if workspace is None:
+        workspace = Workspace()
+
+    # Cumulative weights for all rows at once, the last column is the total
+    cumulative = np.cumsum(weights, axis = 1, out = workspace.get('cumulative', weights.shape, weights.dtype))
+    totals = cumulative[:, -1]
+
+    # Random thresholds, kept strictly below each total to absorb rounding
+    thresholds = np.minimum(draws * totals, np.nextafter(totals, 0))
+
+    # First column whose cumulative weight exceeds the threshold
+    exceeds = np.greater(cumulative, thresholds[:, None], out = workspace.get('exceeds', weights.shape, bool))
+    return np.argmax(exceeds, axis = 1)
+
+# [3] Storage
+
+"""
+    Weight type - Get the type of the probability weights of a storage, pheromones ^ alpha * inverted distances ^ beta
+    @arg
+        {Storage} storage           -- The storage
+
+    @return
+        {numpy.dtype}               -- float32 when both are, float64 otherwise
+"""
+def weightType(storage):
+    return np.result_type(storage.pheromones, storage.heuristic)
+
+"""
+    Make storage - Get the distances and pheromones storage selected for a given space
+    @arg
+        {numpy.ndarray} space       -- The space
+        {string} storage            -- 'dense' or 'sparse'
+        {float} beta                -- Beta algorithm parameter, more or less weight to a selected distance
+        {int} candidates            -- Size of the nearest neighbours candidate list per node, full rows if None
+        {string} metric {None}      -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype         -- Type of the distances, inverted distances and pheromones
+        {InstanceCache} cache       -- On-disk cache of preprocessed instances, preprocess every time if None
+
+    @return
+        {Storage}                   -- The storage
+"""
+def makeStorage(space, storage, beta, candidates, metric = None, dtype = np.float64, cache = None):
+    checkSpace(space, metric)
+
+    if storage not in ('dense', 'sparse'):
+        raise ValueError('Unknown storage: {}'.format(storage))
+
+    if storage == 'sparse' and not candidates:
+        raise ValueError('Sparse storage needs a candidates list size')
+
+    # Preprocessed arrays from a previous run, if any
+    key = instanceKey(space, storage, beta, candidates, metric, np.dtype(dtype).str)
+    cached = cache.load(key) if cache is not None else None
+    heuristic = cached['heuristic'] if cached else None
+    distances = cached.get('distances') if cached else None
+
+    # Nearest neighbours candidate lists, computed once
+    if cached and 'candidates' in cached:
+        neighbours = cached['candidates']
+    else:
+        neighbours = nearestNeighbours(space, candidates) if candidates else None
+
+    # Full matrices or candidate edges only
+    if storage == 'dense':
+        result = DenseStorage(space, beta, neighbours, metric, dtype, heuristic, distances)
+    else:
+        result = SparseStorage(space, beta, neighbours, metric, dtype, heuristic)
+
+    # Store preprocessed arrays for the next run
+    if cache is not None and cached is None:
+        arrays = {'heuristic': result.heuristic}
+        if storage == 'dense':
+            arrays['distances'] = result.distances
+        if neighbours is not None:
+            arrays['candidates'] = neighbours
+        cache.save(key, arrays)
+
+    return result
+
+"""
+    Check space - Make sure distances can be computed from a space, storages are built from node coordinates only. A
+    ValueError is raised for anything but a (nodes, 2 or 3) array of numbers, e.g. for an EXPLICIT instance
+    @arg
+        {numpy.ndarray} space       -- The space
+        {string} metric {None}      -- TSPLIB rounding of the distances
+"""
+def checkSpace(space, metric = None):
+    if metric == 'EXPLICIT':
+        raise ValueError('EXPLICIT edge weight instances (EDGE_WEIGHT_SECTION) are not supported, distances are '
+                         'computed from node coordinates')
+
+    array = np.asarray(space)
+    if array.ndim != 2 or array.shape[1] not in (2, 3) or array.dtype.kind not in 'iuf':
+        raise ValueError('The space must be a (nodes, 2 or 3) array of node coordinates, got {} {}; EXPLICIT edge '
+                         'weight instances (EDGE_WEIGHT_SECTION) have none'.format(array.dtype, array.shape))
+
+"""
+    Dense storage - Distances, inverted distances ^ beta and pheromones trail as full space.dimension per
+    space.dimension matrices
+    @arg
+        {numpy.ndarray} space       -- The space
+        {float} beta                -- Beta algorithm parameter, more or less weight to a selected distance
+        {numpy.ndarray} candidates  -- Nearest neighbours candidate lists, full rows if None
+        {string} metric {None}      -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype         -- Type of the distances, inverted distances and pheromones
+        {numpy.ndarray} heuristic   -- Precomputed inverted distances ^ beta, computed if None
+        {numpy.ndarray} distances   -- Precomputed distances, computed if None
+"""
+class DenseStorage:
+    def __init__(self, space, beta, candidates = None, metric = None, dtype = np.float64, heuristic = None,
+                 distances = None):
+        # Distances to all nodes to all nodes
+        if distances is None:
+            distances = distanceMatrix(space, metric, dtype)
+        self.distances = distances
+
+        # Add beta algorithm parameter to inverted distances, in place
+        if heuristic is None:
+            heuristic = invert(distances)
+            if beta != 1:
+                heuristic **= beta
+        self.heuristic = heuristic
+
+        # Empty pheromones trail
+        self.pheromones = np.zeros((space.shape[0], space.shape[0]), dtype = dtype)
+
+        # Nearest neighbours candidate lists
+        self.candidates = candidates
+
+        # Choice info, computed on demand for the alpha of choice_alpha (None when out of date)
+        self.choice = None
+        self.choice_alpha = None
+
+    # Pheromones ^ alpha * inverted distances ^ beta of every edge, computed again only after the trail changed
+    def choiceInfo(self, alpha):
+        if self.choice_alpha != alpha:
+            if self.choice is None or self.choice.shape != self.pheromones.shape:
+                self.choice = np.empty(self.pheromones.shape, dtype = weightType(self))
+            np.copyto(self.choice, self.pheromones)
+            self.choice **= alpha
+            self.choice *= self.heuristic
+            self.choice_alpha = alpha
+
+        return self.choice
+
+    # Put the choice info out of date, after the pheromones or inverted distances were changed directly
+    def invalidate(self):
+        self.choice_alpha = None
+
+    # Probability weights to travel every node from the given rows, into a workspace buffer if any
+    def rowWeights(self, rows, alpha, workspace = None):
+        choice = self.choiceInfo(alpha)
+        if workspace is None:
+            return choice[rows]
+
+        weights = workspace.get('weights', (len(rows), choice.shape[1]), choice.dtype)
+        return np.take(choice, rows, axis = 0, out = weights)
+
+    # Probability weights to travel the candidates of the given rows, into a workspace buffer if any
+    def candidateWeights(self, rows, alpha, workspace = None):
+        choice = self.choiceInfo(alpha)
+        if workspace is None:
+            return choice[rows[:, None], self.candidates[rows]]
+
+        # Flat indexes of the candidate edges, gathered from the flat choice info
+        shape = (len(rows), self.candidates.shape[1])
+        cells = np.take(self.candidates, rows, axis = 0, out = workspace.get('candidate_cells', shape,
+                                                                              self.candidates.dtype))
+        cells += (rows * choice.shape[1])[:, None]
+        return np.take(choice, cells, out = workspace.get('candidate_weights', shape, choice.dtype))
+
+    # Distances of closed paths
+    def pathDistances(self, paths):
+        if KERNELS and paths.ndim == 2:
+            return kernels.tourLengths(paths, self.distances)
+
+        return tourLengths(paths, self.distances)
+
+    # Set the pheromones of every edge
+    def fill(self, value):
+        self.pheromones.fill(value)
+        self.invalidate()
+
+    # Bound the pheromones of every edge
+    def clip(self, low, high):
+        np.clip(self.pheromones, low, high, out = self.pheromones)
+        self.invalidate()
+
+    # Evaporate pheromones
+    def evaporate(self, rho):
+        self.pheromones *= (1 - rho)
+        self.invalidate()
+
+    # Release pheromones on the given edges
+    def deposit(self, rows, columns, amount):
+        if KERNELS:
+            kernels.deposit(self.pheromones, rows, columns, np.broadcast_to(amount, rows.shape))
+        else:
+            np.add.at(self.pheromones, (rows, columns), amount)
+        self.invalidate()
+
+    # Move the pheromones of the given edges towards a value, and their choice info with them
+    def blend(self, rows, columns, rate, value):
+        self.pheromones[rows, columns] = (1 - rate) * self.pheromones[rows, columns] + rate * value
+        if self.choice_alpha is not None:
+            pheromones = self.pheromones[rows, columns] ** self.choice_alpha
+            self.choice[rows, columns] = pheromones * self.heuristic[rows, columns]
+
+"""
+    Sparse storage - Pheromones trail kept only on candidate edges, in a CSR-like layout with a fixed number of entries
+    per row, and inverted distances computed on demand from the space with a LRU cache of full rows. Memory grows as
+    space.dimension * k instead of space.dimension ^ 2
+    @arg
+        {numpy.ndarray} space       -- The space
+        {float} beta                -- Beta algorithm parameter, more or less weight to a selected distance
+        {numpy.ndarray} candidates  -- Nearest neighbours candidate lists (column indexes of every row)
+        {string} metric {None}      -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.dtype} dtype         -- Type of the inverted distances and pheromones
+        {numpy.ndarray} heuristic   -- Precomputed inverted distances ^ beta on candidate edges, computed if None
+        {int} cached_rows {256}     -- Maximum number of full rows kept in the LRU cache
+"""
+class SparseStorage:
+    def __init__(self, space, beta, candidates, metric = None, dtype = np.float64, heuristic = None, cached_rows = 256):
+        # The space, metric and beta algorithm parameter, to compute rows on demand
+        self.space = space
+        self.metric = metric
+        self.dtype = dtype
+        self.beta = beta
+
+        # Column indexes of every row
+        self.candidates = candidates
+
+        # Inverted distances ^ beta and empty pheromones trail on candidate edges
+        if heuristic is None:
+            heuristic = invert(pairDistances(space[:, None, :], space[candidates], metric).astype(dtype, copy = False))
+            if beta != 1:
+                heuristic **= beta
+        self.heuristic = heuristic
+        self.pheromones = np.zeros(candidates.shape, dtype = dtype)
+
+        # Choice info on candidate edges, computed on demand for the alpha of choice_alpha (None when out of date)
+        self.choice = None
+        self.choice_alpha = None
+
+        # Pheromones of the edges that are not candidate edges
+        self.floor = 0.0
+
+        # Least recently used full rows of inverted distances ^ beta
+        self.cached_rows = cached_rows
+        self.rows = OrderedDict()
+
+    # Inverted distances ^ beta from the given rows to every node
+    def heuristicRows(self, rows):
+        # Compute the missing rows at once
+        missing = [row for row in np.unique(rows) if row not in self.rows]
+        if missing:
+            distances = pairDistances(self.space[missing][:, None, :], self.space[None, :, :], self.metric)
+            for row, values in zip(missing, (invert(distances) ** self.beta).astype(self.dtype)):
+                self.rows[row] = values
+
+        # Mark as recently used and drop the least recently used ones
+        for row in rows:
+            self.rows.move_to_end(row)
+        while len(self.rows) > max(self.cached_rows, len(rows)):
+            self.rows.popitem(last = False)
+
+        return np.array([self.rows[row] for row in rows])
+
+    # Full pheromones rows, zero outside candidate edges
+    def pheromoneRows(self, rows):
+        pheromones = np.full((len(rows), self.space.shape[0]), self.floor, dtype = self.pheromones.dtype)
+        np.put_along_axis(pheromones, self.candidates[rows], self.pheromones[rows], axis = 1)
+        return pheromones
+
+    # Probability weights to travel every node from the given rows, computed anew (workspace unused)
+    def rowWeights(self, rows, alpha, workspace = None):
+        return self.pheromoneRows(rows) ** alpha * self.heuristicRows(rows)
+
+    # Probability weights to travel the candidates of the given rows, into a workspace buffer if any
+    def candidateWeights(self, rows, alpha, workspace = None):
+        choice = self.choiceInfo(alpha)
+        if workspace is None:
+            return choice[rows]
+
+        weights = workspace.get('candidate_weights', (len(rows), choice.shape[1]), choice.dtype)
+        return np.take(choice, rows, axis = 0, out = weights)
+
+    # Pheromones ^ alpha * inverted distances ^ beta of every candidate edge, computed again only after the trail
+    # changed
+    def choiceInfo(self, alpha):
+        if self.choice_alpha != alpha:
+            self.choice = self.pheromones ** alpha
+            self.choice *= self.heuristic
+            self.choice_alpha = alpha
+
+        return self.choice
+
+    # Put the choice info out of date, after the pheromones were changed directly
+    def invalidate(self):
+        self.choice_alpha = None
+
+    # Distances of closed paths, from the space
+    def pathDistances(self, paths):
+        edges = pairDistances(self.space[paths], self.space[np.roll(paths, -1, axis = -1)], self.metric)
+        return edges.sum(axis = -1, dtype = np.float64)
+
+    # Set the pheromones of every edge
+    def fill(self, value):
+        self.pheromones.fill(value)
+        self.floor = value
+        self.invalidate()
+
+    # Bound the pheromones of every edge
+    def clip(self, low, high):
+        np.clip(self.pheromones, low, high, out = self.pheromones)
+        self.floor = min(max(self.floor, low), high)
+        self.invalidate()
+
+    # Evaporate pheromones
+    def evaporate(self, rho):
+        self.pheromones *= (1 - rho)
+        self.floor *= (1 - rho)
+        self.invalidate()
+
+    # Release pheromones on the given edges, dropped when they are not candidate edges
+    def deposit(self, rows, columns, amount):
+        rows, slots, found = self.locate(rows, columns)
+        np.add.at(self.pheromones, (rows, slots), np.broadcast_to(amount, found.shape)[found])
+        self.invalidate()
+
+    # Move the pheromones of the given edges towards a value, and their choice info with them, dropped when they are
+    # not candidate edges
+    def blend(self, rows, columns, rate, value):
+        rows, slots, _ = self.locate(rows, columns)
+        self.pheromones[rows, slots] = (1 - rate) * self.pheromones[rows, slots] + rate * value
+        if self.choice_alpha is not None:
+            self.choice[rows, slots] = self.pheromones[rows, slots] ** self.choice_alpha * self.heuristic[rows, slots]
+
+    # Rows and candidate slots of the given edges that are candidate edges, and which ones they are
+    def locate(self, rows, columns):
+        match = self.candidates[rows] == np.asarray(columns)[:, None]
+        found = match.any(axis = 1)
+        return (rows[found], match[found].argmax(axis = 1), found)
+
+"""
+    Invert - Invert distances, zero distances (same or duplicated points) are inverted to zero
+    @arg
+        {numpy.ndarray} distances   -- Distances
+        {numpy.ndarray} out {None}  -- Array to write the inverted distances into, it can be distances itself
+
+    @return
+        {numpy.ndarray}             -- Inverted distances
+"""
+def invert(distances, out = None):
+    # Zero distances are left as zero to prevent zero division error, a single mask
+    if out is None:
+        out = np.zeros_like(distances)
+    nonzero = distances != 0
+    np.divide(1, distances, out = out, where = nonzero)
+    if out is not distances:
+        np.putmask(out, ~nonzero, 0)
+
+    return out
+
+# [4] Cache
+
+"""
+    Instance key - Get a content hash for a given data and the settings it was preprocessed with, the shape and type
+    of an array included so the same bytes in another layout get another key
+    @arg
+        {bytes|numpy.ndarray} data  -- File content or space
+        {*} settings                -- Settings that change the preprocessed arrays
+
+    @return
+        {string}                    -- The key
+"""
+def instanceKey(data, *settings):
+    digest = hashlib.sha1(data.tobytes() if isinstance(data, np.ndarray) else data)
+    if isinstance(data, np.ndarray):
+        digest.update(repr((data.shape, data.dtype.str)).encode())
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
+
+"""
+    Cached TSP data - Get data from a given TSP file, parsed once and stored by content hash
+    @arg
+        {string} tsp                -- The TSP file src
+        {InstanceCache} cache       -- On-disk cache of preprocessed instances
+
+    @return
+        {dictionary}                -- The TSP file as dictionary
+"""
+def cachedTspData(tsp, cache):
+    # Key by file content
+    with open(tsp, 'rb') as infile:
+        key = instanceKey(infile.read(), 'tsp')
+
+    # Parsed headers and sections from a previous run
+    cached = cache.load(key)
+    if cached is not None:
+        src = cache.loadJson(key)
+        src.update(cached)
+        return src
+
+    # Parse and store, sections as arrays and headers as JSON
+    src = getTspData(tsp)
+    sections = {name: value for name, value in src.items() if isinstance(value, np.ndarray)}
+    headers = {name: value for name, value in src.items() if name not in sections}
+    cache.save(key, sections, headers)
+    return src
+
+"""
+    Instance cache - On-disk cache of preprocessed instances, one folder of memory-mapped .npy arrays per key, the least
+    recently used ones are evicted when the folder grows over a size limit
+    @arg
+        {string} folder {'.cache'}  -- The cache folder
+        {int} limit {1 GB}          -- Maximum size of the cache folder in bytes
+"""
+class InstanceCache:
+    def __init__(self, folder = '.cache', limit = 1 << 30):
+        self.folder = folder
+        self.limit = limit
+        os.makedirs(folder, exist_ok = True)
+
+    # Arrays stored for a key, memory-mapped, or None if missing
+    def load(self, key):
+        path = os.path.join(self.folder, key)
+        if not os.path.isdir(path):
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+
+        return {
+            file[:-4]: np.load(os.path.join(path, file), mmap_mode = 'r')
+            for file in os.listdir(path) if file.endswith('.npy')
+        }
+
+    # Dictionary stored along the arrays of a key
+    def loadJson(self, key):
+        with open(os.path.join(self.folder, key, 'data.json')) as infile:
+            return json.load(infile)
+
+    # Store arrays, and optionally a dictionary, for a key
+    def save(self, key, arrays, data = None):
+        # Write in a temporary folder first so readers never see a partial entry
+        path = os.path.join(self.folder, key)
+        partial = '{}.{}.partial'.format(path, os.getpid())
+        os.makedirs(partial, exist_ok = True)
+        for name, array in arrays.items():
+            np.save(os.path.join(partial, name + '.npy'), array)
+        if data is not None:
+            with open(os.path.join(partial, 'data.json'), 'w') as outfile:
+                json.dump(data, outfile)
+
+        # Another process may have stored the same key meanwhile
+        try:
+            os.rename(partial, path)
+        except OSError:
+            shutil.rmtree(partial, ignore_errors = True)
+
+        self.evict()
+
+    # Remove the least recently used keys until the cache fits its size limit
+    def evict(self):
+        entries = []
+        for key in os.listdir(self.folder):
+            path = os.path.join(self.folder, key)
+            if os.path.isdir(path) and not key.endswith('.partial'):
+                size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            shutil.rmtree(path, ignore_errors = True)
+            total -= size
+
+# [5] Islands
+
+# Seconds between checks that the islands are still alive while waiting for their statistics
+ISLAND_POLL = 1.0
+
+"""
+    Run islands - Run Ant Colony Optimization (ACO) with several colonies in separate processes (island model), every
+    colony with its own pheromones trail and random state. Every migration iterations each island sends its best path
+    to the next island in a ring and adopts the ones received when better, releasing pheromones along them. A failed
+    island, or one that ends without reporting (killed), raises a RuntimeError
+    @arg
+        {numpy.ndarray} space           -- The space
+        {int} islands {4}               -- Number of colonies, one process each
+        {int} migration {10}            -- Iterations between migrations
+        {bool} merge {False}            -- Also send the pheromones trail and average it with the received one
+        {**} kwargs                     -- runAcoTsp algorithm parameters (iterations, colony, alpha, beta, ...), the
+                                           seed gives every island an independent stream (SeedSequence.spawn), runs
+                                           are only reproduced without migration as it depends on timing
+
+    @return
+        {Tuple(numpy.ndarray, float, list)} -- Indexes of the minimun distance path, the minimun distance and a
+                                               dictionary of statistics per island
+"""
+def runIslands(space, islands = 4, migration = 10, merge = False, **kwargs):
+    # Reject a variant the ending conditions do not apply to before starting any process
+    Termination(branching = kwargs.get('branching')).check(makeEngine(kwargs.get('variant', 'as')))
+
+    # One inbox per island and a single outbox for results
+    inboxes = [multiprocessing.Queue() for _ in range(islands)]
+    results = multiprocessing.Queue()
+
+    # Independent random numbers per island
+    kwargs = dict(kwargs)
+    seeds = spawnSeeds(kwargs.pop('seed', None), islands)
+
+    # Start every island
+    processes = [
+        multiprocessing.Process(target = runIsland,
+                                args = (island, space, inboxes[island], inboxes[(island + 1) % islands], results,
+                                        migration, merge, seeds[island], kwargs))
+        for island in range(islands)
+    ]
+    for process in processes:
+        process.start()
+
+    # Collect statistics as islands finish, an island ended without reporting (killed, out of memory) stops them all
+    stats = []
+    errors = []
+    pending = set(range(islands))
+    while pending:
+        try:
+            island, result = results.get(timeout = ISLAND_POLL)
+        except queue.Empty:
+            dead = [island for island in sorted(pending) if processes[island].exitcode not in (None, 0)]
+            if dead:
+                for process in processes:
+                    process.terminate()
+                    process.join()
+                raise RuntimeError('Island {} ended with exit code {} before reporting'.format(
+                    dead[0], processes[dead[0]].exitcode))
+            continue
+
+        pending.discard(island)
+        if isinstance(result, str):
+            errors.append('Island {} failed:\n{}'.format(island, result))
+        else:
+            stats.append(result)
+
+    for process in processes:
+        process.join()
+
+    if errors:
+        raise RuntimeError('\n'.join(errors))
+
+    # Global minimum path and distance
+    stats.sort(key = lambda stat: stat['island'])
+    best = min(stats, key = lambda stat: stat['min_distance'])
+    return (best['min_path'], best['min_distance'], stats)
+
+"""
+    Run island - A single colony of the island model, run in its own process
+    @arg
+        {int} island                    -- The island number
+        {numpy.ndarray} space           -- The space
+        {multiprocessing.Queue} inbox   -- Paths (and pheromones) migrating to this island
+        {multiprocessing.Queue} outbox  -- Inbox of the next island
+        {multiprocessing.Queue} results -- Statistics of every island, or a traceback if it failed
+        {int} migration                 -- Iterations between migrations
+        {bool} merge                    -- Also send the pheromones trail and average it with the received one
+        {numpy.random.SeedSequence} seed    -- Seed of the random numbers of the island
+        {dict} kwargs                   -- runAcoTsp algorithm parameters
+"""
+def runIsland(island, space, inbox, outbox, results, migration, merge, seed, kwargs):
+    # Whether the previous island is done sending
+    drained = False
+    try:
+        # Own random numbers, independent of the other islands
+        rng = np.random.default_rng(seed)
+
+        # Algorithm parameters and ending conditions
+        beta = kwargs.get('beta', 1.0)
+        metric = kwargs.get('metric')
+        termination = Termination(kwargs.get('iterations', 80), kwargs.get('time_budget'), kwargs.get('stagnation'),
+                                  kwargs.get('branching'), kwargs.get('target'), kwargs.get('gap', 0.0))
+
+        # Inverted distances ^ beta and empty pheromones trail for all nodes
+        storage = makeStorage(space, kwargs.get('storage', 'dense'), beta, kwargs.get('candidates'), metric,
+                              kwargs.get('dtype', np.float64), kwargs.get('cache'))
+
+        # Neighbour lists for the local search, the candidate lists if any
+        search = makeSearch(space, storage, kwargs.get('local_search'), kwargs.get('search_scope', 'best'), metric)
+
+        # Initial pheromones trail of the variant
+        engine = makeEngine(kwargs.get('variant', 'as'))
+        engine.start(space, storage, kwargs.get('colony', 50), kwargs.get('alpha', 1.0), beta,
+                     kwargs.get('del_tau', 1.0), kwargs.get('rho', 0.5))
+
+        # Empty minimum distance and path, and statistics
+        min_distance = None
+        min_path = None
+        history = []
+        received = 0
+        adopted = 0
+
+        # Buffers of the colony, reused by every iteration
+        workspace = Workspace()
+
+        while not termination.done(min_distance, storage, engine):
+            # Move the colony and measure its paths
+            paths, distances = runIteration(space, storage, engine, search, rng, workspace = workspace)
+
+            # Update minimun distance and path if less
+            best = np.argmin(distances)
+            improved = min_distance is None or distances[best] < min_distance
+            if improved:
+                min_distance = distances[best]
+                min_path = paths[best].astype(int)
+            history.append(min_distance)
+            termination.record(improved)
+
+            # Migrate every few iterations
+            if len(history) % migration:
+                continue
+
+            outbox.put((min_path, min_distance, storage.pheromones if merge else None))
+
+            # Adopt every received path that is better than ours, until the previous island is done
+            while not drained:
+                try:
+                    migrant = inbox.get_nowait()
+                except queue.Empty:
+                    break
+
+                if migrant is None:
+                    drained = True
+                    break
+                path, distance, pheromones = migrant
+
+                received += 1
+                if pheromones is not None:
+                    storage.pheromones += pheromones
+                    storage.pheromones /= 2
+                    storage.invalidate()
+
+                if distance < min_distance:
+                    termination.stale = 0
+                    adopted += 1
+                    min_distance = distance
+                    min_path = path
+                    engine.adopt(storage, path, distance)
+
+        results.put((island, {
+            'island': island,
+            'min_path': closedPath(min_path),
+            'min_distance': min_distance,
+            'history': np.array(history),
+            'iterations': termination.iteration,
+            'reason': termination.reason,
+            'received': received,
+            'adopted': adopted
+        }))
+    except Exception:
+        results.put((island, traceback.format_exc()))
+    finally:
+        # Tell the next island nothing else is coming and read every migration until the previous island says the
+        # same, so no queue is left half written (a trail is larger than a pipe) and all of them flush on exit
+        outbox.put(None)
+        while not drained:
+            drained = inbox.get() is None
+
+# [6] Local search
+
+"""
+    Local search - Improve a path with 2-opt and/or Or-opt moves until no move improves it. With the distance matrix
+    of the run, moves are measured on the same distances as the paths (tourLengths) and the path is only replaced when
+    tourLengths finds it shorter
+    @arg
+        {numpy.ndarray} path            -- Indexes of the path, open (first node not repeated at the end)
+        {numpy.ndarray} space           -- The space
+        {numpy.ndarray} neighbours      -- Nearest neighbours candidate lists, closest first
+        {string} method {'2-opt'}       -- '2-opt', 'or-opt' or '2-opt+or-opt'
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.ndarray} distances {None}    -- Distances between all nodes, computed from the space as needed if None
+
+    @return
+        {numpy.ndarray}                 -- Indexes of the improved path, open
+"""
+def localSearch(path, space, neighbours, method = '2-opt', metric = None, distances = None):
+    if method not in ('2-opt', 'or-opt', '2-opt+or-opt'):
+        raise ValueError('Unknown local search: {}'.format(method))
+
+    # Distance between two nodes, on plain Python floats for speed
+    distance = nodeDistance(space, metric, distances)
+    neighbours = neighbours.tolist()
+    original = path
+    path = np.array(path)
+
+    # Alternate until Or-opt can not improve the 2-opt local optimum either
+    while True:
+        if method != 'or-opt':
+            path = twoOpt(path, distance, neighbours)
+        if method == '2-opt' or not orOpt(path, distance, neighbours):
+            break
+
+    # Moves add up their gains, rounding included, so the path is kept only if measured shorter as a whole
+    if distances is not None and tourLengths(path, distances) > tourLengths(original, distances):
+        return np.array(original)
+
+    return path
+
+"""
+    Node distance - Get a function giving the distance between two nodes of the space
+    @arg
+        {numpy.ndarray} space           -- The space
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.ndarray} distances {None}    -- Distances between all nodes, read instead of computed if given
+
+    @return
+        {function}                      -- Distance between two node indexes
+"""
+def nodeDistance(space, metric = None, distances = None):
+    if distances is not None:
+        return distances.item
+
+    points = space.tolist()
+
+    if metric == 'EUC_2D':
+        return lambda a, b: math.floor(math.dist(points[a], points[b]) + 0.5)
+
+    if metric == 'CEIL_2D':
+        return lambda a, b: math.ceil(math.dist(points[a], points[b]))
+
+    return lambda a, b: math.dist(points[a], points[b])
+
+"""
+    2-opt - Replace two edges by two shorter ones, reversing the path between them. Only nearest neighbours are tried
+    as new endpoints, and nodes whose neighbourhood did not change are skipped (don't-look bits)
+    @arg
+        {numpy.ndarray} path            -- Indexes of the path, open
+        {function} distance             -- Distance between two node indexes
+        {list} neighbours               -- Nearest neighbours candidate lists, closest first
+
+    @return
+        {numpy.ndarray}                 -- Indexes of the improved path
+"""
+def twoOpt(path, distance, neighbours):
+    # Position of every node in the path
+    nodes = path.shape[0]
+    position = np.empty(nodes, dtype = int)
+    position[path] = np.arange(nodes)
+
+    # Nodes to look at, all at first
+    active = deque(path.tolist())
+    looking = np.ones(nodes, dtype = bool)
+
+    while active:
+        a = active.popleft()
+        looking[a] = False
+
+        # New edge (a, c) replacing (a, b), both with b after a and with b before a
+        moved = False
+        for forward in (True, False):
+            if moved:
+                break
+
+            i = position[a]
+            b = path[(i + 1) % nodes] if forward else path[i - 1]
+            ab = distance(a, b)
+
+            for c in neighbours[a]:
+                # Neighbours are sorted, no farther one can shorten (a, b)
+                ac = distance(a, c)
+                if ac >= ab:
+                    break
+
+                j = position[c]
+                d = path[(j + 1) % nodes] if forward else path[j - 1]
+                if c == b or d == a:
+                    continue
+
+                # Replace (a, b) and (c, d) by (a, c) and (b, d)
+                if ac + distance(b, d) - ab - distance(c, d) < -1e-9:
+                    if forward:
+                        reverseSegment(path, position, position[b], j)
+                    else:
+                        reverseSegment(path, position, i, position[d])
+
+                    # Look again at the nodes whose edges changed
+                    for node in (a, b, c, d):
+                        if not looking[node]:
+                            looking[node] = True
+                            active.append(node)
+                    moved = True
+                    break
+
+    return path
+
+"""
+    Reverse segment - Reverse in place the path from one position to another, going forward and wrapping around. The
+    shorter of the segment and its complement is reversed, both give the same closed path
+    @arg
+        {numpy.ndarray} path            -- Indexes of the path
+        {numpy.ndarray} position        -- Position of every node in the path, updated
+        {int} i                         -- First position of the segment
+        {int} j                         -- Last position of the segment
+"""
+def reverseSegment(path, position, i, j):
+    nodes = path.shape[0]
+    length = (j - i) % nodes + 1
+    if 2 * length > nodes:
+        i, j = (j + 1) % nodes, (i - 1) % nodes
+        length = nodes - length
+
+    # Contiguous slice, or indexes wrapping around
+    if i <= j:
+        segment = slice(i, j + 1)
+        indexes = np.arange(i, j + 1)
+    else:
+        segment = indexes = (i + np.arange(length)) % nodes
+
+    path[segment] = path[segment][::-1]
+    position[path[segment]] = indexes
+
+"""
+    Or-opt - Move segments of one to three nodes between two other nodes, in either direction. Only nearest neighbours
+    of the segment ends are tried as new neighbours, and segments whose neighbourhood did not change are skipped
+    (don't-look bits)
+    @arg
+        {numpy.ndarray} path            -- Indexes of the path, open (improved in place)
+        {function} distance             -- Distance between two node indexes
+        {list} neighbours               -- Nearest neighbours candidate lists, closest first
+
+    @return
+        {bool}                          -- Whether the path was improved
+"""
+def orOpt(path, distance, neighbours):
+    # Position of every node in the path
+    nodes = path.shape[0]
+    position = np.empty(nodes, dtype = int)
+    position[path] = np.arange(nodes)
+
+    # Segment starts to look at, all at first
+    active = deque(path.tolist())
+    looking = np.ones(nodes, dtype = bool)
+    improved = False
+
+    while active:
+        first = active.popleft()
+        looking[first] = False
+
+        for length in range(1, min(3, nodes - 3) + 1):
+            # Segment, its previous and next nodes
+            i = position[first]
+            last = path[(i + length - 1) % nodes]
+            before = path[i - 1]
+            after = path[(i + length) % nodes]
+            segment = set(path[(i + np.arange(length)) % nodes].tolist())
+
+            # Gain of removing the segment
+            gain = distance(before, first) + distance(last, after) - distance(before, after)
+
+            # Insert between c and its next node e, as is or reversed
+            move = None
+            for end in (first, last):
+                for c in neighbours[end]:
+                    if distance(end, c) >= gain:
+                        break
+
+                    e = path[(position[c] + 1) % nodes]
+                    if c in segment or e in segment or c == before:
+                        continue
+
+                    ce = distance(c, e)
+                    if distance(c, first) + distance(last, e) - ce < gain - 1e-9:
+                        move = (c, e, False)
+                    elif distance(c, last) + distance(first, e) - ce < gain - 1e-9:
+                        move = (c, e, True)
+                    if move:
+                        break
+                if move:
+                    break
+
+            if not move:
+                continue
+
+            # Rebuild the path with the segment moved after c
+            c, e, reverse = move
+            moved = path[(i + np.arange(length)) % nodes]
+            rest = np.roll(path, -(i + length))[:nodes - length]
+            k = int(np.flatnonzero(rest == c)[0]) + 1
+            path[:] = np.concatenate((rest[:k], moved[::-1] if reverse else moved, rest[k:]))
+            position[path] = np.arange(nodes)
+            improved = True
+
+            # Look again at the nodes whose edges changed
+            for node in (before, after, first, last, c, e):
+                if not looking[node]:
+                    looking[node] = True
+                    active.append(node)
+            break
+
+    return improved
+
+# [7] Variants
+
+"""
+    Make engine - Get the pheromones update rule of a given variant
+    @arg
+        {string|AntSystem} variant      -- 'as', 'mmas', 'acs' or an AntSystem instance
+
+    @return
+        {AntSystem}                     -- The variant
+"""
+def makeEngine(variant):
+    if isinstance(variant, AntSystem):
+        return variant
+
+    engines = {'as': AntSystem, 'mmas': MaxMinAntSystem, 'acs': AntColonySystem}
+    if variant not in engines:
+        raise ValueError('Unknown variant: {}'.format(variant))
+
+    return engines[variant]()
+
+"""
+    Ant System (AS) - Every ant releases del_tau / distance on the edges of its path after the whole trail evaporates.
+    Base of the other variants, which override start, local and update
+"""
+class AntSystem:
+    # Probability of taking the most probable node instead of a random one
+    q0 = 0.0
+
+    # Whether the lambda-branching factor of the trail tells convergence
+    converges = True
+
+    # No update while the ants move
+    local = None
+
+    # Keep the algorithm parameters and set the initial pheromones trail
+    def start(self, space, storage, colony, alpha, beta, del_tau, rho):
+        self.nodes = space.shape[0]
+        self.colony = colony
+        self.alpha = alpha
+        self.beta = beta
+        self.del_tau = del_tau
+        self.rho = rho
+
+        # Best path so far
+        self.min_path = None
+        self.min_distance = np.inf
+
+        # Greedy nearest neighbour path, its distance is the usual scale of the initial trail
+        storage.fill(1.0)
+        self.greedy_path, self.greedy_distance = greedyPath(space, storage)
+        storage.fill(colony * del_tau / self.greedy_distance)
+
+    # Evaporate and release pheromones after an iteration
+    def update(self, storage, paths, distances):
+        self.track(paths, distances)
+        storage.evaporate(self.rho)
+        self.release(storage, paths, self.del_tau / distances)
+
+    # A path found elsewhere (e.g. another island) becomes the best so far if shorter
+    def adopt(self, storage, path, distance):
+        if distance < self.min_distance:
+            self.min_path = path
+            self.min_distance = distance
+        self.release(storage, path[None, :], self.del_tau / np.array([distance]))
+
+    # Warm start from a known path, its edges receive as much pheromones as a whole colony would release on it
+    def seed(self, storage, path, distance):
+        self.track(path[None, :], np.array([distance]))
+        self.release(storage, path[None, :], np.array([self.colony * self.del_tau / distance]))
+
+    # State to resume from, besides the pheromones trail
+    def getState(self):
+        return {'min_path': self.min_path.tolist(), 'min_distance': float(self.min_distance)}
+
+    # Resume from a state of getState
+    def setState(self, state):
+        self.min_path = np.array(state['min_path'], dtype = int)
+        self.min_distance = state['min_distance']
+
+    # Bounds of the trail (tau_min, tau_max), none if unbounded
+    def limits(self):
+        return None
+
+    # Keep the best path so far, whether it improved
+    def track(self, paths, distances):
+        best = np.argmin(distances)
+        if distances[best] < self.min_distance:
+            self.min_path = paths[best].astype(int)
+            self.min_distance = distances[best]
+            return True
+
+        return False
+
+    # Release an amount per path on its edges, in both directions
+    def release(self, storage, paths, amounts):
+        rows = paths.ravel()
+        columns = np.roll(paths, -1, axis = 1).ravel()
+        amounts = np.repeat(amounts, paths.shape[1])
+        storage.deposit(rows, columns, amounts)
+        storage.deposit(columns, rows, amounts)
+
+"""
+    MAX-MIN Ant System (MMAS) - Only the best path so far releases pheromones, the trail is bounded between tau_min and
+    tau_max and set back to tau_max when the best path does not improve for a number of iterations
+    @arg
+        {float} p_best {0.05}           -- Probability of building the best path once converged, sets tau_min
+        {int} stagnation {50}           -- Iterations without improvement before the trail is set back to tau_max
+"""
+class MaxMinAntSystem(AntSystem):
+    def __init__(self, p_best = 0.05, stagnation = 50):
+        self.p_best = p_best
+        self.stagnation = stagnation
+
+    # Start at tau_max of the greedy path
+    def start(self, space, storage, colony, alpha, beta, del_tau, rho):
+        super().start(space, storage, colony, alpha, beta, del_tau, rho)
+        self.stale = 0
+        storage.fill(self.bounds(self.greedy_distance)[1])
+
+    # Evaporate, release on the best path so far and bound the trail
+    def update(self, storage, paths, distances):
+        self.stale = 0 if self.track(paths, distances) else self.stale + 1
+        low, high = self.bounds(self.min_distance)
+
+        # Stagnation, start over from tau_max
+        if self.stale >= self.stagnation:
+            self.stale = 0
+            storage.fill(high)
+            return
+
+        storage.evaporate(self.rho)
+        self.release(storage, self.min_path[None, :], self.del_tau / np.array([self.min_distance]))
+        storage.clip(low, high)
+
+    # Warm start, the known path is the best so far and bounds the trail
+    def seed(self, storage, path, distance):
+        super().seed(storage, path, distance)
+        storage.clip(*self.bounds(self.min_distance))
+
+    # The stagnation count is part of the state
+    def getState(self):
+        return dict(super().getState(), stale = self.stale)
+
+    def setState(self, state):
+        super().setState(state)
+        self.stale = state['stale']
+
+    # Bounds of the trail for the best distance so far
+    def limits(self):
+        return self.bounds(self.min_distance)
+
+    # Bounds of the trail for a given best distance
+    def bounds(self, distance):
+        high = self.del_tau / (self.rho * distance)
+        root = self.p_best ** (1 / self.nodes)
+        low = high * (1 - root) / (max(self.nodes / 2 - 1, 1) * root)
+        return (min(low, high), high)
+
+"""
+    Ant Colony System (ACS) - Ants take the most probable node with probability q0, every edge taken moves its
+    pheromones towards tau0 (local update), and only the edges of the best path so far evaporate and receive pheromones
+    @arg
+        {float} q0 {0.9}                -- Probability of taking the most probable node instead of a random one
+        {float} xi {0.1}                -- Local update rate
+"""
+class AntColonySystem(AntSystem):
+    # Only the edges of best paths rise over tau0, the branching factor is about 2 from the first iteration
+    converges = False
+
+    def __init__(self, q0 = 0.9, xi = 0.1):
+        self.q0 = q0
+        self.xi = xi
+
+    # Start at tau0 of the greedy path
+    def start(self, space, storage, colony, alpha, beta, del_tau, rho):
+        super().start(space, storage, colony, alpha, beta, del_tau, rho)
+        self.tau0 = 1 / (self.nodes * self.greedy_distance)
+        storage.fill(self.tau0)
+
+    # Local update, the edges just taken lose pheromones so the next ants explore
+    def local(self, storage, rows, columns):
+        storage.blend(rows, columns, self.xi, self.tau0)
+        storage.blend(columns, rows, self.xi, self.tau0)
+
+    # Global update on the edges of the best path so far
+    def update(self, storage, paths, distances):
+        self.track(paths, distances)
+        rows = self.min_path
+        columns = np.roll(rows, -1)
+        storage.blend(rows, columns, self.rho, self.del_tau / self.min_distance)
+        storage.blend(columns, rows, self.rho, self.del_tau / self.min_distance)
+
+    # Warm start, a global update on the known path
+    def seed(self, storage, path, distance):
+        self.update(storage, path[None, :], np.array([distance]))
+
+"""
+    Greedy path - Get a nearest neighbour path from the first node, built before any pheromones
+    @arg
+        {numpy.ndarray} space           -- The space
+        {Storage} storage               -- Inverted distances ^ beta, with an uniform pheromones trail
+
+    @return
+        {Tuple(numpy.ndarray, float)}   -- Indexes of the path, open, and its distance
+"""
+def greedyPath(space, storage):
+    # Always the most probable node, whatever the random numbers
+    path = moveAnts(space, np.zeros(1, dtype = int), storage, 1.0, 1.0, q0 = 1.0, rng = 0)
+    return (path[0].astype(int), storage.pathDistances(path)[0])
+
+"""
+    Warm start - Seed the pheromones trail of a started engine with a known path
+    @arg
+        {numpy.ndarray} space                   -- The space
+        {Storage} storage                       -- Inverted distances ^ beta and pheromones trail
+        {AntSystem} engine                      -- The started variant
+        {numpy.ndarray|string} initial_path     -- Indexes of the path, open or closed, or 'greedy'
+
+    @return
+        {Tuple(numpy.ndarray, float)}           -- Indexes of the path, open, and its distance
+"""
+def warmStart(space, storage, engine, initial_path):
+    if isinstance(initial_path, str):
+        if initial_path != 'greedy':
+            raise ValueError('Unknown initial path: {}'.format(initial_path))
+        path = engine.greedy_path
+    else:
+        path = np.asarray(initial_path, dtype = int)
+
+    # Open a closed path, it must visit every node once
+    nodes = space.shape[0]
+    if path.shape == (nodes + 1,) and path[0] == path[-1]:
+        path = path[:-1]
+    if path.shape != (nodes,) or not np.array_equal(np.sort(path), np.arange(nodes)):
+        raise ValueError('The initial path must visit each of the {} nodes once'.format(nodes))
+
+    distance = storage.pathDistances(path[None, :])[0]
+    engine.seed(storage, path, distance)
+    return (path, distance)
+
+# [8] Checkpoints
+
+"""
+    Save checkpoint - Write the state of a run, pheromones trail, best path, progress and random state, so it can be
+    resumed. Written to a temporary file first, an interrupted save keeps the previous checkpoint
+    @arg
+        {string} file                   -- The checkpoint file (.npz)
+        {Storage} storage               -- Pheromones trail
+        {AntSystem} engine              -- The variant
+        {Termination} termination       -- Progress of the run
+        {numpy.random.Generator} rng    -- Random numbers of the run
+"""
+def saveCheckpoint(file, storage, engine, termination, rng):
+    state = {
+        'engine': engine.getState(),
+        'iteration': termination.iteration,
+        'stale': termination.stale,
+        'floor': float(getattr(storage, 'floor', 0.0)),
+        'random': rng.bit_generator.state
+    }
+
+    partial = '{}.partial.npz'.format(file)
+    np.savez(partial, pheromones = storage.pheromones, state = json.dumps(state))
+    os.replace(partial, file)
+
+"""
+    Load checkpoint - Restore the state of a run saved by saveCheckpoint, on a started engine of the same instance
+    @arg
+        {string} file                   -- The checkpoint file (.npz)
+        {Storage} storage               -- Pheromones trail, restored
+        {AntSystem} engine              -- The started variant, restored
+        {Termination} termination       -- Progress of the run, restored
+        {numpy.random.Generator} rng    -- Random numbers of the run, restored
+
+    @return
+        {Tuple(numpy.ndarray, float)}   -- Indexes of the minimum distance path so far, open, and its distance
+"""
+def loadCheckpoint(file, storage, engine, termination, rng):
+    with np.load(file) as checkpoint:
+        pheromones = checkpoint['pheromones']
+        state = json.loads(str(checkpoint['state']))
+
+    if pheromones.shape != storage.pheromones.shape:
+        raise ValueError('Checkpoint of another instance or storage: pheromones {} instead of {}'.format(
+            pheromones.shape, storage.pheromones.shape))
+
+    storage.pheromones[...] = pheromones
+    storage.invalidate()
+    if hasattr(storage, 'floor'):
+        storage.floor = state['floor']
+
+    engine.setState(state['engine'])
+    termination.iteration = state['iteration']
+    termination.stale = state['stale']
+    rng.bit_generator.state = state['random']
+
+    return (engine.min_path.copy(), engine.min_distance)
+
+# [9] Dynamic instances
+
+"""
+    Dynamic TSP - A dense instance whose nodes are inserted, deleted or moved while it is optimized. Only the distances,
+    inverted distances and candidate lists of the affected nodes are computed again, the pheromones trail is remapped
+    (the edges of the changed nodes start at the mean of the trail) and the best path so far is repaired by cheapest
+    insertion, so optimization goes on from there
+    @arg
+        {numpy.ndarray} space           -- The space
+        {*} ...                         -- The runAcoTsp algorithm arguments: colony, alpha, beta, del_tau, rho,
+                                           candidates, metric, dtype, local_search, search_scope, variant,
+                                           initial_path and seed
+"""
+class DynamicTsp:
+    def __init__(self, space, colony = 50, alpha = 1.0, beta = 1.0, del_tau = 1.0, rho = 0.5, candidates = None,
+                 metric = None, dtype = np.float64, local_search = None, search_scope = 'best', variant = 'as',
+                 initial_path = None, seed = None):
+        self.space = np.array(space, dtype = float)
+        self.rng = np.random.default_rng(seed)
+        self.beta = beta
+        self.candidates = candidates
+        self.metric = metric
+        self.local_search = local_search
+        self.search_scope = search_scope
+
+        # Inverted distances ^ beta, pheromones trail and started variant, as in iterateAcoTsp
+        self.storage = makeStorage(self.space, 'dense', beta, candidates, metric, dtype)
+        self.search = makeSearch(self.space, self.storage, local_search, search_scope, metric)
+        self.engine = makeEngine(variant)
+        self.engine.start(self.space, self.storage, colony, alpha, beta, del_tau, rho)
+        if initial_path is not None:
+            warmStart(self.space, self.storage, self.engine, initial_path)
+
+        # Buffers the matrices are views of, with a quarter of spare capacity so the first inserts copy nothing, see
+        # resize
+        self.buffers = {name: getattr(self.storage, name) for name in ('distances', 'heuristic', 'pheromones')}
+        self.reserve(self.nodes + self.nodes // 4)
+
+    # Number of nodes
+    @property
+    def nodes(self):
+        return self.space.shape[0]
+
+    # Best path so far, open, and its distance, None before any iteration
+    @property
+    def best(self):
+        if self.engine.min_path is None:
+            return (None, None)
+
+        return (self.engine.min_path, self.engine.min_distance)
+
+    # Run the colony from the current trail and best path, yielding the iterateAcoTsp events
+    def iterate(self, iterations = 80, time_budget = None, stagnation = None, branching = None, target = None,
+                gap = 0.0, report = 1, timings = None):
+        termination = Termination(iterations, time_budget, stagnation, branching, target, gap)
+        termination.check(self.engine)
+        min_path, min_distance = self.best
+        yield from iterateEngine(self.space, self.storage, self.engine, self.search, termination, self.rng,
+                                 min_path, min_distance, report, timings = timings)
+
+    # Run the colony and return the minimum distance path, closed, and its distance
+    def run(self, **conditions):
+        for event in self.iterate(**conditions):
+            pass
+
+        return (event['path'], event['distance'])
+
+    # Add points as new nodes at the end, returns their indexes
+    def insert(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype = float))
+        nodes = self.nodes
+        added = np.arange(nodes, nodes + points.shape[0])
+        trail = self.trail()
+        self.space = np.concatenate((self.space, points))
+
+        # The new rows and columns are set by refresh
+        self.resize(self.nodes)
+        self.refresh(added, trail)
+        self.repair(self.engine.min_path, added)
+        return added
+
+    # Remove nodes, the last nodes take their places, returns the new index of every node (-1 if deleted)
+    def delete(self, nodes):
+        storage = self.storage
+        origin = np.arange(self.nodes)
+
+        # From the highest, so the last node is never one to delete
+        for node in np.unique(nodes)[::-1]:
+            last = origin.shape[0] - 1
+            if node != last:
+                for matrix in (storage.distances, storage.heuristic, storage.pheromones):
+                    matrix[node] = matrix[last]
+                    matrix[:, node] = matrix[:, last]
+                    matrix[node, node] = matrix[last, last]
+                self.space[node] = self.space[last]
+                origin[node] = origin[last]
+                if storage.candidates is not None:
+                    storage.candidates[node] = storage.candidates[last]
+
+            origin = origin[:last]
+            self.space = self.space[:last]
+            self.resize(last)
+
+        # New index of every node
+        index = np.full(len(origin) + len(np.unique(nodes)), -1)
+        index[origin] = np.arange(len(origin))
+
+        # Candidate lists that lost a node are computed again, the others are renumbered
+        if storage.candidates is not None:
+            candidates = index[storage.candidates[:self.nodes]]
+            storage.candidates = candidates
+            self.updateCandidates(np.flatnonzero((candidates < 0).any(axis = 1)))
+
+        self.search = makeSearch(self.space, storage, self.local_search, self.search_scope, self.metric)
+        path = self.engine.min_path
+        self.repair(None if path is None else index[path][index[path] >= 0], [])
+        return index
+
+    # Move nodes to new points
+    def move(self, nodes, points):
+        nodes = np.atleast_1d(nodes)
+        self.space[nodes] = np.atleast_2d(np.asarray(points, dtype = float))
+        self.refresh(nodes, self.trail())
+
+        # Take the moved nodes out of the best path and insert them back
+        path = self.engine.min_path
+        self.repair(None if path is None else path[~np.isin(path, nodes)], nodes)
+
+    # Matrices as views of buffers grown by a quarter when full, so few changes copy them
+    def resize(self, nodes):
+        capacity = self.buffers['distances'].shape[0]
+        if nodes > capacity:
+            self.reserve(max(nodes, capacity + capacity // 4))
+
+        storage = self.storage
+        for name, buffer in self.buffers.items():
+            setattr(storage, name, buffer[:nodes, :nodes])
+        storage.invalidate()
+
+    # Buffers for up to capacity nodes, the matrices copied into them
+    def reserve(self, capacity):
+        storage = self.storage
+        for name, buffer in self.buffers.items():
+            matrix = getattr(storage, name)
+            nodes = matrix.shape[0]
+            buffer = self.buffers[name] = np.empty((capacity, capacity), dtype = buffer.dtype)
+            buffer[:nodes, :nodes] = matrix
+            setattr(storage, name, buffer[:nodes, :nodes])
+
+    # Mean of the pheromones trail, estimated on up to 64 evenly spaced rows
+    def trail(self):
+        return self.storage.pheromones[::max(self.nodes // 64, 1)].mean()
+
+    # Distances, inverted distances ^ beta, pheromones and candidate lists of changed nodes
+    def refresh(self, changed, trail):
+        storage = self.storage
+        distances = pairDistances(self.space[changed, None, :], self.space[None, :, :], self.metric)
+        storage.distances[changed] = distances
+        storage.distances[:, changed] = distances.T
+
+        heuristic = invert(distances.astype(storage.heuristic.dtype))
+        if self.beta != 1:
+            heuristic **= self.beta
+        storage.heuristic[changed] = heuristic
+        storage.heuristic[:, changed] = heuristic.T
+
+        # New edges start at the mean of the trail
+        storage.pheromones[changed] = trail
+        storage.pheromones[:, changed] = trail
+        storage.invalidate()
+
+        # The changed nodes, the nodes that had them as candidates and the ones they are now closer to than their
+        # farthest candidate
+        if storage.candidates is not None:
+            candidates = storage.candidates
+            if candidates.shape[0] < self.nodes:
+                candidates = np.concatenate((candidates, np.zeros((self.nodes - candidates.shape[0],
+                                                                   candidates.shape[1]), dtype = candidates.dtype)))
+                storage.candidates = candidates
+
+            farthest = storage.distances[np.arange(self.nodes), candidates[:, -1]]
+            affected = np.isin(candidates, changed).any(axis = 1) | (distances < farthest).any(axis = 0)
+            affected[changed] = True
+            self.updateCandidates(np.flatnonzero(affected))
+
+        self.search = makeSearch(self.space, storage, self.local_search, self.search_scope, self.metric)
+
+    # Nearest neighbours candidate lists of the given rows, from their distances
+    def updateCandidates(self, rows):
+        if not len(rows):
+            return
+
+        candidates = self.storage.candidates
+        k = min(candidates.shape[1], self.nodes - 1)
+        distances = self.storage.distances[rows].astype(float)
+        distances[np.arange(len(rows)), rows] = np.inf
+
+        # Unordered k nearest, then sorted closest first
+        nearest = np.argpartition(distances, k - 1, axis = 1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, nearest, axis = 1), axis = 1)
+        if k < candidates.shape[1]:
+            candidates = candidates[:, :k]
+        candidates[rows] = np.take_along_axis(nearest, order, axis = 1)
+        self.storage.candidates = candidates
+
+    # Best path so far made of the remaining nodes, with the given ones inserted where they cost the least
+    def repair(self, path, inserted):
+        self.engine.nodes = self.nodes
+        if path is None:
+            return
+
+        distances = self.storage.distances
+        for node in inserted:
+            following = np.roll(path, -1)
+            cost = distances[path, node] + distances[node, following] - distances[path, following]
+            path = np.insert(path, np.argmin(cost) + 1, node)
+
+        # The repaired path is the best so far on the changed instance
+        self.engine.min_path = path
+        self.engine.min_distance = self.storage.pathDistances(path)
+        if hasattr(self.engine, 'stale'):
+            self.engine.stale = 0
+
+# [10] Instrumentation
+
+"""
+    Timings - Cumulative seconds and calls of every phase of a run, measured around whole phases so the overhead is a
+    few microseconds per iteration. Each measure may also go to a callback and to a trace
+    @arg
+        {function} callback {None}      -- Called with the phase name and seconds of every measure, e.g. to export to
+                                           a metrics system
+        {bool} trace {False}            -- Keep every measure, for saveTrace
+"""
+class Timings:
+    def __init__(self, callback = None, trace = False):
+        self.callback = callback
+        self.seconds = {}
+        self.calls = {}
+        self.events = [] if trace else None
+        self.started = time.perf_counter()
+
+    # Measure the block of a with statement
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start)
+
+    # Count a measure
+    def add(self, name, start, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.events is not None:
+            self.events.append((name, start, seconds))
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    # Seconds, calls and share of the measured time of every phase
+    def summary(self):
+        total = sum(self.seconds.values()) or 1.0
+        return {
+            name: {'seconds': seconds, 'calls': self.calls[name], 'share': seconds / total}
+            for name, seconds in sorted(self.seconds.items(), key = lambda item: -item[1])
+        }
+
+    # Write the measures as a Chrome trace (JSON), viewable in chrome://tracing or Perfetto
+    def saveTrace(self, file):
+        events = [
+            {'name': name, 'ph': 'X', 'ts': (start - self.started) * 1e6, 'dur': seconds * 1e6, 'pid': os.getpid(),
+             'tid': 0}
+            for name, start, seconds in self.events or []
+        ]
+        with open(file, 'w') as trace:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+
+# Unmeasured phase
+NO_PHASE = contextlib.nullcontext()
+
+"""
+    Phase - Measure a block of a with statement, nothing if there are no timings
+    @arg
+        {Timings} timings       -- The timings, none if None
+        {string} name           -- The phase name
+
+    @return
+        {contextmanager}        -- The measure
+"""
+def phase(timings, name):
+    return NO_PHASE if timings is None else timings.phase(name)
+
+# [11] Batches
+
+"""
+    Run ACO TSP batch - Solve many small instances together, the colonies of all instances move at once as
+    (instances x ants x nodes) arrays, smaller instances padded and masked. Instances are grouped by size in chunks of
+    bounded memory and close sizes, so small instances are not padded to the largest ones. Ant System rule. It only
+    saves the Python overhead of every iteration of every instance, which counts for a few dozen nodes: from about 100
+    nodes building the paths takes most of the time and a batch is no faster than a loop of runAcoTsp (benchmark.py
+    batch)
+    @arg
+        {list|numpy.ndarray} spaces     -- The spaces, a list of (nodes, 2) arrays or a padded (instances, nodes, 2)
+                                           stack
+        {int} iterations {80}           -- Number of iterations (Ending condition)
+        {int} colony {50}               -- Number of ants in the colony of every instance
+        {float} alpha {1.0}             -- Alpha algorithm parameter, more or less weight to a selected distance
+        {float} beta {1.0}              -- Beta algorithm parameter, more or less weight to a selected distance
+        {float} del_tau {1.0}           -- Delta Tau algorithm parameter, pheromones releasing rate
+        {float} rho {0.5}               -- Rho algorithm parameter, pheromones evaporation rate
+        {string} metric {None}          -- TSPLIB rounding of the distances ('EUC_2D', 'CEIL_2D'), exact if None
+        {numpy.ndarray} sizes {None}    -- Number of nodes of every instance of a padded stack, all of them if None
+        {int|numpy.random.Generator} seed {None}    -- Seed of the random numbers, or a generator, unseeded if None
+        {int} block {4194304}           -- Maximum instances x nodes x nodes per chunk, bounds memory
+        {float} spread {1.25}           -- Maximum ratio of the largest to the smallest size of a chunk, bounds padding
+
+    @return
+        {list}                          -- Tuple(numpy.ndarray, float), the minimum distance path (closed) and
+                                           distance of every instance
+"""
+def runAcoTspBatch(spaces, iterations = 80, colony = 50, alpha = 1.0, beta = 1.0, del_tau = 1.0, rho = 0.5,
+                   metric = None, sizes = None, seed = None, block = 1 << 22, spread = 1.25):
+    rng = np.random.default_rng(seed)
+
+    # Coordinates of every instance
+    for space in spaces:
+        checkSpace(space, metric)
+
+    # Sizes of the instances, a list is padded chunk by chunk
+    if sizes is None:
+        sizes = [len(space) for space in spaces]
+    sizes = np.asarray(sizes, dtype = int)
+
+    # Similar sizes together so padding is small
+    order = np.argsort(sizes, kind = 'stable')
+    results = [None] * len(sizes)
+    start = 0
+    while start < len(order):
+        smallest = sizes[order[start]]
+        end = start + 1
+        while end < len(order) and (end - start + 1) * sizes[order[end]] ** 2 <= block and \
+                sizes[order[end]] <= smallest * spread:
+            end += 1
+        chunk = order[start:end]
+
+        # Padded stack of the chunk, padding nodes at the origin
+        nodes = sizes[chunk].max()
+        space = np.zeros((len(chunk), nodes, 2))
+        for row, instance in enumerate(chunk):
+            space[row, :sizes[instance]] = np.asarray(spaces[instance])[:sizes[instance]]
+
+        paths, distances = runBatch(space, sizes[chunk], iterations, colony, alpha, beta, del_tau, rho, metric, rng)
+        for row, instance in enumerate(chunk):
+            path = paths[row, :sizes[instance]]
+            results[instance] = (closedPath(path), distances[row])
+        start = end
+
+    return results
+
+"""
+    Run batch - Ant System on a padded stack of instances
+    @arg
+        {numpy.ndarray} space           -- The padded (instances, nodes, 2) stack
+        {numpy.ndarray} sizes           -- Number of nodes of every instance
+        {*} ...                         -- The runAcoTspBatch algorithm parameters
+        {numpy.random.Generator} rng    -- Random numbers
+
+    @return
+        {Tuple(numpy.ndarray, numpy.ndarray)}   -- Indexes of the minimum distance path of every instance, one row each
+                                                   (padding after the first sizes nodes), and the distances
+"""
+def runBatch(space, sizes, iterations, colony, alpha, beta, del_tau, rho, metric, rng):
+    instances, nodes = space.shape[:2]
+
+    # Distances and inverted distances ^ beta, none between padding nodes and the others
+    distances = pairDistances(space[:, :, None, :], space[:, None, :, :], metric)
+    real = np.arange(nodes) < sizes[:, None]
+    distances *= real[:, :, None] & real[:, None, :]
+    heuristic = invert(distances)
+    if beta != 1:
+        heuristic **= beta
+
+    # Initial trail at colony * del_tau / distance of a greedy path of every instance, whose choice info is the
+    # inverted distances alone
+    greedy = moveAntsBatch(heuristic, sizes, np.zeros((instances, 1), dtype = int), 1.0, rng)
+    pheromones = np.ones((instances, nodes, nodes))
+    pheromones *= (colony * del_tau / batchLengths(greedy, distances, sizes)[:, 0])[:, None, None]
+    choice = np.empty_like(pheromones)
+
+    # Empty minimum distance and path of every instance
+    min_distances = np.full(instances, np.inf)
+    min_paths = np.zeros((instances, nodes), dtype = int)
+    batch = np.arange(instances)
+    for _ in range(iterations):
+        # Choice info of the trail, then move all colonies and measure their paths
+        if alpha == 1:
+            np.multiply(pheromones, heuristic, out = choice)
+        else:
+            np.power(pheromones, alpha, out = choice)
+            choice *= heuristic
+        positions = (rng.random((instances, colony)) * sizes[:, None]).astype(int)
+        paths = moveAntsBatch(choice, sizes, positions, 0.0, rng)
+        lengths = batchLengths(paths, distances, sizes)
+
+        # Update minimum distances and paths if less
+        best = lengths.argmin(axis = 1)
+        improved = lengths[batch, best] < min_distances
+        min_distances[improved] = lengths[batch, best][improved]
+        min_paths[improved] = paths[batch, best][improved]
+
+        # Evaporate and release del_tau / distance on the edges taken, in both directions
+        pheromones *= 1 - rho
+        depositBatch(pheromones, paths, sizes, del_tau / lengths)
+
+    return (min_paths, min_distances)
+
+"""
+    Move ants batch - Move the colonies of a padded stack of instances at once, one step for all ants of all instances
+    at a time. An instance already complete goes through its padding nodes
+    @arg
+        {numpy.ndarray} choice          -- Pheromones ^ alpha * inverted distances ^ beta of every instance
+        {numpy.ndarray} sizes           -- Number of nodes of every instance
+        {numpy.ndarray} positions       -- Initial positions, one row of ants per instance
+        {float} q0                      -- Probability of taking the most probable node instead of a random one
+        {numpy.random.Generator} rng    -- Random numbers
+
+    @return
+        {numpy.ndarray}                 -- Indexes of the paths, (instances, ants, nodes)
+"""
+def moveAntsBatch(choice, sizes, positions, q0, rng):
+    instances, colony = positions.shape
+    nodes = choice.shape[1]
+    batch = np.arange(instances)[:, None]
+    ants = np.arange(colony)[None, :]
+
+    # Compiled kernel with the random numbers of every step at once, the same stream
+    if KERNELS:
+        draws = rng.random((nodes - 1, instances * colony, 2 if q0 > 0 else 1))
+        return kernels.moveBatch(positions, choice, sizes, draws, q0)
+
+    # Padding nodes are never chosen
+    paths = np.empty((instances, colony, nodes), dtype = int)
+    visited = np.zeros((instances, colony, nodes), dtype = bool)
+    visited |= (np.arange(nodes) >= sizes[:, None])[:, None, :]
+    paths[:, :, 0] = positions
+    visited[batch, ants, positions] = True
+
+    for step in range(1, nodes):
+        current = paths[:, :, step - 1]
+
+        # Every ant of every instance as a row of selectNext, with the random numbers of the step at once
+        draws = rng.random((instances * colony, 2 if q0 > 0 else 1))
+        weights = choice[batch, current]
+        selected = selectNext(weights.reshape(-1, nodes), visited.reshape(-1, nodes), q0, draws)
+        selected = np.where(step < sizes[:, None], selected.reshape(instances, colony), step)
+
+        paths[:, :, step] = selected
+        visited[batch, ants, selected] = True
+
+    return paths
+
+"""
+    Batch lengths - Get the distances of the closed paths of a padded stack, summed edge after edge, padding left out
+    @arg
+        {numpy.ndarray} paths           -- Indexes of the paths, (instances, ants, nodes)
+        {numpy.ndarray} distances       -- Distances of every instance
+        {numpy.ndarray} sizes           -- Number of nodes of every instance
+
+    @return
+        {numpy.ndarray}                 -- Distance of every path, (instances, ants)
+"""
+def batchLengths(paths, distances, sizes):
+    if KERNELS:
+        return kernels.batchLengths(paths, distances, sizes)
+
+    following = followingNodes(paths, sizes)
+    edges = distances[np.arange(paths.shape[0])[:, None, None], paths, following]
+    edges[np.broadcast_to((np.arange(paths.shape[2]) >= sizes[:, None])[:, None, :], paths.shape)] = 0
+    return np.cumsum(edges, axis = 2)[:, :, -1]
+
+"""
+    Deposit batch - Add an amount per path to the edges it takes in both directions, in place on the trail, every
+    forward edge of an instance first then every backward one
+    @arg
+        {numpy.ndarray} pheromones      -- Pheromones trail of every instance, updated
+        {numpy.ndarray} paths           -- Indexes of the paths, (instances, ants, nodes)
+        {numpy.ndarray} sizes           -- Number of nodes of every instance
+        {numpy.ndarray} amounts         -- Amount per path, (instances, ants)
+"""
+def depositBatch(pheromones, paths, sizes, amounts):
+    if KERNELS:
+        kernels.depositBatch(pheromones, paths, sizes, amounts)
+        return
+
+    # Forward and backward edges of the real nodes, instance by instance as the compiled kernel, on (instances x
+    # nodes) rows of the trail
+    instances, colony, nodes = paths.shape
+    following = followingNodes(paths, sizes)
+    offsets = (np.arange(instances) * nodes)[:, None, None, None]
+    rows = offsets + np.stack([paths, following], axis = 1)
+    columns = np.stack([following, paths], axis = 1)
+    valid = np.broadcast_to((np.arange(nodes) < sizes[:, None])[:, None, None, :], rows.shape)
+    amounts = np.broadcast_to(amounts[:, None, :, None], rows.shape)
+    np.add.at(pheromones.reshape(-1, nodes), (rows[valid], columns[valid]), amounts[valid])
+
+"""
+    Following nodes - Get the node following each one in its path, back to the first one after the last real node
+    @arg
+        {numpy.ndarray} paths           -- Indexes of the paths, (instances, ants, nodes)
+        {numpy.ndarray} sizes           -- Number of nodes of every instance
+
+    @return
+        {numpy.ndarray}                 -- The following nodes, same shape as paths
+"""
+def followingNodes(paths, sizes):
+    index = np.arange(paths.shape[2])
+    following = np.where(index + 1 < sizes[:, None], index + 1, 0)
+    return np.take_along_axis(paths, np.broadcast_to(following[:, None, :], paths.shape), axis = 2)
@@ -0,0 +1,432 @@
+# Import
+from library import *
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import io
+import json
+import os
+import sqlite3
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+# Tables of the store, every run appended once with its parameters, seed, best path, convergence trace and timings
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS experiments (
+        id INTEGER PRIMARY KEY, created TEXT, meta TEXT
+    );
+    CREATE TABLE IF NOT EXISTS instances (
+        name TEXT PRIMARY KEY, nodes INTEGER, header TEXT, space BLOB
+    );
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY, experiment INTEGER, instance TEXT, repetition INTEGER, params TEXT, seed TEXT,
+        distance REAL, iterations INTEGER, elapsed REAL, reason TEXT, timings TEXT, path BLOB, trace BLOB
+    );
+    CREATE INDEX IF NOT EXISTS runs_experiment ON runs (experiment, instance);
+'''
+
+# Columns of a convergence trace, one row per 'iteration' event
+TRACE = ('iteration', 'elapsed', 'distance', 'iteration_best', 'iteration_mean')
+
+"""
+    Results store - SQLite store of experiments, instances and runs, only ever appended to: an instance keeps the space
+    first stored under its name and another space under the same name is refused, so earlier experiments render the
+    same. Writing a run is a single insert, so thousands of runs cost no rendering, and reports read the store later on
+    (see report)
+    @arg
+        {string} file {'results/results.db'}    -- The SQLite file, created if missing
+        {bool} readonly {False}                 -- Open for reading only, e.g. from the report workers
+"""
+class ResultsStore:
+    def __init__(self, file = 'results/results.db', readonly = False):
+        self.file = file
+        if readonly:
+            self.connection = sqlite3.connect('file:{}?mode=ro'.format(file), uri = True)
+        else:
+            os.makedirs(os.path.dirname(file) or '.', exist_ok = True)
+            self.connection = sqlite3.connect(file)
+
+            # Readers are not blocked by a running experiment, and commits do not wait for the disk
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+            self.connection.executescript(SCHEMA)
+        self.connection.row_factory = sqlite3.Row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Close the connection
+    def close(self):
+        self.connection.close()
+
+    # Start an experiment, returns its id
+    def addExperiment(self, meta = None):
+        with self.connection:
+            cursor = self.connection.execute('INSERT INTO experiments (created, meta) VALUES (?, ?)',
+                                             (time.strftime('%Y-%m-%dT%H:%M:%S'), toJson(meta or {})))
+        return cursor.lastrowid
+
+    # Keep the space and header (TSPLIB data but the nodes) of an instance once, a ValueError if its name is already
+    # stored with another space
+    def addInstance(self, name, space, header = None):
+        space = np.asarray(space)
+        row = self.connection.execute('SELECT space FROM instances WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            if not np.array_equal(unpackArray(row['space']), space):
+                raise ValueError('Instance {} is already stored with another space in {}, rename it or use another '
+                                 'store'.format(name, self.file))
+            return
+
+        header = {key: value for key, value in (header or {}).items() if not isinstance(value, (list, np.ndarray))}
+        with self.connection:
+            self.connection.execute('INSERT INTO instances VALUES (?, ?, ?, ?)',
+                                    (name, len(space), toJson(header), packArray(space)))
+
+    # Append a run, the runJob record of a repetition, returns its id
+    def addRun(self, experiment, instance, repetition, params, record):
+        params = dict(params)
+        seed = params.pop('seed', None)
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (experiment, instance, repetition, params, seed, distance, iterations, elapsed, '
+                'reason, timings, path, trace) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (experiment, instance, repetition, toJson(params), toJson(seedJson(seed)), float(record['distance']),
+                 record['iterations'], record['elapsed'], record['reason'], toJson(record.get('timings')),
+                 packArray(record['path']), packArray(np.asarray(record['trace'], dtype = np.float64))))
+        return cursor.lastrowid
+
+    # Id of the last experiment, None if there are none
+    def latest(self):
+        return self.connection.execute('SELECT MAX(id) FROM experiments').fetchone()[0]
+
+    # Experiments with their number of runs
+    def experiments(self):
+        rows = self.connection.execute(
+            'SELECT e.id, e.created, e.meta, COUNT(r.id) AS runs FROM experiments e '
+            'LEFT JOIN runs r ON r.experiment = e.id GROUP BY e.id ORDER BY e.id')
+        return [dict(row, meta = json.loads(row['meta'])) for row in rows]
+
+    # Runs of an experiment (or all), without their paths and traces
+    def runs(self, experiment = None, instance = None):
+        query = 'SELECT id, experiment, instance, repetition, params, seed, distance, iterations, elapsed, reason, ' \
+                'timings FROM runs WHERE (? IS NULL OR experiment = ?) AND (? IS NULL OR instance = ?) ORDER BY id'
+        rows = self.connection.execute(query, (experiment, experiment, instance, instance))
+        return [
+            dict(row, params = json.loads(row['params']), seed = json.loads(row['seed']),
+                 timings = json.loads(row['timings']))
+            for row in rows
+        ]
+
+    # Closed path and convergence trace (TRACE columns) of a run
+    def runArrays(self, run):
+        row = self.connection.execute('SELECT path, trace FROM runs WHERE id = ?', (run,)).fetchone()
+        return unpackArray(row['path']), unpackArray(row['trace']).reshape(-1, len(TRACE))
+
+    # Space and header of an instance
+    def instance(self, name):
+        row = self.connection.execute('SELECT header, space FROM instances WHERE name = ?', (name,)).fetchone()
+        return unpackArray(row['space']), json.loads(row['header'])
+
+"""
+    Pack array - Get the bytes of an array, with its type and shape (.npy format)
+    @arg
+        {numpy.ndarray} array   -- The array
+
+    @return
+        {bytes}                 -- The bytes
+"""
+def packArray(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle = False)
+    return buffer.getvalue()
+
+"""
+    Unpack array - Get an array back from packArray bytes
+    @arg
+        {bytes} data            -- The bytes
+
+    @return
+        {numpy.ndarray}         -- The array
+"""
+def unpackArray(data):
+    return np.load(io.BytesIO(data), allow_pickle = False)
+
+"""
+    To JSON - Serialize plain and NumPy values, anything else (e.g. a dtype) as its string
+    @arg
+        {*} value               -- The value
+
+    @return
+        {string}                -- The JSON
+"""
+def toJson(value):
+    return json.dumps(value, default = lambda item: item.tolist() if isinstance(item, (np.ndarray, np.generic))
+                      else str(item))
+
+"""
+    Seed JSON - Get a seed back as plain values, a SeedSequence as its entropy and spawn key
+    @arg
+        {int|numpy.random.SeedSequence} seed    -- The seed, unseeded if None
+
+    @return
+        {int|dict}                              -- The seed, np.random.SeedSequence(**seed) gives the sequence back
+"""
+def seedJson(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy': seed.entropy, 'spawn_key': list(seed.spawn_key)}
+
+    return seed
+
+"""
+    Report - Render the figures and summaries of an experiment from the store, in a pool of worker processes. Figures
+    already rendered are skipped, so reports are only paid for what was not asked yet
+    @arg
+        {string} file {'results/results.db'}    -- The SQLite store
+        {int} experiment {None}                 -- The experiment, the latest if None
+        {string} out {'results'}                -- Folder of the generated files
+        {int} workers {None}                    -- Number of worker processes, as many as CPUs if None
+        {bool} force {False}                    -- Render again existing files
+
+    @return
+        {list}                                  -- The generated files
+
+    @export
+        {png}                                   -- Generated x-space.png for every instance, then for the
+                                                   experiment x-e-path-x.png for every run and x-e-convergence.png
+        {txt}                                   -- Generated x-e-results.txt for every instance of the experiment
+"""
+def report(file = 'results/results.db', experiment = None, out = 'results', workers = None, force = False):
+    if not os.path.exists(file):
+        msg('No results store at {}, run testing.py first'.format(file))
+        return []
+
+    with ResultsStore(file, readonly = True) as store:
+        experiment = experiment or store.latest()
+        runs = store.runs(experiment) if experiment is not None else []
+        headers = {tsp: store.instance(tsp)[1] for tsp in {run['instance'] for run in runs}}
+
+    # Nothing stored for the experiment
+    if not runs:
+        msg('No runs stored in {} for experiment {}'.format(file, experiment))
+        return []
+
+    # Runs by instance, in repetition order
+    groups = {}
+    for run in sorted(runs, key = lambda run: (run['instance'], run['repetition'])):
+        groups.setdefault(run['instance'], []).append(run)
+
+    # Figures not rendered yet
+    figures = []
+    for tsp, rows in groups.items():
+        prefix = os.path.join(out, '{}-{}'.format(tsp, experiment))
+        figures.append(('space', tsp, os.path.join(out, '{}-space.png'.format(tsp))))
+        figures.append(('convergence', rows, '{}-convergence.png'.format(prefix)))
+        figures += [('path', row, '{}-path-{}.png'.format(prefix, row['repetition'] + 1)) for row in rows]
+    figures = [figure for figure in figures if force or not os.path.exists(figure[2])]
+
+    # Summaries are cheap, written here
+    os.makedirs(out, exist_ok = True)
+    files = []
+    for tsp, rows in groups.items():
+        files.append(saveResultsTxt(tsp, headers[tsp], rows, os.path.join(out, '{}-{}-results.txt'.format(tsp,
+                                                                                                          experiment))))
+
+    # Figures rendered in the background, each worker reading the store on its own
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(renderFigure, file, *figure) for figure in figures]
+        for future in as_completed(futures):
+            files.append(future.result())
+            msg('{} generated'.format(files[-1]))
+
+    return files
+
+"""
+    Render figure - Render a figure of a report in a worker process
+    @arg
+        {string} file           -- The SQLite store
+        {string} kind           -- 'space', 'path' or 'convergence'
+        {string|dict|list} key  -- The instance name, the run or the runs of the instance
+        {string} target         -- The .png file
+
+    @return
+        {string}                -- The .png file
+"""
+def renderFigure(file, kind, key, target):
+    with ResultsStore(file, readonly = True) as store:
+        if kind == 'space':
+            saveSpacePlot(key, store.instance(key)[0], target)
+        elif kind == 'path':
+            space = store.instance(key['instance'])[0]
+            path, _ = store.runArrays(key['id'])
+            savePathPlot(key['repetition'], key['instance'], space, path, key['distance'], target)
+        else:
+            traces = [store.runArrays(run['id'])[1] for run in key]
+            saveConvergencePlot(key[0]['instance'], traces, target)
+
+    return target
+
+"""
+    Save Space plot
+    @arg
+        {string} tsp            -- The TSP file src name
+        {numpy.ndarray} space   -- The space
+        {string} file           -- The .png file
+
+    @export
+        {png}                   -- Generated .png for TSP space plot
+"""
+def saveSpacePlot(tsp, space, file):
+    # Plot nodes
+    plt.scatter(space[:, 0], space[:, 1], s = 15)
+
+    # Plot properties
+    plt.title('Space for {}'.format(tsp))
+    plt.xlabel('Latitude')
+    plt.ylabel('Longitude')
+
+    # Save and close plot
+    plt.savefig(file)
+    plt.close()
+
+"""
+    Save Path plot for a given result
+    @arg
+        {int} i                 -- The result
+        {string} tsp            -- The TSP file src name
+        {numpy.ndarray} space   -- The space
+        {numpy.ndarray}         -- Indexes of the minimun distance path for the result
+        {float}                 -- the minimun distance for the result
+        {string} file           -- The .png file
+
+    @export
+        {png}                   -- Generated .png for ACO-TSP path result plot
+"""
+def savePathPlot(i, tsp, space, min_path, min_distance, file):
+    # Plot nodes
+    plt.scatter(space[:, 0], space[:, 1], marker='o', s = 15)
+    plt.plot(space[min_path, 0], space[min_path, 1], c='g', linewidth=0.8, linestyle="--")
+
+    # Plot properties
+    plt.suptitle('Mininum Path for {}'.format(tsp))
+    plt.title('Result #{} for a minimum distance of {}'.format(i + 1, min_distance), fontsize = 10)
+    plt.xlabel('Latitude')
+    plt.ylabel('Longitude')
+
+    # Save and close plot
+    plt.savefig(file)
+    plt.close()
+
+"""
+    Save Convergence plot, minimum distance so far by iteration of every run and their mean
+    @arg
+        {string} tsp            -- The TSP file src name
+        {list} traces           -- Convergence traces of the runs (TRACE columns)
+        {string} file           -- The .png file
+
+    @export
+        {png}                   -- Generated .png for ACO-TSP convergence plot
+"""
+def saveConvergencePlot(tsp, traces, file):
+    # Every run, then the mean over the iterations all of them reached
+    for trace in traces:
+        plt.plot(trace[:, 0], trace[:, 2], linewidth = 0.8, alpha = 0.5)
+    length = min((trace.shape[0] for trace in traces), default = 0)
+    if length:
+        mean = np.mean([trace[:length, 2] for trace in traces], axis = 0)
+        plt.plot(traces[0][:length, 0], mean, c = 'k', linewidth = 1.5, label = 'Mean')
+        plt.legend()
+
+    # Plot properties
+    plt.title('Convergence for {} ({} runs)'.format(tsp, len(traces)))
+    plt.xlabel('Iteration')
+    plt.ylabel('Minimum distance')
+
+    # Save and close plot
+    plt.savefig(file)
+    plt.close()
+
+"""
+    Save results for a given TSP
+    @arg
+        {string} tsp            -- The TSP file src name
+        {dict} header           -- The TSP data, but the nodes
+        {list} runs             -- The runs of the TSP, with their params
+        {string} file           -- The .txt file
+
+    @return
+        {string}                -- The .txt file
+
+    @export
+        {txt}                   -- Generated .txt for ACO-TSP results
+"""
+def saveResultsTxt(tsp, header, runs, file):
+    params = runs[0]['params']
+    results = np.array([run['distance'] for run in runs])
+
+    with open(file, 'w') as txt:
+        txt.write('\n--------------------------')
+        txt.write('\n 1- TSP INFO')
+        txt.write('\n--------------------------')
+        txt.write('\nNAME           : {}.tsp (stored in /data)'.format(header.get('name', tsp)))
+        txt.write('\n# OF NODES     : {}\n'.format(header.get('dimension')))
+
+        txt.write('\n--------------------------')
+        txt.write('\n 2- ALGORITHM PARAMETERS')
+        txt.write('\n--------------------------')
+        for name, value in params.items():
+            txt.write('\n{:<15}: {}'.format(name.upper(), value))
+        txt.write('\n')
+
+        txt.write('\n--------------------------')
+        txt.write('\n 3- RESULTS ')
+        txt.write('\n--------------------------')
+        txt.write('\nMIN_DISTANCES      : {}'.format(results))
+        txt.write('\n# OF RESULTS       : {}'.format(results.size))
+        txt.write('\nAVG_MIN_DISTANCE   : {}'.format(np.average(results)))
+        txt.write('\nAVG_ELAPSED        : {}'.format(np.average([run['elapsed'] for run in runs])))
+        txt.write('\n--------------------------')
+
+    msg('{} generated'.format(file))
+    return file
+
+"""
+    Show a console message
+    @arg
+        {string} str
+"""
+def msg(str):
+    print('[Reports ACO_TSP] {}'.format(str))
+
+"""
+    Command line entry point, 'report' an experiment of the store or 'list' its experiments
+"""
+def main():
+    parser = argparse.ArgumentParser(description = 'ACO-TSP results reports')
+    parser.add_argument('command', choices = ('report', 'list'))
+    parser.add_argument('--store', default = 'results/results.db')
+    parser.add_argument('--experiment', type = int, default = None)
+    parser.add_argument('--out', default = 'results')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--force', action = 'store_true')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.store):
+        msg('No results store at {}, run testing.py first'.format(args.store))
+        raise SystemExit(1)
+
+    if args.command == 'report':
+        files = report(args.store, args.experiment, args.out, args.workers, args.force)
+        if not files:
+            raise SystemExit(1)
+        msg('{} files generated in {}'.format(len(files), args.out))
+    else:
+        with ResultsStore(args.store, readonly = True) as store:
+            for experiment in store.experiments():
+                msg('#{id} {created}: {runs} runs, {meta}'.format(**experiment))
+
+if __name__ == '__main__':
+    main()
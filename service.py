@@ -0,0 +1,451 @@
+# Import
+from library import *
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+# Largest colony a request may ask for, larger ones would only exhaust the memory of a worker
+MAX_COLONY = 1000
+
+# runAcoTsp arguments a request may set, with the check of their values and what they must be
+PARAMS = {
+    'iterations': (lambda value: value is None or isInteger(value, 1), 'a positive integer or null'),
+    'colony': (lambda value: isInteger(value, 1, MAX_COLONY), 'an integer from 1 to {}'.format(MAX_COLONY)),
+    'alpha': (lambda value: isNumber(value, 0), 'a non-negative number'),
+    'beta': (lambda value: isNumber(value, 0), 'a non-negative number'),
+    'del_tau': (lambda value: isNumber(value, 0) and value > 0, 'a positive number'),
+    'rho': (lambda value: isNumber(value, 0, 1) and value > 0, 'a number over 0 and up to 1'),
+    'candidates': (lambda value: value is None or isInteger(value, 1), 'a positive integer or null'),
+    'storage': (lambda value: value in ('dense', 'sparse'), "'dense' or 'sparse'"),
+    'metric': (lambda value: value in (None, 'EUC_2D', 'CEIL_2D'), "'EUC_2D', 'CEIL_2D' or null"),
+    'local_search': (lambda value: value in (None, '2-opt', 'or-opt', '2-opt+or-opt'),
+                     "'2-opt', 'or-opt', '2-opt+or-opt' or null"),
+    'search_scope': (lambda value: value in ('best', 'all'), "'best' or 'all'"),
+    'variant': (lambda value: value in ('as', 'mmas', 'acs'), "'as', 'mmas' or 'acs'"),
+    'stagnation': (lambda value: value is None or isInteger(value, 1), 'a positive integer or null'),
+    'branching': (lambda value: value is None or isNumber(value, 0) and value > 0, 'a positive number or null'),
+    'target': (lambda value: value is None or isNumber(value, 0) and value > 0, 'a positive number or null'),
+    'gap': (lambda value: isNumber(value, 0), 'a non-negative number'),
+    'initial_path': (lambda value: value in (None, 'greedy') or isinstance(value, list) and
+                     all(isInteger(node, 0) for node in value), "'greedy', a list of node indexes or null"),
+    'seed': (lambda value: value is None or isInteger(value, 0), 'a non-negative integer or null'),
+    'report': (lambda value: isInteger(value, 1), 'a positive integer')
+}
+
+# Seconds between checks of the worker and the client while waiting for the next event
+POLL = 1.0
+
+"""
+    Solve service - Local asyncio server for batched TSP solve requests, as JSON lines over TCP. Requests are queued and
+    solved in a process pool, and every improved path is streamed back while the run goes on
+
+    Request     {"id": 1, "coordinates": [[x, y], ...], "time_budget": 2.0, "params": {"variant": "acs", ...}}
+    Responses   {"id": 1, "event": "queued", "queue": 3}, then the iterateAcoTsp events ("improved", "iteration",
+                "done"), or {"id": 1, "event": "error", "message": "..."}. A request whose client disconnected is
+                cancelled, queued or running
+    Metrics     {"id": 2, "metrics": true} answered with {"id": 2, "event": "metrics", "queue": ..., ...}
+    @arg
+        {int} workers {None}            -- Number of worker processes, as many as CPUs if None
+        {float} time_budget {10.0}      -- Default and maximum seconds per request
+        {string} folder {'.cache'}      -- The cache folder for preprocessed instances
+        {int} cache_limit {256 MB}      -- Maximum size of the cache folder in bytes, the least recently used instances
+                                           are evicted and larger ones never stored, no disk cache if 0
+"""
+class SolveService:
+    def __init__(self, workers = None, time_budget = 10.0, folder = '.cache', cache_limit = 1 << 28):
+        self.workers = workers or os.cpu_count()
+        self.time_budget = time_budget
+        self.folder = folder
+        self.cache_limit = cache_limit
+
+        # Pending requests and latencies (queued and solving seconds) of the last finished ones
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen = 1000)
+        self.counts = {'received': 0, 'solving': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+
+    # Serve until cancelled
+    async def serve(self, host = '127.0.0.1', port = 8765):
+        # Events travel from the worker processes through manager queues
+        self.manager = multiprocessing.Manager()
+        self.pool = self.startPool()
+        runners = []
+        try:
+            runners = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+            server = await asyncio.start_server(self.handle, host, port)
+            msg('Serving on {}:{} with {} workers'.format(host, port, self.workers))
+            async with server:
+                await server.serve_forever()
+        finally:
+            for runner in runners:
+                runner.cancel()
+            self.pool.shutdown(cancel_futures = True)
+            self.manager.shutdown()
+
+    # Worker processes, started and warmed up right away so the first requests do not spend their time budget
+    # loading the compiled kernels
+    def startPool(self):
+        pool = ProcessPoolExecutor(self.workers, initializer = warmUp)
+        for _ in range(self.workers):
+            pool.submit(int)
+
+        return pool
+
+    # Read the requests of a connection, one JSON per line
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await send(writer, {'id': None, 'event': 'error', 'message': 'Invalid JSON'})
+                    continue
+
+                if request.get('metrics'):
+                    await send(writer, dict(self.metrics(), id = request.get('id'), event = 'metrics'))
+                    continue
+
+                # Queue the request
+                error = validate(request)
+                if error:
+                    await send(writer, {'id': request.get('id'), 'event': 'error', 'message': error})
+                    continue
+
+                self.counts['received'] += 1
+                await self.queue.put((request, writer, time.perf_counter()))
+                await send(writer, {'id': request.get('id'), 'event': 'queued', 'queue': self.queue.qsize()})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Solve queued requests one at a time, as many runners as workers
+    async def run(self):
+        while True:
+            request, writer, queued = await self.queue.get()
+            started = time.perf_counter()
+            self.counts['solving'] += 1
+
+            # A failing request never stops the runner
+            try:
+                outcome = await self.solveRequest(request, writer)
+            except Exception as error:
+                outcome = 'failed'
+                await reply(writer, {'id': request.get('id'), 'event': 'error',
+                                     'message': '{}: {}'.format(type(error).__name__, error)})
+
+            self.counts['solving'] -= 1
+            self.counts[outcome] += 1
+            self.latencies.append((started - queued, time.perf_counter() - started))
+
+    # Solve a request in the pool and relay its events, returns 'done', 'failed' or 'cancelled'
+    async def solveRequest(self, request, writer):
+        # Client gone while the request was queued
+        if writer.is_closing():
+            return 'cancelled'
+
+        # Time budget of the request, bounded by the service one
+        budget = min(float(request.get('time_budget') or self.time_budget), self.time_budget)
+        params = dict(request.get('params') or {}, time_budget = budget)
+        params.setdefault('iterations', None)
+
+        # Events travel back through a manager queue, and a manager event cancels the run
+        loop = asyncio.get_running_loop()
+        events = self.manager.Queue()
+        cancel = self.manager.Event()
+        pool = self.pool
+        future = loop.run_in_executor(pool, solveJob, request['coordinates'], params, events, cancel, self.folder,
+                                      self.cache_limit)
+        failed = False
+        while True:
+            try:
+                event = await loop.run_in_executor(None, events.get, True, POLL)
+            except queue.Empty:
+                # Cancel when the client disconnects, fail when the worker ended without its last event
+                if writer.is_closing():
+                    cancel.set()
+                if not future.done():
+                    continue
+                error = None if future.cancelled() else future.exception()
+                failure = type(error).__name__ if error else 'no result'
+                event = {'event': 'error', 'message': 'Worker failed: {}'.format(failure)}
+
+            if event['event'] == 'cancelled':
+                break
+            event['id'] = request.get('id')
+            failed = failed or event['event'] == 'error'
+            if not await reply(writer, event):
+                cancel.set()
+            if event['event'] in ('done', 'error'):
+                break
+
+        # A broken pool (e.g. a killed worker) is replaced for the next requests
+        await asyncio.wait([future])
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool) and self.pool is pool:
+            msg('Worker pool broken, restarting it')
+            self.pool = self.startPool()
+            pool.shutdown(wait = False)
+
+        return 'cancelled' if cancel.is_set() else 'failed' if failed else 'done'
+
+    # Queue depth, counts and latency percentiles in seconds
+    def metrics(self):
+        metrics = dict(self.counts, queue = self.queue.qsize(), workers = self.workers)
+        if self.latencies:
+            waits, solves = np.array(self.latencies).T
+            for name, values in (('wait', waits), ('solve', solves), ('latency', waits + solves)):
+                for percentile in (50, 95, 99):
+                    metrics['{}_p{}'.format(name, percentile)] = float(np.percentile(values, percentile))
+
+        return metrics
+
+"""
+    Validate - Check a solve request
+    @arg
+        {dict} request          -- The request
+
+    @return
+        {string}                -- The error, or None if valid
+"""
+def validate(request):
+    coordinates = request.get('coordinates')
+    if not isinstance(coordinates, list) or len(coordinates) < 3:
+        return 'coordinates must be a list of at least 3 points'
+
+    if not all(isinstance(point, list) and len(point) in (2, 3) and all(isNumber(value) for value in point)
+               for point in coordinates):
+        return 'coordinates must be [x, y] or [x, y, z] numbers'
+
+    budget = request.get('time_budget')
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or not budget > 0):
+        return 'time_budget must be a positive number'
+
+    params = request.get('params') or {}
+    if not isinstance(params, dict):
+        return 'params must be an object'
+
+    unknown = set(params) - set(PARAMS)
+    if unknown:
+        return 'Unknown params: {}'.format(', '.join(sorted(unknown)))
+
+    # Values of the params, before any of them reaches a worker
+    for name, value in params.items():
+        check, expected = PARAMS[name]
+        if not check(value):
+            return '{} must be {}'.format(name, expected)
+
+    if params.get('storage') == 'sparse' and params.get('candidates') is None:
+        return 'sparse storage needs candidates'
+
+    try:
+        Termination(branching = params.get('branching')).check(makeEngine(params.get('variant', 'as')))
+    except ValueError as error:
+        return str(error)
+
+    return None
+
+"""
+    Is number - Whether a value is a JSON number within bounds, booleans excluded
+    @arg
+        {*} value                   -- The value
+        {float} low {-inf}          -- Lowest value allowed
+        {float} high {inf}          -- Highest value allowed
+
+    @return
+        {bool}                      -- Whether it is a number from low to high
+"""
+def isNumber(value, low = -np.inf, high = np.inf):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and low <= value <= high
+
+"""
+    Is integer - Whether a value is a JSON integer within bounds, booleans excluded
+    @arg
+        {*} value                   -- The value
+        {int} low {-inf}            -- Lowest value allowed
+        {int} high {inf}            -- Highest value allowed
+
+    @return
+        {bool}                      -- Whether it is an integer from low to high
+"""
+def isInteger(value, low = -np.inf, high = np.inf):
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+"""
+    Solve job - Run a request in a worker process, putting every event in a queue
+    @arg
+        {list} coordinates      -- The points
+        {dict} params           -- iterateAcoTsp keyword arguments
+        {Queue} events          -- Queue for the events, the last one is 'done', 'error' or 'cancelled'
+        {Event} cancel          -- Set to stop the run after its current event
+        {string} folder         -- The cache folder for preprocessed instances
+        {int} limit             -- Maximum size of the cache folder in bytes, no disk cache if 0
+"""
+def solveJob(coordinates, params, events, cancel, folder, limit):
+    try:
+        space = np.array(coordinates, dtype = float)
+
+        # Only instances whose distances and inverted distances fit the cache go to disk
+        cache = InstanceCache(folder, limit) if 2 * space.shape[0] ** 2 * 8 <= limit else None
+        for event in iterateAcoTsp(space, cache = cache, **params):
+            if cancel.is_set():
+                events.put({'event': 'cancelled'})
+                return
+            events.put(jsonEvent(event))
+    except Exception as error:
+        events.put({'event': 'error', 'message': '{}: {}'.format(type(error).__name__, error)})
+
+"""
+    JSON event - Get an event with plain Python values
+    @arg
+        {dict} event            -- An iterateAcoTsp event
+
+    @return
+        {dict}                  -- The event, JSON serializable
+"""
+def jsonEvent(event):
+    return {name: value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value for name, value in event.items()}
+
+"""
+    Send - Write a JSON line
+    @arg
+        {asyncio.StreamWriter} writer   -- The connection
+        {dict} data                     -- The data
+"""
+async def send(writer, data):
+    writer.write(json.dumps(data).encode() + b'\n')
+    await writer.drain()
+
+"""
+    Reply - Write a JSON line to a client, unless it is gone
+    @arg
+        {asyncio.StreamWriter} writer   -- The connection
+        {dict} data                     -- The data
+
+    @return
+        {bool}                          -- Whether it was written
+"""
+async def reply(writer, data):
+    if writer.is_closing():
+        return False
+
+    try:
+        await send(writer, data)
+    except ConnectionError:
+        return False
+
+    return True
+
+"""
+    Solve - Client for the solve service, send a request and yield its events until it is done
+    @arg
+        {list} coordinates              -- The points
+        {float} time_budget {None}      -- Seconds for the request, the service default if None
+        {dict} params {None}            -- runAcoTsp arguments
+        {string} host {'127.0.0.1'}     -- The service host
+        {int} port {8765}               -- The service port
+
+    @yield
+        {dict}                          -- The events
+"""
+async def solve(coordinates, time_budget = None, params = None, host = '127.0.0.1', port = 8765):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        request = {'id': 0, 'coordinates': coordinates, 'time_budget': time_budget, 'params': params or {}}
+        await send(writer, request)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            event = json.loads(line)
+            yield event
+            if event['event'] in ('done', 'error'):
+                break
+    finally:
+        writer.close()
+
+"""
+    Fetch metrics - Client for the solve service metrics
+    @arg
+        {string} host {'127.0.0.1'}     -- The service host
+        {int} port {8765}               -- The service port
+
+    @return
+        {dict}                          -- The metrics
+"""
+async def fetchMetrics(host = '127.0.0.1', port = 8765):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await send(writer, {'id': 0, 'metrics': True})
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+"""
+    Load test - Send many requests at once and report the service metrics
+    @arg
+        {string} tsp            -- The TSP file src
+        {int} requests          -- Number of concurrent requests
+        {float} time_budget     -- Seconds per request
+        {string} host           -- The service host
+        {int} port              -- The service port
+"""
+async def loadTest(tsp, requests, time_budget, host, port):
+    coordinates = np.asarray(getTspData(tsp)['node_coord_section']).tolist()
+
+    # Last event of a request
+    async def last():
+        async for event in solve(coordinates, time_budget, None, host, port):
+            pass
+        return event
+
+    started = time.perf_counter()
+    done = await asyncio.gather(*[last() for _ in range(requests)])
+    msg('{} requests in {:.2f}s, best distance {}'.format(
+        requests, time.perf_counter() - started, min(event.get('distance') or np.inf for event in done)))
+    msg(json.dumps(await fetchMetrics(host, port)))
+
+"""
+    Show a console message
+    @arg
+        {string} str
+"""
+def msg(str):
+    print('[ACO_TSP service] {}'.format(str))
+
+"""
+    Command line entry point, 'serve' the service or 'load' test a running one
+"""
+def main():
+    parser = argparse.ArgumentParser(description = 'Local ACO-TSP solve service')
+    parser.add_argument('command', choices = ('serve', 'load'))
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--time-budget', type = float, default = 10.0)
+    parser.add_argument('--tsp', default = 'data/berlin52.tsp')
+    parser.add_argument('--requests', type = int, default = 20)
+    parser.add_argument('--cache-limit', type = int, default = 256, help = 'Disk cache size in MB, none if 0')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            service = SolveService(args.workers, args.time_budget, cache_limit = args.cache_limit << 20)
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(loadTest(args.tsp, args.requests, args.time_budget, args.host, args.port))
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,47 @@
 # Import
 from library import *
-import matplotlib.pyplot as plt
+from reports import ResultsStore
+from tuning import tunedParams
+import library
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+import cProfile
+import contextlib
+
+# Configurations compared by checkParity (and tests/test_library.py), every branch of the compiled kernels
+PARITY = [
+    {'variant': 'as'},
+    {'variant': 'as', 'alpha': 1.5, 'beta': 2.0},
+    {'variant': 'mmas', 'candidates': 10},
+    {'variant': 'acs'},
+    {'variant': 'acs', 'candidates': 10, 'local_search': '2-opt'},
+    {'variant': 'as', 'metric': 'EUC_2D', 'dtype': np.float32}
+]
 
 """
-    Run Ant Colony Optimization (ACO) algorithm for a given Symmetric traveling salesman problem (TSP)
+    Run Ant Colony Optimization (ACO) algorithm for given Symmetric traveling salesman problems (TSP), every repetition
+    of every TSP as an independent job of a process pool. Every run is appended to a results store, and plots and
+    summaries are rendered later on from it (python reports.py report)
     @arg
-        {string} tsp    -- The TSP file src name (located in /data folder)
+        {string} tsps           -- The TSP file src names (located in /data folder)
+        {int} workers {None}    -- Number of worker processes, as many as CPUs if None
+        {string} local_search {None}    -- Local search applied to paths, '2-opt', 'or-opt' or '2-opt+or-opt'
+        {string} search_scope {'best'}  -- Paths improved by the local search, 'best' of each iteration or 'all'
+        {int} seed {None}       -- Seed of the whole experiment, every repetition gets its own stream, unseeded if None
+        {string} profile {None}         -- Profile every repetition, 'timings' (per phase), 'cprofile' or
+                                           'pyinstrument' (also per phase), none if None
+        {string} tuned {None}           -- Tuning file (tuning.py) whose configuration for the size of every TSP
+                                           overrides the default parameters, defaults only if None
+        {string} store {'results/results.db'}   -- The results store (reports.py)
+
+    @return
+        {int}                   -- The experiment id in the store
 
     @export
-        {results}       -- Generated files for results
-        {plots}         -- Generated files for plots
+        {db}                    -- Runs appended to the results store
 """
-def test(tsp):
+def test(*tsps, workers = None, local_search = None, search_scope = 'best', seed = None, profile = None,
+         tuned = None, store = 'results/results.db'):
     # Default arguments
     '''
         iterations {80}     -- Number of iterations (Ending condition)
@@ -32,146 +62,218 @@ def test(tsp):
     beta = 1
     del_tau = 1.0
     rho = 0.5
-
-    results = np.zeros(n)   # Store
-
-    # Get TSP data
-    src = getTspData('data/{}.tsp'.format(tsp))
-    space = None
-    space = np.array(src['node_coord_section'])
-
-    # Inform
-    msg('Computing {} times for {}'.format(n, tsp))
-
-    # Save space plot
-    saveSpacePlot(tsp, space)
-
-    # Repeat and save path plot for each result
-    for i in range(n):
-        # Run
-        min_path, min_distance = runAcoTsp(space, iterations, colony, alpha, beta, del_tau, rho)
-
-        # Store result
-        results[i] = min_distance
-
-        # Save path plot
-        savePathPlot(i, n, tsp, space, min_path, min_distance)
-
-    # Save results txt
-    saveResultsTxt(src, results, iterations, colony, alpha, beta, del_tau, rho)
+    params = {
+        'iterations': iterations, 'colony': colony, 'alpha': alpha, 'beta': beta, 'del_tau': del_tau, 'rho': rho,
+        'local_search': local_search, 'search_scope': search_scope
+    }
+
+    cache = InstanceCache() # Preprocessed instances, reused across repetitions and runs
+    store = ResultsStore(store)
+
+    # Get TSP data, preprocessed once here so workers only read the cache
+    srcs = {}
+    spaces = {}
+    configs = {}
+    for tsp in tsps:
+        srcs[tsp] = cachedTspData('data/{}.tsp'.format(tsp), cache)
+        spaces[tsp] = np.array(srcs[tsp]['node_coord_section'])
+
+        # Tuned parameters of its size, if any
+        configs[tsp] = dict(params, **tunedParams(spaces[tsp].shape[0], tuned)) if tuned else params
+        makeStorage(spaces[tsp], 'dense', configs[tsp]['beta'], configs[tsp].get('candidates'), cache = cache)
+        store.addInstance(tsp, spaces[tsp], srcs[tsp])
+
+        # Inform
+        msg('Computing {} times for {}'.format(n, tsp))
+
+    # Experiment started once every instance is stored, a refused instance leaves none empty
+    experiment = store.addExperiment({'tsps': tsps, 'repetitions': n, 'seed': seed, 'tuned': tuned,
+                                      'profile': profile})
+
+    # Repeat every TSP in parallel, with independent random numbers
+    seeds = iter(spawnSeeds(seed, len(tsps) * n))
+    jobs = [(tsp, i, dict(configs[tsp], seed = next(seeds))) for tsp in tsps for i in range(n)]
+    try:
+        for (tsp, i, params), record in runExperiments(spaces, jobs, workers, cache.folder, profile, experiment):
+            # Store result
+            store.addRun(experiment, tsp, i, params, record)
+
+            # Inform
+            msg('Result #{} of {} for {}: {}'.format(i + 1, n, tsp, record['distance']))
+    finally:
+        store.close()
+
+    msg('Experiment #{} stored in {}'.format(experiment, store.file))
+    return experiment
 
 """
-    Save Space plot
+    Run experiments - Run (instance, repetition, parameters) jobs over a process pool, the spaces are shared with the
+    workers through shared memory and the preprocessed instances through the on-disk cache
     @arg
-        {string} tsp            -- The TSP file src name
-        {numpy.ndarray} space   -- The space
-
-    @export
-        {png}                   -- Generated .png for TSP space plot
+        {dict} spaces               -- The spaces by instance name
+        {list} jobs                 -- (instance name, repetition, runAcoTsp keyword arguments) tuples, a seed in the
+                                       arguments makes the job reproducible whatever worker runs it
+        {int} workers {None}        -- Number of worker processes, as many as CPUs if None
+        {string} folder {'.cache'}  -- The cache folder
+        {string} profile {None}     -- Profile every job, see test
+        {int} experiment {None}     -- Experiment id in the results store, named in the profile files
+
+    @yield
+        {Tuple(tuple, dict)}        -- The job and its runJob record, as finished
 """
-def saveSpacePlot(tsp, space):
-    # Plot nodes
-    plt.scatter(space[:, 0], space[:, 1], s = 15)
-
-    # Plot properties
-    plt.title('Space for {}'.format(tsp))
-    plt.xlabel('Latitude')
-    plt.ylabel('Longitude')
-
-    # Save plot
-    file = 'results/{}-space.png'.format(tsp)
-    plt.savefig(file)
-
-    # Close plot
-    plt.close()
-
-    # Inform
-    msg('{} generated'.format(file))
+def runExperiments(spaces, jobs, workers = None, folder = '.cache', profile = None, experiment = None):
+    # Copy every space once into shared memory
+    shared = {}
+    try:
+        for tsp, space in spaces.items():
+            shared[tsp] = SharedMemory(create = True, size = max(space.nbytes, 1))
+            np.ndarray(space.shape, space.dtype, buffer = shared[tsp].buf)[:] = space
+
+        # Fan out and collect as finished
+        with ProcessPoolExecutor(workers) as pool:
+            futures = {
+                pool.submit(runJob, (shared[tsp].name, spaces[tsp].shape, spaces[tsp].dtype.str), tsp, i, params,
+                            folder, profile, experiment): (tsp, i, params)
+                for tsp, i, params in jobs
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    finally:
+        for memory in shared.values():
+            memory.close()
+            memory.unlink()
 
 """
-    Save Path plot for a given result
+    Run job - Run a single experiment in a worker process
     @arg
-        {int} i                 -- The result
-        {int} n                 -- The total results
-        {numpy.ndarray}         -- Indexes of the minimun distance path for the result
-        {float}                 -- the minimun distance for the result
-        {string} tsp            -- The TSP file src name
-        {numpy.ndarray} space   -- The space
-
-    @export
-        {png}                   -- Generated .png for ACO-TSP path result plot
+        {tuple} shared          -- Shared memory name, shape and dtype of the space
+        {string} tsp            -- The instance name
+        {int} i                 -- The repetition
+        {dict} params           -- runAcoTsp keyword arguments
+        {string} folder         -- The cache folder
+        {string} profile {None} -- Profile the job, see test
+        {int} experiment {None} -- Experiment id in the results store, the profile files are x-e-run-x like the
+                                   reports (x-run-x without it)
+
+    @return
+        {dict}                  -- Minimum 'path' and 'distance', 'iterations', 'elapsed' seconds, ending 'reason',
+                                   convergence 'trace' (reports.TRACE rows) and 'timings' summary of the run
 """
-def savePathPlot(i, n, tsp, space, min_path, min_distance):
-    # Plot nodes
-    plt.scatter(space[:, 0], space[:, 1], marker='o', s = 15)
-    plt.plot(space[min_path, 0], space[min_path, 1], c='g', linewidth=0.8, linestyle="--")
+def runJob(shared, tsp, i, params, folder, profile = None, experiment = None):
+    # Convergence trace and last event, kept as the run goes
+    trace = []
+    done = {}
+    def follow(event):
+        if event['event'] == 'iteration':
+            trace.append((event['iteration'], event['elapsed'], event['distance'], event['iteration_best'],
+                          event['iteration_mean']))
+        elif event['event'] == 'done':
+            done.update(event)
+
+    # Attach to the shared space without copying it
+    name, shape, dtype = shared
+    memory = SharedMemory(name = name)
+    try:
+        space = np.ndarray(shape, dtype, buffer = memory.buf)
+        prefix = tsp if experiment is None else '{}-{}'.format(tsp, experiment)
+        with profiled(profile, 'results/{}-run-{}'.format(prefix, i + 1)) as timings:
+            runAcoTsp(space, cache = InstanceCache(folder), timings = timings or Timings(), callback = follow,
+                      **params)
+        del space
+    finally:
+        memory.close()
+
+    return {
+        'path': done['path'],
+        'distance': done['distance'],
+        'iterations': done['iteration'],
+        'elapsed': done['elapsed'],
+        'reason': done['reason'],
+        'trace': trace,
+        'timings': done.get('timings')
+    }
 
-    # Plot properties
-    plt.suptitle('Mininum Path for {}'.format(tsp))
-    plt.title('Result #{} of {} for a minimum distance of {}'.format(i + 1, n, min_distance), fontsize = 10)
-    plt.xlabel('Latitude')
-    plt.ylabel('Longitude')
-
-    # Save plot
-    file = 'results/{}-path-{}.png'.format(tsp, i + 1)
-    plt.savefig(file)
-
-    # Close plot
-    plt.close()
+"""
+    Check parity - Run the same seeded configurations with the compiled kernels and with NumPy, they must give the same
+    paths and distances
+    @arg
+        {string} tsp {'kroA100'}    -- The TSP file src name (located in /data folder)
+        {int} iterations {20}       -- Iterations per run
+        {int} seed {0}              -- Seed of every run
 
-    # Inform
-    msg('{} generated'.format(file))
+    @return
+        {bool}                      -- Whether every configuration matched, False if there are no kernels
+"""
+def checkParity(tsp = 'kroA100', iterations = 20, seed = 0):
+    if library.kernels is None:
+        msg('No compiled kernels (Numba is not installed), nothing to compare')
+        return False
+
+    space = np.array(getTspData('data/{}.tsp'.format(tsp))['node_coord_section'])
+
+    matched = True
+    previous = library.KERNELS
+    for config in PARITY:
+        # Same seed, with and without kernels
+        runs = []
+        for compiled in (True, False):
+            library.KERNELS = compiled
+            runs.append(runAcoTsp(space, iterations, colony = 20, seed = seed, **config))
+        library.KERNELS = previous
+
+        same = runs[0][1] == runs[1][1] and np.array_equal(runs[0][0], runs[1][0])
+        matched = matched and same
+        msg('Parity {} for {}: {} (kernels) and {} (NumPy)'.format('OK' if same else 'FAILED', config, runs[0][1],
+                                                                   runs[1][1]))
+
+    return matched
 
 """
-    Save results for a given TSP
+    Profiled - Profile the block of a with statement, giving it the timings per phase to pass to runAcoTsp
     @arg
-        {dict} src                  -- The TSP file src
-        {numpy.ndarray} results     -- The TSP file as dictionary
-        {int} iterations {80}       -- Number of iterations (Ending condition)
-        {int} colony {50}           -- Number of ants in the colony
-        {float} alpha {1.0}         -- Alpha algorithm parameter, more or less weight to a selected distance
-        {float} beta {1.0}          -- Beta algorithm parameter, more or less weight to a selected distance
-        {float} del_tau {1.0}       -- Delta Tau algorithm parameter, pheromones releasing rate
-        {float} rho {0.5}           -- Rho algorithm parameter, pheromones evaporation rate
+        {string} profile        -- 'timings', 'cprofile' or 'pyinstrument', none if None
+        {string} file           -- Path of the generated files, without extension
+
+    @yield
+        {Timings}               -- The timings, None if not profiled
 
     @export
-        {txt}                       -- Generated .txt for ACO-TSP results
+        {json, prof, html}      -- Generated files for timings per phase (-timings.json, a -trace.json Chrome trace)
+                                   and the profile (.prof for cProfile, -profile.html for pyinstrument)
 """
-def saveResultsTxt(src, results, iterations, colony, alpha, beta, del_tau, rho):
-    # Open or create
-    file = 'results/{}-results.txt'.format(src['name'])
-    txt = open(file, 'w+')
-
-    # Write file
-    txt.write('\n--------------------------')
-    txt.write('\n 1- TSP INFO')
-    txt.write('\n--------------------------')
-    txt.write('\nNAME           : {}.tsp (stored in /data)'.format(src['name']))
-    txt.write('\n# OF NODES     : {}\n'.format(src['dimension']))
-
-    txt.write('\n--------------------------')
-    txt.write('\n 2- ALGORITHM PARAMETERS')
-    txt.write('\n--------------------------')
-    txt.write('\nITERATIONS     : {}'.format(iterations))
-    txt.write('\nCOLONY         : {}'.format(colony))
-    txt.write('\nALPHA          : {}'.format(alpha))
-    txt.write('\nBETA           : {}'.format(beta))
-    txt.write('\nDEL_TAU        : {}'.format(del_tau))
-    txt.write('\nRHO            : {}\n'.format(rho))
-
-    txt.write('\n--------------------------')
-    txt.write('\n 3- RESULTS ')
-    txt.write('\n--------------------------')
-    txt.write('\nMIN_DISTANCES      : {}'.format(results))
-    txt.write('\n# OF RESULTS       : {}'.format(results.size))
-    txt.write('\nAVG_MIN_DISTANCE   : {}'.format(np.average(results)))
-    txt.write('\n--------------------------')
-
-    # Close file
-    txt.close()
-
-    # Inform
-    msg('{} generated'.format(file))
+@contextlib.contextmanager
+def profiled(profile, file):
+    if profile is None:
+        yield None
+        return
+
+    if profile not in ('timings', 'cprofile', 'pyinstrument'):
+        raise ValueError('Unknown profile: {}'.format(profile))
+
+    # Optional, only needed for its own mode
+    if profile == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    elif profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    timings = Timings(trace = True)
+    try:
+        yield timings
+    finally:
+        if profile == 'pyinstrument':
+            profiler.stop()
+            with open('{}-profile.html'.format(file), 'w') as html:
+                html.write(profiler.output_html())
+        elif profile == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats('{}.prof'.format(file))
+
+        with open('{}-timings.json'.format(file), 'w') as summary:
+            json.dump(timings.summary(), summary, indent = 2)
+        timings.saveTrace('{}-trace.json'.format(file))
 
 """
     Show a console message
@@ -188,11 +290,10 @@ def msg(str):
 """
 def main():
     # Test for each stored TSP data
-    test('kroA100')
-    test('berlin52')
+    test('kroA100', 'berlin52')
 
     # Inform
-    msg('All files generated, see /results for details')
+    msg('All runs stored, python reports.py report generates the files in /results')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,31 @@
+# Import
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the root of the repository, next to the data folder
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from library import getTspData
+
+"""
+    Space - Coordinates of a TSP of the data folder
+    @arg
+        {string} tsp            -- The TSP file src name (located in /data folder)
+
+    @return
+        {numpy.ndarray}         -- The space
+"""
+def space(tsp):
+    return np.array(getTspData(os.path.join(ROOT, 'data', '{}.tsp'.format(tsp)))['node_coord_section'])
+
+@pytest.fixture(scope = 'session')
+def berlin52():
+    return space('berlin52')
+
+@pytest.fixture(scope = 'session')
+def kroA100():
+    return space('kroA100')
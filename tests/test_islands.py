@@ -0,0 +1,62 @@
+# Import
+from library import *
+import library
+import multiprocessing
+import os
+import threading
+
+# Seconds an island run may take before it counts as hung
+LIMIT = 120
+
+"""
+    Run in time - Run the island model in a thread, so a hang fails the test instead of blocking it
+    @arg
+        {**} kwargs             -- runIslands arguments
+
+    @return
+        {Tuple(bool, *)}        -- Whether it finished in time, and its result or raised exception
+"""
+def runInTime(**kwargs):
+    outcome = []
+    def target():
+        try:
+            outcome.append(runIslands(**kwargs))
+        except Exception as error:
+            outcome.append(error)
+
+    thread = threading.Thread(target = target, daemon = True)
+    thread.start()
+    thread.join(LIMIT)
+
+    # Hung islands are stopped, the test process would wait for them at exit
+    if thread.is_alive():
+        for process in multiprocessing.active_children():
+            process.terminate()
+
+    return (not thread.is_alive(), outcome[0] if outcome else None)
+
+# Islands sending their pheromones trail along with the paths all finish and report
+def test_merge(kroA100):
+    finished, result = runInTime(space = kroA100, islands = 2, migration = 2, merge = True, iterations = 10,
+                                 colony = 10, seed = 0)
+    assert finished
+    path, distance, stats = result
+    assert [stat['island'] for stat in stats] == [0, 1]
+    assert distance == min(stat['min_distance'] for stat in stats)
+    assert np.array_equal(np.sort(path[:-1]), np.arange(len(kroA100)))
+
+# An island killed before reporting stops the others and raises
+def test_dead_island(berlin52, monkeypatch):
+    monkeypatch.setattr(library, 'runIsland', lambda island, *args: os._exit(3) if island == 0 else
+                        runIsland(island, *args))
+    finished, result = runInTime(space = berlin52, islands = 2, migration = 2, merge = True, iterations = 10,
+                                 colony = 5, seed = 0)
+    assert finished
+    assert isinstance(result, RuntimeError)
+    assert 'exit code 3' in str(result)
+
+# ACS is refused with the branching ending condition before any island starts
+def test_branching(berlin52):
+    finished, result = runInTime(space = berlin52, islands = 2, variant = 'acs', branching = 2.0)
+    assert finished
+    assert isinstance(result, ValueError)
@@ -0,0 +1,126 @@
+# Import
+from library import *
+from testing import PARITY
+import library
+import pytest
+
+"""
+    Check tour - Assert a path is a closed tour over every node
+    @arg
+        {numpy.ndarray} path    -- Indexes of the path, closed
+        {int} nodes             -- Number of nodes
+"""
+def checkTour(path, nodes):
+    assert path[0] == path[-1]
+    assert np.array_equal(np.sort(path[:-1]), np.arange(nodes))
+
+# A seed gives the same run with the compiled kernels and with NumPy
+@pytest.mark.skipif(library.kernels is None, reason = 'Numba is not installed')
+@pytest.mark.parametrize('config', PARITY, ids = str)
+def test_kernel_parity(kroA100, config, monkeypatch):
+    runs = []
+    for compiled in (True, False):
+        monkeypatch.setattr(library, 'KERNELS', compiled)
+        runs.append(runAcoTsp(kroA100, 10, colony = 20, seed = 0, **config))
+
+    assert runs[0][1] == runs[1][1]
+    assert np.array_equal(runs[0][0], runs[1][0])
+
+# Sparse storage gives tours of the right distance, for every variant
+@pytest.mark.parametrize('variant', ['as', 'mmas', 'acs'])
+def test_sparse(berlin52, variant):
+    path, distance = runAcoTsp(berlin52, 10, colony = 10, candidates = 8, storage = 'sparse', variant = variant,
+                               seed = 0)
+    checkTour(path, len(berlin52))
+    assert distance == pytest.approx(tourLengths(path[:-1], distanceMatrix(berlin52)))
+
+# A run resumed from its checkpoint ends as the same run never stopped
+@pytest.mark.parametrize('variant', ['as', 'mmas', 'acs'])
+def test_checkpoint_resume(berlin52, variant, tmp_path):
+    checkpoint = str(tmp_path / 'run.npz')
+    whole = runAcoTsp(berlin52, 20, colony = 10, variant = variant, seed = 1)
+    runAcoTsp(berlin52, 10, colony = 10, variant = variant, seed = 1, checkpoint = checkpoint, checkpoint_every = 5)
+    resumed = runAcoTsp(berlin52, 20, colony = 10, variant = variant, seed = 1, resume = checkpoint)
+
+    assert resumed[1] == whole[1]
+    assert np.array_equal(resumed[0], whole[0])
+
+# A checkpoint of another instance is refused
+def test_checkpoint_other_instance(berlin52, tmp_path):
+    checkpoint = str(tmp_path / 'run.npz')
+    runAcoTsp(berlin52, 5, colony = 5, seed = 1, checkpoint = checkpoint, checkpoint_every = 5)
+    with pytest.raises(ValueError):
+        runAcoTsp(berlin52[:40], 5, colony = 5, seed = 1, resume = checkpoint)
+
+# The branching ending condition is refused for ACS before any preprocessing, and applies to the others
+def test_branching(berlin52):
+    with pytest.raises(ValueError, match = 'does not converge'):
+        runAcoTsp(berlin52, 10, variant = 'acs', branching = 2.0)
+
+    path, distance = runAcoTsp(berlin52, 500, colony = 10, variant = 'mmas', branching = 2.0, seed = 0)
+    checkTour(path, len(berlin52))
+
+# The same bytes with another shape or dtype are another instance
+def test_instance_key():
+    data = np.arange(12, dtype = np.float64)
+    assert instanceKey(data) == instanceKey(data.copy())
+    assert instanceKey(data) != instanceKey(data.reshape(6, 2))
+    assert instanceKey(data.reshape(6, 2)) != instanceKey(data.reshape(4, 3))
+    assert instanceKey(data) != instanceKey(data.view(np.int64))
+    assert instanceKey(data) != instanceKey(data, 'dense')
+
+# The local search on the shared distances never gives a longer path
+@pytest.mark.parametrize('method', ['2-opt', 'or-opt', '2-opt+or-opt'])
+def test_local_search(berlin52, method):
+    distances = distanceMatrix(berlin52, 'EUC_2D')
+    neighbours = nearestNeighbours(berlin52, 10)
+    path = np.random.default_rng(0).permutation(len(berlin52))
+    improved = localSearch(path, berlin52, neighbours, method, 'EUC_2D', distances)
+
+    checkTour(closedPath(improved), len(berlin52))
+    assert tourLengths(improved, distances) < tourLengths(path, distances)
+
+# Every instance of a batch gets a tour of its own size and its distance, the same with or without kernels
+def test_batch(berlin52, kroA100, monkeypatch):
+    spaces = [berlin52, kroA100[:60], berlin52[:45]]
+    runs = []
+    for compiled in (True, False) if library.kernels is not None else (False,):
+        monkeypatch.setattr(library, 'KERNELS', compiled)
+        runs.append(runAcoTspBatch(spaces, 5, colony = 10, seed = 0))
+
+    for space, (path, distance) in zip(spaces, runs[0]):
+        checkTour(path, len(space))
+        assert distance == pytest.approx(tourLengths(path[:-1], distanceMatrix(space)))
+    for (path, distance), (other, length) in zip(runs[0], runs[-1]):
+        assert np.array_equal(path, other)
+        assert distance == length
+
+# Inserted, deleted and moved nodes keep the matrices, the best path and the optimization consistent
+def test_dynamic(berlin52):
+    dynamic = DynamicTsp(berlin52[:40], colony = 10, candidates = 8, seed = 0)
+    dynamic.run(iterations = 5)
+
+    # The first inserts fit the spare capacity, nothing is copied
+    buffer = dynamic.buffers['distances']
+    added = dynamic.insert(berlin52[40:45])
+    assert dynamic.buffers['distances'] is buffer
+    assert np.array_equal(added, np.arange(40, 45))
+    checkTour(closedPath(dynamic.best[0]), 45)
+
+    # Beyond it the buffers grow
+    dynamic.insert(berlin52[45:])
+    assert dynamic.buffers['distances'] is not buffer
+    assert dynamic.nodes == len(berlin52)
+
+    index = dynamic.delete([0, 10, 51])
+    assert (index[[0, 10, 51]] == -1).all()
+    assert dynamic.nodes == len(berlin52) - 3
+    checkTour(closedPath(dynamic.best[0]), dynamic.nodes)
+
+    dynamic.move([1, 2], [[0, 0], [1750, 1200]])
+    np.testing.assert_allclose(dynamic.storage.distances, distanceMatrix(dynamic.space))
+    assert (dynamic.storage.candidates >= 0).all()
+
+    path, distance = dynamic.run(iterations = 5)
+    checkTour(path, dynamic.nodes)
+    assert distance == pytest.approx(tourLengths(path[:-1], distanceMatrix(dynamic.space)))
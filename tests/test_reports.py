@@ -0,0 +1,36 @@
+# Import
+from library import *
+from reports import ResultsStore
+from testing import runExperiments
+import os
+import pytest
+
+# An instance name is stored once, another space under it is refused
+def test_instance_conflict(berlin52, tmp_path):
+    with ResultsStore(str(tmp_path / 'results.db')) as store:
+        store.addInstance('berlin52', berlin52, {'name': 'berlin52', 'node_coord_section': berlin52.tolist()})
+        store.addInstance('berlin52', berlin52.copy())
+        with pytest.raises(ValueError, match = 'already stored with another space'):
+            store.addInstance('berlin52', berlin52[:40])
+
+        assert np.array_equal(store.instance('berlin52')[0], berlin52)
+
+# Runs of a process pool are stored with their trace, and profile files are named after the experiment
+def test_experiment(berlin52, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('results')
+    with ResultsStore('results/results.db') as store:
+        store.addInstance('berlin52', berlin52)
+        experiment = store.addExperiment({'tsps': ['berlin52']})
+        jobs = [('berlin52', i, {'iterations': 5, 'colony': 10, 'seed': i}) for i in range(2)]
+        for (tsp, i, params), record in runExperiments({'berlin52': berlin52}, jobs, 1, str(tmp_path / 'cache'),
+                                                       'timings', experiment):
+            store.addRun(experiment, tsp, i, params, record)
+
+        runs = store.runs(experiment)
+        assert len(runs) == 2
+        assert all(len(store.runArrays(run['id'])[1]) == 5 for run in runs)
+
+    for i in (1, 2):
+        assert os.path.exists('results/berlin52-{}-run-{}-timings.json'.format(experiment, i))
+        assert os.path.exists('results/berlin52-{}-run-{}-trace.json'.format(experiment, i))
@@ -0,0 +1,73 @@
+# Import
+from service import *
+import asyncio
+import pytest
+import socket
+
+# A valid request, changed by every case
+POINTS = [[0, 0], [0, 1], [1, 1], [1, 0]]
+
+@pytest.mark.parametrize('request_, error', [
+    ({'coordinates': POINTS}, None),
+    ({'coordinates': POINTS, 'time_budget': 1, 'params': {'variant': 'mmas', 'colony': 10, 'seed': 0}}, None),
+    ({'coordinates': POINTS, 'params': {'storage': 'sparse', 'candidates': 2}}, None),
+    ({'coordinates': POINTS[:2]}, 'coordinates must be a list'),
+    ({'coordinates': [[0, 0], [0, 1], [1, 'a']]}, 'coordinates must be'),
+    ({'coordinates': [[0, 0], [0, 1], [1]]}, 'coordinates must be'),
+    ({'coordinates': POINTS, 'time_budget': -1}, 'time_budget'),
+    ({'coordinates': POINTS, 'time_budget': True}, 'time_budget'),
+    ({'coordinates': POINTS, 'params': [1]}, 'params must be an object'),
+    ({'coordinates': POINTS, 'params': {'callback': 1}}, 'Unknown params: callback'),
+    ({'coordinates': POINTS, 'params': {'colony': 10 ** 6}}, 'colony must be'),
+    ({'coordinates': POINTS, 'params': {'colony': 2.5}}, 'colony must be'),
+    ({'coordinates': POINTS, 'params': {'alpha': '1'}}, 'alpha must be'),
+    ({'coordinates': POINTS, 'params': {'rho': 0}}, 'rho must be'),
+    ({'coordinates': POINTS, 'params': {'iterations': True}}, 'iterations must be'),
+    ({'coordinates': POINTS, 'params': {'variant': 'aco'}}, 'variant must be'),
+    ({'coordinates': POINTS, 'params': {'initial_path': [0, -1]}}, 'initial_path must be'),
+    ({'coordinates': POINTS, 'params': {'storage': 'sparse'}}, 'sparse storage needs candidates'),
+    ({'coordinates': POINTS, 'params': {'variant': 'acs', 'branching': 2}}, 'does not converge')
+])
+def test_validate(request_, error):
+    if error is None:
+        assert validate(request_) is None
+    else:
+        assert error in validate(request_)
+
+# A request is streamed back until done, an invalid one gets its error, and both are counted
+def test_solve(berlin52, tmp_path):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    async def session():
+        service = SolveService(workers = 1, time_budget = 2.0, folder = str(tmp_path))
+        server = asyncio.create_task(service.serve(port = port))
+        try:
+            # Up once it accepts connections
+            for _ in range(100):
+                try:
+                    await fetchMetrics(port = port)
+                    break
+                except ConnectionError:
+                    await asyncio.sleep(0.1)
+
+            events = [event async for event in solve(berlin52.tolist(), 0.5, {'colony': 10, 'seed': 0}, port = port)]
+            errors = [event async for event in solve(berlin52.tolist(), 0.5, {'rho': 2}, port = port)]
+            metrics = await fetchMetrics(port = port)
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions = True)
+
+        return (events, errors, metrics)
+
+    events, errors, metrics = asyncio.run(session())
+    assert events[0]['event'] == 'queued'
+    assert 'improved' in [event['event'] for event in events]
+    done = events[-1]
+    assert done['event'] == 'done'
+    assert sorted(done['path'][:-1]) == list(range(len(berlin52)))
+    assert errors[-1]['event'] == 'error'
+    assert 'rho must be' in errors[-1]['message']
+    assert metrics['done'] == 1
+    assert metrics['received'] == 1
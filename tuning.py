@@ -0,0 +1,412 @@
+# Import
+from library import *
+from benchmark import instanceFile
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+
+# Optional statistical tests, races fall back to successive halving without them
+try:
+    from scipy import stats
+except ImportError:
+    stats = None
+
+# Tuned runAcoTsp parameters, ('real', low, high), ('int', low, high) or ('choice', options)
+PARAMETERS = {
+    'alpha': ('real', 0.5, 3.0),
+    'beta': ('real', 1.0, 6.0),
+    'rho': ('real', 0.02, 0.9),
+    'colony': ('int', 5, 100),
+    'variant': ('choice', ('as', 'mmas', 'acs')),
+    'candidates': ('choice', (None, 10, 20))
+}
+
+# runAcoTsp defaults, the first configuration of every tuning
+DEFAULTS = {'alpha': 1.0, 'beta': 1.0, 'rho': 0.5, 'colony': 50, 'variant': 'as', 'candidates': None}
+
+# Instance size buckets (fewest and most nodes), a configuration is tuned for each
+BUCKETS = ((20, 100), (101, 500), (501, 2000))
+
+"""
+    Tune - Find the runAcoTsp configuration giving the shortest paths within a time budget on a set of instances, by
+    iterated racing. Every iteration races configurations over blocks (an instance and a seed shared by all of them,
+    evaluated in parallel) and drops the ones significantly worse than the best (Friedman test and Conover post-hoc
+    comparisons) or, with method 'halving' or without SciPy, keeps the best ranked 1 / eta at every rung. The next
+    iteration samples new configurations around the survivors, closer and closer
+    @arg
+        {list} instances                -- (name, space, metric) of every instance
+        {float} time_budget {1.0}       -- Seconds of every run
+        {int} configurations {24}       -- Configurations raced at every iteration
+        {int} iterations {3}            -- Races, each one around the survivors of the previous one
+        {int} budget {None}             -- Maximum number of runs, configurations * first_test * iterations * 2 if None
+        {string} method {'race'}        -- 'race' (statistical tests) or 'halving' (successive halving)
+        {int} first_test {5}            -- Blocks run by every configuration before dropping any
+        {int} eta {2}                   -- Successive halving rate
+        {float} confidence {0.95}       -- Confidence of the statistical tests
+        {int} workers {None}            -- Number of worker processes, as many as CPUs if None
+        {int} seed {None}               -- Seed of the whole tuning, unseeded if None
+        {dict} parameters {PARAMETERS}  -- Tuned parameters and their domains
+
+    @return
+        {dict}                          -- Best 'config', ranked 'elites' with their mean rank and mean relative gap to
+                                           the best distance of every block, and the tuning settings
+"""
+def tune(instances, time_budget = 1.0, configurations = 24, iterations = 3, budget = None, method = 'race',
+         first_test = 5, eta = 2, confidence = 0.95, workers = None, seed = None, parameters = PARAMETERS):
+    if method not in ('race', 'halving'):
+        raise ValueError('Unknown tuning method: {}'.format(method))
+
+    rng = np.random.default_rng(seed)
+    budget = budget or configurations * first_test * iterations * 2
+    blocks = nextBlocks(instances, rng)
+
+    # Defaults (when every parameter has one) and random configurations first
+    configs = [{name: DEFAULTS[name] for name in parameters}] if set(parameters) <= set(DEFAULTS) else []
+    configs = configs + [sampleConfig(parameters, rng) for _ in range(configurations - len(configs))]
+
+    spent = 0
+    elites = []
+    # Workers load the compiled kernels first, or the first runs of each would spend their time budget on it
+    with ProcessPoolExecutor(workers, initializer = warmUp) as pool:
+        for iteration in range(iterations):
+            # Budget of the race, what is left shared by the iterations to come
+            share = (budget - spent) // (iterations - iteration)
+            ranked, spent_race = race(pool, configs, blocks, share, time_budget, method, first_test, eta, confidence)
+            spent += spent_race
+            elites = ranked[:max(configurations // 4, 1)]
+            msg('Iteration {}: {} runs, best {} (mean rank {:.2f}, gap {:.2%})'.format(
+                iteration + 1, spent_race, elites[0]['config'], elites[0]['mean_rank'], elites[0]['mean_gap']))
+
+            # Survivors and new configurations around them, picked by rank
+            if iteration + 1 < iterations:
+                spread = 0.5 ** (iteration + 1)
+                weights = np.arange(len(elites), 0, -1, dtype = float)
+                picks = rng.choice(len(elites), configurations - len(elites), p = weights / weights.sum())
+                configs = [elite['config'] for elite in elites]
+                configs = configs + [sampleConfig(parameters, rng, elites[pick]['config'], spread) for pick in picks]
+
+    return {
+        'config': elites[0]['config'],
+        'elites': elites,
+        'evaluations': spent,
+        'time_budget': time_budget,
+        'method': method if stats is not None else 'halving',
+        'instances': [name for name, _, _ in instances]
+    }
+
+"""
+    Race - Run configurations block after block, dropping the worse ones, until one is left or the budget is spent
+    @arg
+        {ProcessPoolExecutor} pool      -- Worker processes
+        {list} configs                  -- The configurations
+        {iterator} blocks               -- (instance, seed) blocks
+        {int} budget                    -- Maximum number of runs
+        {*} ...                         -- The tune settings
+
+    @return
+        {Tuple(list, int)}              -- Surviving configurations, best first, with 'config', 'mean_rank' and
+                                           'mean_gap', and the number of runs
+"""
+def race(pool, configs, blocks, budget, time_budget, method, first_test, eta, confidence):
+    alive = np.arange(len(configs))
+    results = np.empty((0, len(configs)))
+    spent = 0
+
+    while len(alive) > 1 or not len(results):
+        # The first test needs several blocks, then one block at a time
+        count = min(max(first_test - len(results), 1), (budget - spent) // len(alive))
+        if count < 1:
+            break
+
+        rows = np.full((count, len(configs)), np.nan)
+        rows[:, alive] = runBlocks(pool, [next(blocks) for _ in range(count)], [configs[i] for i in alive],
+                                   time_budget)
+        results = np.concatenate((results, rows))
+        spent += count * len(alive)
+
+        if len(results) >= first_test:
+            alive = alive[survivors(results[:, alive], method, first_test, eta, confidence)]
+
+    # Mean rank and relative gap to the best distance of every block, over the blocks every survivor ran
+    survived = results[:, alive]
+    ranks = rankRows(survived).mean(axis = 0)
+    gaps = (survived / survived.min(axis = 1, keepdims = True) - 1).mean(axis = 0)
+    order = np.lexsort((gaps, ranks))
+
+    return ([{'config': configs[alive[i]], 'mean_rank': float(ranks[i]), 'mean_gap': float(gaps[i])} for i in order],
+            spent)
+
+"""
+    Survivors - Get the configurations still in the race after a block
+    @arg
+        {numpy.ndarray} results         -- Distances, one row per block and one column per configuration
+        {string} method                 -- 'race' or 'halving'
+        {int} first_test                -- Blocks before the first test
+        {int} eta                       -- Successive halving rate
+        {float} confidence              -- Confidence of the statistical tests
+
+    @return
+        {numpy.ndarray}                 -- Indexes of the surviving columns
+"""
+def survivors(results, method, first_test, eta, confidence):
+    blocks, count = results.shape
+    ranks = rankRows(results)
+    sums = ranks.sum(axis = 0)
+
+    # Successive halving, the best ranked 1 / eta at every rung (first_test, first_test * eta, ... blocks)
+    if method == 'halving' or stats is None:
+        rung = blocks / first_test
+        if rung != eta ** round(math.log(rung, eta)):
+            return np.arange(count)
+        return np.sort(np.argsort(sums, kind = 'stable')[:math.ceil(count / eta)])
+
+    # Friedman test on the ranks (ties averaged), nothing to drop when all the ranks are the same
+    a = (ranks ** 2).sum()
+    c = blocks * count * (count + 1) ** 2 / 4
+    if a <= c:
+        return np.arange(count)
+    statistic = (count - 1) * ((sums ** 2).sum() - blocks * c) / (a - c)
+    if stats.chi2.sf(statistic, count - 1) >= 1 - confidence:
+        return np.arange(count)
+
+    # Conover post-hoc comparisons, drop the configurations whose rank sum is significantly over the best one
+    freedom = (blocks - 1) * (count - 1)
+    difference = stats.t.ppf(1 - (1 - confidence) / 2, freedom) * math.sqrt(
+        2 * (blocks * a - (sums ** 2).sum()) / freedom)
+    return np.flatnonzero(sums - sums.min() <= difference)
+
+"""
+    Rank rows - Rank the configurations of every block, 1 for the shortest distance, ties averaged when SciPy is there
+    @arg
+        {numpy.ndarray} results         -- Distances, one row per block
+
+    @return
+        {numpy.ndarray}                 -- Ranks, same shape
+"""
+def rankRows(results):
+    if stats is not None:
+        return stats.rankdata(results, axis = 1)
+
+    return results.argsort(axis = 1, kind = 'stable').argsort(axis = 1, kind = 'stable') + 1.0
+
+"""
+    Run blocks - Run every configuration on every block in the worker processes
+    @arg
+        {ProcessPoolExecutor} pool      -- Worker processes
+        {list} blocks                   -- (instance, seed) blocks
+        {list} configs                  -- The configurations
+        {float} time_budget             -- Seconds of every run
+
+    @return
+        {numpy.ndarray}                 -- Distances, one row per block and one column per configuration
+"""
+def runBlocks(pool, blocks, configs, time_budget):
+    futures = [
+        [pool.submit(evaluate, space, metric, config, time_budget, seed) for config in configs]
+        for (_, space, metric), seed in blocks
+    ]
+
+    return np.array([[future.result() for future in row] for row in futures])
+
+"""
+    Evaluate - Run a configuration on an instance in a worker process
+    @arg
+        {numpy.ndarray} space           -- The space
+        {string} metric                 -- TSPLIB rounding of the distances, exact if None
+        {dict} config                   -- runAcoTsp keyword arguments
+        {float} time_budget             -- Seconds of the run
+        {numpy.random.SeedSequence} seed    -- Seed of the run, the same for every configuration of a block
+
+    @return
+        {float}                         -- Minimum distance
+"""
+def evaluate(space, metric, config, time_budget, seed):
+    _, distance = runAcoTsp(space, iterations = None, metric = metric, time_budget = time_budget, seed = seed, **config)
+    return float(distance)
+
+"""
+    Next blocks - Get endless (instance, seed) blocks, every instance once in a random order before any repeats, with
+    a new seed each time
+    @arg
+        {list} instances                -- (name, space, metric) of every instance
+        {numpy.random.Generator} rng    -- Random numbers
+
+    @yield
+        {tuple}                         -- The instance and a numpy.random.SeedSequence
+"""
+def nextBlocks(instances, rng):
+    while True:
+        for index in rng.permutation(len(instances)):
+            yield (instances[index], spawnSeeds(rng, 1)[0])
+
+"""
+    Sample config - Draw a configuration uniformly, or around an elite one
+    @arg
+        {dict} parameters               -- Tuned parameters and their domains
+        {numpy.random.Generator} rng    -- Random numbers
+        {dict} elite {None}             -- Configuration to sample around, uniformly if None
+        {float} spread {1.0}            -- Standard deviation of numbers as a share of their range, and probability of
+                                           drawing a new option
+
+    @return
+        {dict}                          -- runAcoTsp keyword arguments, plain Python values
+"""
+def sampleConfig(parameters, rng, elite = None, spread = 1.0):
+    config = {}
+    for name, (kind, *domain) in parameters.items():
+        if kind == 'choice':
+            options = domain[0]
+            keep = elite is not None and rng.random() >= spread
+            config[name] = elite[name] if keep else options[rng.integers(len(options))]
+            continue
+
+        low, high = domain
+        if elite is None:
+            value = rng.uniform(low, high)
+        else:
+            value = min(max(rng.normal(elite[name], spread * (high - low)), low), high)
+        config[name] = int(round(value)) if kind == 'int' else round(float(value), 4)
+
+    return config
+
+"""
+    Size bucket - Get the name of the bucket of an instance size
+    @arg
+        {int} nodes                     -- Number of nodes
+        {list} buckets {BUCKETS}        -- (fewest, most) nodes of every bucket
+
+    @return
+        {string}                        -- 'fewest-most', the last bucket for larger instances
+"""
+def sizeBucket(nodes, buckets = BUCKETS):
+    for low, high in buckets:
+        if nodes <= high:
+            return '{}-{}'.format(low, high)
+
+    return '{}-{}'.format(*buckets[-1])
+
+"""
+    Tuned params - Get the tuned configuration for an instance size
+    @arg
+        {int} nodes                             -- Number of nodes
+        {string} file {'results/tuning.json'}   -- The saveTuning file
+
+    @return
+        {dict}                                  -- runAcoTsp keyword arguments, empty if not tuned
+"""
+def tunedParams(nodes, file = 'results/tuning.json'):
+    if not os.path.exists(file):
+        return {}
+
+    with open(file) as tuning:
+        return dict(json.load(tuning).get(sizeBucket(nodes), {}).get('config', {}))
+
+"""
+    Save tuning - Write the tuning of a bucket, keeping the other buckets of the file
+    @arg
+        {dict} tuning           -- The tune result
+        {string} bucket         -- The bucket name
+        {string} file           -- The JSON file
+
+    @export
+        {json}                  -- Tuned configuration by bucket
+"""
+def saveTuning(tuning, bucket, file):
+    tunings = {}
+    if os.path.exists(file):
+        with open(file) as saved:
+            tunings = json.load(saved)
+    tunings[bucket] = tuning
+
+    partial = '{}.partial'.format(file)
+    with open(partial, 'w') as out:
+        json.dump(tunings, out, indent = 2)
+    os.replace(partial, file)
+
+    msg('{} tuning saved to {}'.format(bucket, file))
+
+"""
+    Random instances - Get instances with nodes uniformly spread over a square
+    @arg
+        {int} low                       -- Fewest nodes
+        {int} high                      -- Most nodes
+        {int} count                     -- Number of instances
+        {numpy.random.Generator} rng    -- Random numbers
+
+    @return
+        {list}                          -- (name, space, metric) of every instance
+"""
+def randomInstances(low, high, count, rng):
+    instances = []
+    for nodes in rng.integers(low, high + 1, size = count):
+        space = rng.integers(1000000, size = (nodes, 2)).astype(float)
+        instances.append(('random{}-{}'.format(nodes, len(instances)), space, None))
+
+    return instances
+
+"""
+    Named instances - Get bundled or synthetic ('rand' and the nodes) instances
+    @arg
+        {list} tsps                     -- Instance names
+
+    @return
+        {list}                          -- (name, space, metric) of every instance
+"""
+def namedInstances(tsps):
+    instances = []
+    for tsp in tsps:
+        data = getTspData(instanceFile(tsp))
+        metric = data['edge_weight_type'] if data['edge_weight_type'] in ('EUC_2D', 'CEIL_2D') else None
+        instances.append((tsp, np.asarray(data['node_coord_section']), metric))
+
+    return instances
+
+"""
+    Show a console message
+    @arg
+        {string} str
+"""
+def msg(str):
+    print('[Tuning ACO_TSP] {}'.format(str))
+
+"""
+    Command line entry point, tune every size bucket on random instances, or on given instances grouped by bucket
+"""
+def main():
+    parser = argparse.ArgumentParser(description = 'ACO-TSP parameter tuning')
+    parser.add_argument('--buckets', nargs = '+', default = [sizeBucket(high) for _, high in BUCKETS])
+    parser.add_argument('--tsps', nargs = '+', help = 'Instances to tune on (in /data, or rand<nodes>), by bucket')
+    parser.add_argument('--instances', type = int, default = 8, help = 'Random instances per bucket')
+    parser.add_argument('--time-budget', type = float, default = 1.0)
+    parser.add_argument('--configurations', type = int, default = 24)
+    parser.add_argument('--iterations', type = int, default = 3)
+    parser.add_argument('--budget', type = int, default = None)
+    parser.add_argument('--method', choices = ('race', 'halving'), default = 'race')
+    parser.add_argument('--first-test', type = int, default = 5)
+    parser.add_argument('--confidence', type = float, default = 0.95)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--out', default = 'results/tuning.json')
+    args = parser.parse_args()
+
+    # Instances of every bucket
+    rng = np.random.default_rng(args.seed)
+    if args.tsps:
+        buckets = {}
+        for instance in namedInstances(args.tsps):
+            buckets.setdefault(sizeBucket(instance[1].shape[0]), []).append(instance)
+    else:
+        buckets = {}
+        for bucket in args.buckets:
+            low, high = map(int, bucket.split('-'))
+            buckets[bucket] = randomInstances(low, high, args.instances, rng)
+
+    for bucket, instances in buckets.items():
+        msg('Tuning {} on {} instances'.format(bucket, len(instances)))
+        tuning = tune(instances, args.time_budget, args.configurations, args.iterations, args.budget, args.method,
+                      args.first_test, confidence = args.confidence, workers = args.workers, seed = rng)
+        saveTuning(tuning, bucket, args.out)
+
+if __name__ == '__main__':
+    main()